@@ -2,9 +2,11 @@ from dataclasses import dataclass
 from enum import Enum
 from functools import partial
 from re import Pattern
+from tornado.ioloop import IOLoop
 from tornado.routing import URLSpec
+from tornado.web import stream_request_body
 from types import MethodType
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List
 
 from .api import PartialURLSpec
 from ..context import ApiContext
@@ -12,6 +14,7 @@ from ..handlers import HttpApiHandler, ApiHandlerMixin, ApiResponse
 
 from ...auth.data import Activity
 from ...data.sql.columns import utcnow_tz
+from ...http.body import BodySink, BufferedBody, STREAMED_BODY_MAX_SIZE
 from ...http.handlers import SessionHandlerMixin
 from ...miniapp.miniapp import MiniappContext, MiniappModule, Miniapp
 from ...typeinfo import MethodInfo, TypeInfo
@@ -24,26 +27,32 @@ class RestVerb(Enum):
     PUT = "PUT"
 
 
+BodyOpener = Callable[..., BodySink|ApiResponse]
+
+
 @dataclass
 class RestMethodInternals:
     verb: RestVerb
     partial_urlspec: PartialURLSpec
+    body: BodyOpener|None = None
+    head: bool = False
 
 
 class RestApiHandler(ApiHandlerMixin, HttpApiHandler):
     pass
 
 
-def get(pattern: str|Pattern, kwargs: Dict[str, Any]|None = None, name: str|None = None):
+def get(pattern: str|Pattern, kwargs: Dict[str, Any]|None = None, name: str|None = None, head: bool = False):
+    """With head, the handler also answers HEAD requests and must skip the body itself"""
     def decorator(fn):
-        internals = RestMethodInternals(RestVerb.GET, PartialURLSpec(pattern, kwargs, name))
+        internals = RestMethodInternals(RestVerb.GET, PartialURLSpec(pattern, kwargs, name), head=head)
         setattr(fn, "__rest__", internals)
         return fn
     return decorator
 
-def post(pattern: str|Pattern, kwargs: Dict[str, Any]|None = None, name: str|None = None):
+def post(pattern: str|Pattern, kwargs: Dict[str, Any]|None = None, name: str|None = None, body: BodyOpener|None = None):
     def decorator(fn):
-        internals = RestMethodInternals(RestVerb.POST, PartialURLSpec(pattern, kwargs, name))
+        internals = RestMethodInternals(RestVerb.POST, PartialURLSpec(pattern, kwargs, name), body)
         setattr(fn, "__rest__", internals)
         return fn
     return decorator
@@ -55,9 +64,9 @@ def delete(pattern: str|Pattern, kwargs: Dict[str, Any]|None = None, name: str|N
         return fn
     return decorator
 
-def put(pattern: str|Pattern, kwargs: Dict[str, Any]|None = None, name: str|None = None):
+def put(pattern: str|Pattern, kwargs: Dict[str, Any]|None = None, name: str|None = None, body: BodyOpener|None = None):
     def decorator(fn):
-        internals = RestMethodInternals(RestVerb.PUT, PartialURLSpec(pattern, kwargs, name))
+        internals = RestMethodInternals(RestVerb.PUT, PartialURLSpec(pattern, kwargs, name), body)
         setattr(fn, "__rest__", internals)
         return fn
     return decorator
@@ -65,6 +74,7 @@ def put(pattern: str|Pattern, kwargs: Dict[str, Any]|None = None, name: str|None
 
 class RestMiniappModule(MiniappModule, RestApiHandler):
     _context: ApiContext|None = None
+    _body_sink: BodySink|None = None
 
     def __init__(self, miniapp: Miniapp, application, request, **kwargs):
         super(MiniappModule, self).__init__(application, request, **kwargs)
@@ -132,9 +142,38 @@ class RestMiniappModule(MiniappModule, RestApiHandler):
             method_info.param_names,
             method_info.param_defaults,
         )
-        if method_info.is_async:
-            pass
-        if method_info.is_context_manager:
+        info: RestMethodInternals = getattr(method, "__rest__")
+        if info.body is not None:
+            async def wrapped_handler(self: RestMiniappModule, *args):
+                sink = self._body_sink
+                assert sink is not None, "Request body was not streamed"
+                await IOLoop.current().run_in_executor(None, sink.finish)
+                self._body_sink = None
+                if method_info.is_async:
+                    result = await method(self, *args, sink)
+                else:
+                    result = method(self, *args, sink)
+                if isinstance(result, ApiResponse):
+                    result.assign(self)
+            return wrapped_handler
+        if method_info.is_async and method_info.is_context_manager:
+            async def wrapped_handler(self: RestApiHandler, *args):
+                if not args:
+                    args = get_query_args(self)
+                with self:  # type: ignore
+                    result = await method(self, *args)
+                    if isinstance(result, ApiResponse):
+                        result.assign(self)
+            return wrapped_handler
+        elif method_info.is_async:
+            async def wrapped_handler(self: RestApiHandler, *args):
+                if not args:
+                    args = get_query_args(self)
+                result = await method(self, *args)
+                if isinstance(result, ApiResponse):
+                    result.assign(self)
+            return wrapped_handler
+        elif method_info.is_context_manager:
             def wrapped_handler(self: RestApiHandler, *args):
                 if not args:
                     args = get_query_args(self)
@@ -152,20 +191,82 @@ class RestMiniappModule(MiniappModule, RestApiHandler):
                     result.assign(self)
             return wrapped_handler
 
+    @staticmethod
+    def __buffered_body_handler(handler: Callable):
+        def wrapped_handler(self: RestMiniappModule, *args):
+            sink, self._body_sink = self._body_sink, None
+            if sink is not None:
+                sink.finish()
+            return handler(self, *args)
+        return wrapped_handler
+
+    @classmethod
+    def __generate_streamed_body(cls, openers: Dict[str, BodyOpener]):
+        def prepare(self: RestMiniappModule):
+            opener = openers.get(self.request.method or "")
+            if opener is None:
+                self._body_sink = BufferedBody(self.request)
+                return
+            self.request.connection.set_max_body_size(STREAMED_BODY_MAX_SIZE)  # type: ignore
+            result = opener(self, *self.path_args)
+            if isinstance(result, ApiResponse):
+                result.assign(self)
+                self.finish()
+                return
+            self._body_sink = result
+
+        async def data_received(self: RestMiniappModule, chunk: bytes):
+            if self._body_sink is not None:
+                await IOLoop.current().run_in_executor(None, self._body_sink.write, chunk)
+
+        def abort_body(self: RestMiniappModule):
+            sink, self._body_sink = self._body_sink, None
+            if sink is not None:
+                sink.abort()
+
+        def on_connection_close(self: RestMiniappModule):
+            abort_body(self)
+            cls.on_connection_close(self)
+
+        def on_finish(self: RestMiniappModule):
+            abort_body(self)
+            cls.on_finish(self)
+
+        return {
+            "prepare": prepare,
+            "data_received": data_received,
+            "on_connection_close": on_connection_close,
+            "on_finish": on_finish,
+        }
+
     @classmethod
     def __generate_handler(cls, miniapp: Miniapp, methods: List[MethodType]):
         attrs = {}
+        body_openers: Dict[str, BodyOpener] = {}
         for method in methods:
             wrapped_handler = cls.__generate_handler_method(miniapp, method)
             info: RestMethodInternals = getattr(method, "__rest__")
             verb = info.verb.value.lower()
             assert verb not in attrs, "Duplicate verbs for the same URL"
             attrs[verb] = wrapped_handler
+            if info.head:
+                assert "head" not in attrs, "Duplicate verbs for the same URL"
+                attrs["head"] = wrapped_handler
+            if info.body is not None:
+                body_openers[info.verb.value] = info.body
+        if body_openers:
+            for verb in attrs:
+                if verb.upper() not in body_openers:
+                    attrs[verb] = cls.__buffered_body_handler(attrs[verb])
+            attrs.update(cls.__generate_streamed_body(body_openers))
         class_name = methods[0].__name__.capitalize() + "Handler"
         def ctor(self, application, request):
             super(cls, self).__init__(miniapp, application, request)  # type: ignore
         attrs["__init__"] = ctor
-        return type(class_name, (cls,), attrs)
+        handler_class = type(class_name, (cls,), attrs)
+        if body_openers:
+            handler_class = stream_request_body(handler_class)
+        return handler_class
     
     @classmethod
     def __register_handler(cls, miniapp: Miniapp, context: MiniappContext, methods: List[MethodType]):
@@ -1,6 +1,12 @@
-from sqlalchemy.orm import Session
-from sqlalchemy.sql import Select, text as sql_text
-from typing import Callable, Iterable, Generic, List, Tuple, TypeVar
+import base64
+from datetime import date, datetime
+from enum import Enum
+import json
+from sqlalchemy import and_, func, or_, tuple_
+from sqlalchemy.orm import InstrumentedAttribute, Session
+from sqlalchemy.sql import ColumnElement, Select
+from typing import Any, Callable, Iterable, Generic, List, Tuple, TypeVar
+from uuid import UUID
 
 
 ItemType = TypeVar("ItemType")
@@ -8,41 +14,57 @@ ItemType = TypeVar("ItemType")
 
 class PagesResult(Generic[ItemType]):
 	"""Result of a pagination query."""
-	total: int
 	page: int
 	page_size: int
 	items: Iterable[ItemType]
+	next_cursor: str|None
 
 	@classmethod
 	def empty(cls) -> "PagesResult[ItemType]":
 		return cls(0, 0, 0, [])
 
+	@property
+	def total(self) -> int:
+		# counted only when asked for, a cursor page can be served without it
+		if callable(self._total):
+			self._total = self._total()
+		return self._total
+
 	@property
 	def max_page(self) -> int:
 		return self.total // self.page_size
-	
+
 	@property
 	def has_previous(self) -> bool:
+		if self._has_previous is not None:
+			return self._has_previous
 		return self.page > 0
 
 	@property
 	def has_next(self) -> bool:
+		if self.next_cursor is not None:
+			return True
+		if self._has_previous is not None:
+			return False
 		return self.page < self.max_page - 1
 
-	def __init__(self, total: int, page: int, page_size: int, items: Iterable[ItemType]):
-		self.total = total
+	def __init__(self, total: int|Callable[[], int], page: int, page_size: int, items: Iterable[ItemType], next_cursor: str|None = None, has_previous: bool|None = None):
+		self._total = total
 		self.page = page
 		self.page_size = page_size
 		self.items = items
+		self.next_cursor = next_cursor
+		self._has_previous = has_previous
 
 
 class PagesInput:
-	"""Input for a pagination query."""
+	"""Input for a pagination query. Pass a `cursor` (empty for the first page) to page by the sort keys instead of offsets."""
 	DEFAULT_PAGE_SIZE = 20
 
 	sort: List[str]|None
 	page: int|None
 	page_size: int|None
+	cursor: str|None
 
 	def validate(self):
 		if self.real_page < 0:
@@ -62,26 +84,111 @@ class PagesInput:
 	def offset(self) -> int:
 		return self.real_page * self.real_size
 
-	def of(self, session: Session, statement: Select[Tuple[ItemType]], filter: Callable[[ItemType], bool]|None = None) -> PagesResult[ItemType]:
+	@property
+	def use_cursor(self) -> bool:
+		return self.cursor is not None
+
+	def sort_keys(self, column_type: Any) -> List[Tuple[InstrumentedAttribute, bool]]:
+		"""Returns the sort attributes and whether they are descending"""
+		keys = []
+		for key in self.sort or []:
+			if key.startswith("-"):
+				keys.append((getattr(column_type, key[1:]), True))
+			elif key.startswith("+"):
+				keys.append((getattr(column_type, key[1:]), False))
+			else:
+				keys.append((getattr(column_type, key), False))
+		return keys
+
+	def of(self, session: Session, statement: Select[Tuple[ItemType]], filter: Callable[[ItemType], bool]|ColumnElement[bool]|None = None) -> PagesResult[ItemType]:
 		assert len(statement.column_descriptions) == 1, "Query must return a single column"
 		self.validate()
 		column_type = statement.column_descriptions[0]["type"]
-		count_statement = statement.with_only_columns(sql_text("count(*)"))
-		total = session.execute(count_statement).scalar() or 0
-		if self.sort:
-			clauses = []
-			for key in self.sort:
-				if key.startswith("-"):
-					clause = getattr(column_type, key[1:]).desc()
-				elif key.startswith("+"):
-					clause = getattr(column_type, key[1:]).asc()
-				else:
-					clause = getattr(column_type, key).asc()
-				clauses.append(clause)
-			statement = statement.order_by(*clauses)
+		if isinstance(filter, ColumnElement):
+			statement = statement.where(filter)
+			filter = None
+		# keeping the entity in FROM lets the access filter apply to the count as well
+		count_statement = statement.with_only_columns(func.count(), maintain_column_froms=True).order_by(None)
+		def count():
+			return session.execute(count_statement).scalar() or 0
+		if self.use_cursor:
+			return self.__of_cursor(session, statement, column_type, count, filter)
+		statement = statement.order_by(*[attr.desc() if descending else attr.asc() for attr, descending in self.sort_keys(column_type)])
 		statement = statement.offset(self.offset).limit(self.real_size)
 		items = session.scalars(statement).all()
 		if filter is not None:
 			items = [item for item in items if filter(item)]
 			items = [item for item in items if item is not None]
-		return PagesResult(total, self.real_page, self.real_size, items)
+		return PagesResult(count, self.real_page, self.real_size, items)
+
+	def __of_cursor(self, session: Session, statement: Select[Tuple[ItemType]], column_type: Any, count: Callable[[], int], filter: Callable[[ItemType], bool]|None):
+		keys = self.sort_keys(column_type)
+		# the primary key breaks ties, so that every row has a distinct position
+		tie_descending = keys[-1][1] if keys else False
+		mapper = column_type.__mapper__
+		for column in mapper.primary_key:
+			attr = getattr(column_type, mapper.get_property_by_column(column).key)
+			if not any(attr is key for key, _ in keys):
+				keys.append((attr, tie_descending))
+		statement = statement.order_by(*[attr.desc() if descending else attr.asc() for attr, descending in keys])
+		if self.cursor:
+			statement = statement.where(self.__seek(keys, self.__decode(keys, self.cursor)))
+		statement = statement.limit(self.real_size + 1)
+		items = list(session.scalars(statement).all())
+		next_cursor = None
+		if len(items) > self.real_size:
+			items = items[:self.real_size]
+			next_cursor = self.__encode(keys, [getattr(items[-1], attr.key) for attr, _ in keys])
+		if filter is not None:
+			items = [item for item in items if filter(item)]
+		return PagesResult(count, 0, self.real_size, items, next_cursor, has_previous=bool(self.cursor))
+
+	def __seek(self, keys: List[Tuple[InstrumentedAttribute, bool]], values: List[Any]) -> ColumnElement[bool]:
+		def after(attr: InstrumentedAttribute, descending: bool, value: Any):
+			return attr < value if descending else attr > value
+		directions = {descending for _, descending in keys}
+		if len(directions) == 1:
+			# a row value comparison can use the index over the sort keys
+			return after(tuple_(*[attr for attr, _ in keys]), directions.pop(), tuple_(*values))  # type: ignore
+		clauses = []
+		for i, (attr, descending) in enumerate(keys):
+			equal = [keys[j][0] == values[j] for j in range(i)]
+			clauses.append(and_(*equal, after(attr, descending, values[i])))
+		return or_(*clauses)
+
+	def __signature(self, keys: List[Tuple[InstrumentedAttribute, bool]]):
+		return ",".join(("-" if descending else "+") + attr.key for attr, descending in keys)
+
+	def __encode(self, keys: List[Tuple[InstrumentedAttribute, bool]], values: List[Any]):
+		def dump(value: Any):
+			if isinstance(value, (datetime, date)):
+				return value.isoformat()
+			if isinstance(value, UUID):
+				return value.hex
+			if isinstance(value, Enum):
+				return value.value
+			return value
+		data = json.dumps([self.__signature(keys), [dump(value) for value in values]]).encode("utf-8")
+		return base64.urlsafe_b64encode(data).decode("ascii")
+
+	def __decode(self, keys: List[Tuple[InstrumentedAttribute, bool]], cursor: str):
+		def load(attr: InstrumentedAttribute, value: Any):
+			python_type = attr.type.python_type
+			if value is None:
+				return None
+			if issubclass(python_type, datetime):
+				return datetime.fromisoformat(value)
+			if issubclass(python_type, date):
+				return date.fromisoformat(value)
+			if issubclass(python_type, UUID):
+				return UUID(value)
+			if issubclass(python_type, Enum):
+				return python_type(value)
+			return value
+		try:
+			signature, values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+			if signature != self.__signature(keys) or len(values) != len(keys):
+				raise ValueError()
+			return [load(attr, value) for (attr, _), value in zip(keys, values)]
+		except (ValueError, TypeError):
+			raise ValueError("Invalid cursor")
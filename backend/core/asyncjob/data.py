@@ -14,3 +14,7 @@ class JobPromise(Model):
     valid_for: Mapped[timedelta] = mapped_column(Interval)
     completed_at_utc: Mapped[datetime] = mapped_column(DateTime, default=None, nullable=True)
     error: Mapped[str] = mapped_column(String(1024), default=None, nullable=True)
+    priority: Mapped[int] = mapped_column(Integer, default=0)
+    claimed_by: Mapped[str] = mapped_column(String(64), default=None, nullable=True)
+    lease_expires_at_utc: Mapped[datetime] = mapped_column(DateTime, default=None, nullable=True)
+    heartbeat_at_utc: Mapped[datetime] = mapped_column(DateTime, default=None, nullable=True)
@@ -1,14 +1,18 @@
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
 import logging
-from sqlalchemy import not_, select
+from sqlalchemy import not_, or_, select, update
 from sqlalchemy.orm import object_session
-from threading import current_thread, Thread
-from typing import Any, Dict, Type
+from threading import Lock
+from typing import Any, Dict, List, Type
 
 from .action import Action
 from .context import AsyncJobContext, AsyncJobRuntimeContext
 from .data import JobPromise
 from .handlers import JobHandlers, AsyncJobHandler
+from .process import ProcessUpdates, _init_worker, _run_job
+from .queue import JobQueue, QueuedJob
+from .settings import AsyncJobSettings, PoolKind
 from .state import State
 
 from ..cronjob.schedule import Schedule
@@ -19,41 +23,57 @@ logger = logging.getLogger(__name__)
 
 class AsyncJobs:
     context: AsyncJobContext
+    settings: AsyncJobSettings
     states: Dict[int, State]
-    threads: Dict[int, Thread]
+    # jobs are started on the loop and finalized on worker threads, the states are only touched under this lock
+    _states_lock: Lock
+    queue: JobQueue
     handlers: JobHandlers
+    _executors: Dict[PoolKind, Executor]|None = None
+    _executors_lock: Lock
+    _finalizer: ThreadPoolExecutor|None = None
+    _process_updates: ProcessUpdates|None = None
 
-    def __init__(self, context: AsyncJobContext):
+    def __init__(self, context: AsyncJobContext, settings: AsyncJobSettings|None = None):
         self.context = context
+        self.settings = settings or AsyncJobSettings()
         self.states = {}
-        self.threads = {}
+        self._states_lock = Lock()
+        self.queue = JobQueue(self.settings)
         self.handlers = JobHandlers()
+        self._executors_lock = Lock()
 
     def start(self):
-        self.context.cron.schedule(self.__resume_jobs, Schedule.hourly())
+        self.__start_executor()
+        self.context.cron.schedule(self.__claim_jobs, Schedule.minutely())
+        self.context.cron.schedule(self.__heartbeat, Schedule.minutely())
         self.context.cron.schedule(self.__delete_expired_jobs, Schedule.daily())
-        self.__resume_jobs()
+        self.__claim_jobs()
 
-    # TODO limit number of jobs running at once
-    def schedule(self, issuer: str, type: str, payload: dict|Any|None, valid_for: timedelta|None = None) -> int:
+    def schedule(self, issuer: str, type: str, payload: dict|Any|None, valid_for: timedelta|None = None, priority: int|None = None) -> int:
         assert ensure_str_fit("issuer", issuer, JobPromise.issuer, should_raise=False)
         ensure_str_fit("type", type, JobPromise.type)
+        handler = self.__resolve_handler_type(issuer, type)
         if payload is None:
             payload = {}
         elif not isinstance(payload, dict):
             payload = {k: getattr(payload, k) for k in payload.__annotations__}
-            handler = self.__resolve_handler_type(issuer, type)
             if handler is not None:
                 handler.verify_payload(payload)
         if valid_for is None:
             valid_for = timedelta()
+        if priority is None:
+            priority = handler.PRIORITY if handler is not None else 0
         with self.context.database.make_session() as session:
             promise = JobPromise()
             promise.issuer = issuer
             promise.type = type
             promise.payload = payload
             promise.valid_for = valid_for
+            promise.priority = priority
             promise.created_at_utc = utcnow_tz()
+            promise.claimed_by = self.settings.node_id
+            promise.lease_expires_at_utc = promise.created_at_utc + self.settings.lease
             session.add(promise)
             session.commit()
             self.__start_job(promise)
@@ -63,6 +83,10 @@ class AsyncJobs:
         state = self.states.get(job.id)
         if state is not None:
             state.cancel()
+            if self.queue.remove(job.id):
+                self.__forget_state(job.id)
+            elif self._process_updates is not None:
+                self._process_updates.cancel(job.id)
         handler_type = self.__resolve_handler_type(job.issuer, job.type)
         if handler_type is not None:
             try:
@@ -83,74 +107,204 @@ class AsyncJobs:
     def __resolve_handler_type(self, issuer: str, type: str) -> Type[AsyncJobHandler]|None:
         return self.handlers.resolve(issuer, type)
 
-    def __job_proc(self, handler_type: Type[AsyncJobHandler], action: Action, job_id: int, payload: dict):
-        state = State()
-        self.states[job_id] = state
-        self.threads[job_id] = current_thread()
+    def __start_executor(self):
+        if self._executors is not None:
+            return
+        self._executors = {}
+        self.__dispatch()
+
+    def __executor(self, pool: PoolKind):
+        assert self._executors is not None
+        with self._executors_lock:
+            executor = self._executors.get(pool)
+            if executor is None:
+                executor = self.__make_executor(pool)
+                self._executors[pool] = executor
+            return executor
+
+    def __make_executor(self, pool: PoolKind) -> Executor:
+        if pool == PoolKind.PROCESS:
+            self._process_updates = ProcessUpdates(self.states.get)
+            self._process_updates.start()
+            self._finalizer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="asyncjob-finalize")
+            return ProcessPoolExecutor(
+                max_workers=self.settings.capacity(pool),
+                mp_context=self._process_updates.mp_context,
+                initializer=_init_worker,
+                initargs=self._process_updates.initializer_args(self.context),
+            )
+        return ThreadPoolExecutor(max_workers=self.settings.capacity(pool), thread_name_prefix="asyncjob")
+
+    def __dispatch(self):
+        if self._executors is None:
+            return
+        for job in self.queue.pop_ready():
+            job.state.set_started()
+            logger.debug("Starting job #%d (waited %s)", job.id, job.state.wait_time)
+            executor = self.__executor(job.pool)
+            if isinstance(executor, ProcessPoolExecutor):
+                future = executor.submit(_run_job, job.handler_type, job.action, job.id, job.payload)
+                future.add_done_callback(lambda f, job=job: self.__process_job_done(job, f))
+            else:
+                executor.submit(self.__job_proc, job)
+
+    def __job_proc(self, job: QueuedJob):
+        state = job.state
         try:
-            logger.debug("Starting job #%d", job_id)
-            context = AsyncJobRuntimeContext(self.context, state, job_id, payload)
-            handler = handler_type(context)
-            handler.trigger(action)
+            context = AsyncJobRuntimeContext(self.context, state, job.id, job.payload)
+            handler = job.handler_type(context)
+            handler.trigger(job.action)
         except Exception as e:
-            logger.error("Job #%d failed", job_id)
+            logger.error("Job #%d failed", job.id)
             error_str = str(e)
             state.set_error(error_str)
         finally:
+            self.__finalize_job(job)
+
+    def __process_job_done(self, job: QueuedJob, future: Future):
+        assert self._finalizer is not None
+        self._finalizer.submit(self.__finalize_process_job, job, future)
+
+    def __finalize_process_job(self, job: QueuedJob, future: Future):
+        state = job.state
+        try:
+            error = future.result()
+            if error and not state.error:
+                state.set_error(error)
+        except Exception as e:
+            logger.error("Job #%d failed", job.id)
+            state.set_error(str(e))
+        finally:
+            self.__finalize_job(job)
+
+    def __finalize_job(self, job: QueuedJob):
+        job_id, state = job.id, job.state
+        try:
             with self.context.database.make_session() as session:
                 promise = session.get(JobPromise, job_id)
                 if promise is None:
                     logger.warning("Complete job #%d not found", job_id)
                 elif state.error:
                     promise.error = state.error
+                    promise.lease_expires_at_utc = None
+                    session.commit()
                     state.complete()
                 elif promise.valid_for.total_seconds() > 0:
                     promise.completed_at_utc = utcnow_tz()
+                    promise.lease_expires_at_utc = None
+                    session.commit()
                     state.complete()
                 else:
                     try:
                         logger.debug("Deleting job #%d", job_id)
-                        context = AsyncJobRuntimeContext(self.context, state, job_id, payload)
-                        handler = handler_type(context)
+                        context = AsyncJobRuntimeContext(self.context, state, job_id, job.payload)
+                        handler = job.handler_type(context)
                         handler.delete()
                     except Exception as e:
                         logger.error("Job #%d failed to delete", job_id)
                     session.delete(promise)
                     session.commit()
                     state.complete()
-            del self.threads[job_id]
-            del self.states[job_id]
+        finally:
+            self.queue.done(job)
+            self.__forget_state(job_id)
+            if self._process_updates is not None:
+                self._process_updates.forget(job_id)
+            self.__dispatch()
+
+    def __state_ids(self):
+        with self._states_lock:
+            return list(self.states)
+
+    def __forget_state(self, job_id: int):
+        with self._states_lock:
+            self.states.pop(job_id, None)
 
     def __start_job(self, promise: JobPromise):
         assert promise.id is not None, "Promise must be saved to database before starting"
-        if promise.id in self.threads or promise.completed_at_utc:
-            if promise.completed_at_utc:
-                logger.warning("Job #%d already completed", promise.id)
-            else:
-                logger.warning("Job #%d already running", promise.id)
-            return
         handler_type = self.__resolve_handler_type(promise.issuer, promise.type)
-        if handler_type is None:
-            logger.warning("No handler for job #%d", promise.id)
-            return
-        Thread(
-            target=self.__job_proc,
-            args=(
+        with self._states_lock:
+            if promise.id in self.states or promise.completed_at_utc:
+                if promise.completed_at_utc:
+                    logger.warning("Job #%d already completed", promise.id)
+                else:
+                    logger.warning("Job #%d already running", promise.id)
+                return
+            if handler_type is None:
+                logger.warning("No handler for job #%d", promise.id)
+                return
+            job = QueuedJob(
+                promise.id,
+                promise.issuer,
+                promise.type,
                 handler_type,
                 Action.RUN,
-                promise.id,
                 promise.payload,
-            ),
-        ).start()
+                promise.priority or 0,
+                self.settings.pool_for(handler_type.CPU_BOUND),
+                State(self.context.cron.loop),
+            )
+            self.states[job.id] = job.state
+        self.queue.push(job)
+        self.__dispatch()
+
+    def __claim_jobs(self):
+        skipped: List[int] = []
+        while True:
+            limit = self.settings.claim_batch - len(self.queue)
+            if limit <= 0:
+                return
+            selected = self.__claim_batch(limit, skipped)
+            if selected < limit:
+                return
 
-    def __resume_jobs(self):
+    def __claim_batch(self, limit: int, skipped: List[int]):
+        now = utcnow_tz()
         with self.context.database.make_session() as session:
             statement = select(JobPromise) \
                 .where(JobPromise.completed_at_utc == None) \
-                .where(not_(JobPromise.id.in_(self.threads)))
+                .where(JobPromise.error == None) \
+                .where(or_(
+                    JobPromise.claimed_by == None,
+                    JobPromise.claimed_by == self.settings.node_id,
+                    JobPromise.lease_expires_at_utc < now,
+                )) \
+                .where(not_(JobPromise.id.in_(self.__state_ids() + skipped))) \
+                .order_by(JobPromise.priority.desc(), JobPromise.id) \
+                .limit(limit) \
+                .with_for_update(skip_locked=True)
             promises = session.scalars(statement).all()
+            claimed: List[JobPromise] = []
             for promise in promises:
+                if self.__resolve_handler_type(promise.issuer, promise.type) is None:
+                    # leave it for a node that has the handler
+                    skipped.append(promise.id)
+                    continue
+                if promise.claimed_by not in (None, self.settings.node_id):
+                    logger.info("Taking over job #%d from %s", promise.id, promise.claimed_by)
+                promise.claimed_by = self.settings.node_id
+                promise.lease_expires_at_utc = now + self.settings.lease
+                promise.heartbeat_at_utc = now
+                claimed.append(promise)
+            session.commit()
+            for promise in claimed:
                 self.__start_job(promise)
+            return len(promises)
+
+    def __heartbeat(self):
+        job_ids = self.__state_ids()
+        if not job_ids:
+            return
+        now = utcnow_tz()
+        with self.context.database.make_session() as session:
+            statement = update(JobPromise) \
+                .where(JobPromise.id.in_(job_ids)) \
+                .where(JobPromise.claimed_by == self.settings.node_id) \
+                .values(heartbeat_at_utc=now, lease_expires_at_utc=now + self.settings.lease)
+            result = session.execute(statement)
+            session.commit()
+        if result.rowcount < len(job_ids):
+            logger.warning("Lost the lease on %d job(s)", len(job_ids) - result.rowcount)
 
     def __delete_expired_jobs(self):
         with self.context.database.make_session() as session:
@@ -169,3 +323,4 @@ class AsyncJobs:
                     except Exception as e:
                         logger.error("Job #%d failed to delete", job.id, exc_info=e)
                 session.delete(job)
+            session.commit()
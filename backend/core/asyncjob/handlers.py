@@ -14,6 +14,8 @@ MISSING_VALUE = object()
 class AsyncJobHandler(ABC):
     TYPE: str
     PAYLOAD_SCHEMA: List[str]|Type|None = None
+    PRIORITY: int = 0
+    CPU_BOUND: bool = False
     context: AsyncJobRuntimeContext
 
     def __init__(self, context: AsyncJobRuntimeContext):
@@ -0,0 +1,124 @@
+import logging
+import multiprocessing
+from multiprocessing.queues import Queue
+from threading import Thread
+from typing import Any, Callable, MutableMapping, Type
+
+from .action import Action
+from .context import AsyncJobContext, AsyncJobRuntimeContext
+from .handlers import AsyncJobHandler
+from .state import JobCancelledError, State
+
+logger = logging.getLogger(__name__)
+
+UPDATE_PROGRESS = "progress"
+UPDATE_COMPLETE = "complete"
+UPDATE_ERROR = "error"
+
+_worker_context: AsyncJobContext|None = None
+_worker_updates: Queue|None = None
+_worker_cancelled: MutableMapping[int, bool]|None = None
+
+
+class WorkerState(State):
+    """State living in a worker process, forwards all updates to the parent process"""
+
+    job_id: int
+
+    def __init__(self, job_id: int):
+        super().__init__()
+        self.job_id = job_id
+
+    def __send(self, kind: str, value: Any):
+        assert _worker_updates is not None
+        _worker_updates.put((self.job_id, kind, value))
+
+    def set_progress(self, progress: float):
+        assert 0.0 <= progress and progress <= 1.0
+        if self.completed:
+            return
+        if _worker_cancelled is not None and _worker_cancelled.get(self.job_id):
+            self.cancelled = True
+            raise JobCancelledError()
+        self.progress = progress
+        self.__send(UPDATE_PROGRESS, progress)
+
+    def complete(self):
+        self.completed = True
+        self.__send(UPDATE_COMPLETE, None)
+
+    def set_error(self, error: str):
+        self.error = error
+        self.__send(UPDATE_ERROR, error)
+
+
+def _init_worker(context: AsyncJobContext, updates: Queue, cancelled: MutableMapping[int, bool]):
+    global _worker_context, _worker_updates, _worker_cancelled
+    _worker_context = context
+    _worker_updates = updates
+    _worker_cancelled = cancelled
+    # connections inherited from the parent process must not be reused
+    context.database.engine.dispose(close=False)
+    context.blobs.after_fork()
+
+
+def _run_job(handler_type: Type[AsyncJobHandler], action: Action, job_id: int, payload: dict):
+    assert _worker_context is not None, "Worker process not initialized"
+    state = WorkerState(job_id)
+    try:
+        context = AsyncJobRuntimeContext(_worker_context, state, job_id, payload)
+        handler = handler_type(context)
+        handler.trigger(action)
+    except Exception as e:
+        logger.error("Job #%d failed in worker process", job_id, exc_info=e)
+        state.set_error(str(e))
+    return state.error
+
+
+class ProcessUpdates:
+    """Relays state updates from worker processes to the states in this process"""
+
+    mp_context: Any
+    updates: Queue
+    cancelled: MutableMapping[int, bool]
+    resolve_state: Callable[[int], State|None]
+    _thread: Thread|None = None
+
+    def __init__(self, resolve_state: Callable[[int], State|None]):
+        self.mp_context = multiprocessing.get_context("fork")
+        self.updates = self.mp_context.Queue()
+        self.cancelled = self.mp_context.Manager().dict()
+        self.resolve_state = resolve_state
+
+    def initializer_args(self, context: AsyncJobContext):
+        return (context, self.updates, self.cancelled)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = Thread(target=self.__pump, name="asyncjob-updates", daemon=True)
+            self._thread.start()
+
+    def cancel(self, job_id: int):
+        self.cancelled[job_id] = True
+
+    def forget(self, job_id: int):
+        self.cancelled.pop(job_id, None)
+
+    def __pump(self):
+        while True:
+            job_id, kind, value = self.updates.get()
+            state = self.resolve_state(job_id)
+            if state is None:
+                continue
+            try:
+                if kind == UPDATE_PROGRESS:
+                    state.set_progress(value)
+                elif kind == UPDATE_COMPLETE:
+                    state.complete()
+                elif kind == UPDATE_ERROR:
+                    state.set_error(value)
+            except JobCancelledError:
+                pass
+            except Exception as e:
+                logger.exception(e)
+
@@ -0,0 +1,121 @@
+from dataclasses import dataclass, field
+import heapq
+from itertools import count
+from threading import Lock
+from typing import Dict, List, Tuple, Type
+
+from .action import Action
+from .handlers import AsyncJobHandler
+from .settings import AsyncJobSettings, PoolKind
+from .state import State
+
+
+@dataclass
+class QueuedJob:
+    id: int
+    issuer: str
+    type: str
+    handler_type: Type[AsyncJobHandler]
+    action: Action
+    payload: dict
+    priority: int
+    pool: PoolKind
+    state: State = field(default_factory=State)
+
+    @property
+    def limit_keys(self):
+        return (self.issuer, f"{self.issuer}.{self.type}")
+
+
+class JobQueue:
+    settings: AsyncJobSettings
+    pending: List[Tuple[int, int, QueuedJob]]
+    running: Dict[int, QueuedJob]
+    running_counts: Dict[str, int]
+    running_per_pool: Dict[PoolKind, int]
+    _lock: Lock
+    _counter: count
+    # positions of the pending jobs, computed when first asked for after the queue changed
+    _positions: Dict[int, int]|None
+
+    def __init__(self, settings: AsyncJobSettings):
+        self.settings = settings
+        self.pending = []
+        self.running = {}
+        self.running_counts = {}
+        self.running_per_pool = {pool: 0 for pool in PoolKind}
+        self._lock = Lock()
+        self._counter = count()
+        self._positions = None
+
+    def __contains__(self, job_id: int):
+        with self._lock:
+            return job_id in self.running or any(entry[2].id == job_id for entry in self.pending)
+
+    def __len__(self):
+        return len(self.pending)
+
+    def push(self, job: QueuedJob):
+        with self._lock:
+            heapq.heappush(self.pending, (-job.priority, next(self._counter), job))
+            self._positions = None
+        job.state.set_queued(lambda: self.place(job.id))
+
+    def remove(self, job_id: int):
+        with self._lock:
+            remaining = [entry for entry in self.pending if entry[2].id != job_id]
+            if len(remaining) == len(self.pending):
+                return False
+            heapq.heapify(remaining)
+            self.pending = remaining
+            self._positions = None
+            return True
+
+    def place(self, job_id: int):
+        """Position of the pending job and the number of pending jobs"""
+        with self._lock:
+            if self._positions is None:
+                self._positions = {entry[2].id: position for position, entry in enumerate(sorted(self.pending))}
+            return self._positions.get(job_id), len(self.pending)
+
+    def pop_ready(self) -> List[QueuedJob]:
+        ready: List[QueuedJob] = []
+        blocked: List[Tuple[int, int, QueuedJob]] = []
+        with self._lock:
+            while self.pending and self.__has_free_pool():
+                entry = heapq.heappop(self.pending)
+                job = entry[2]
+                if not self.__has_capacity(job.pool) or not self.__within_limits(job):
+                    blocked.append(entry)
+                    continue
+                self.running[job.id] = job
+                self.running_per_pool[job.pool] += 1
+                for key in job.limit_keys:
+                    self.running_counts[key] = self.running_counts.get(key, 0) + 1
+                ready.append(job)
+            for entry in blocked:
+                heapq.heappush(self.pending, entry)
+            if ready:
+                self._positions = None
+        return ready
+
+    def done(self, job: QueuedJob):
+        with self._lock:
+            if self.running.pop(job.id, None) is None:
+                return
+            self.running_per_pool[job.pool] -= 1
+            for key in job.limit_keys:
+                self.running_counts[key] -= 1
+
+    def __has_capacity(self, pool: PoolKind):
+        return self.running_per_pool[pool] < self.settings.capacity(pool)
+
+    def __has_free_pool(self):
+        return any(self.__has_capacity(pool) for pool in PoolKind)
+
+    def __within_limits(self, job: QueuedJob):
+        for key in job.limit_keys:
+            limit = self.settings.limit_for(key)
+            if limit is not None and self.running_counts.get(key, 0) >= limit:
+                return False
+        return True
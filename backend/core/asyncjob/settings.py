@@ -0,0 +1,79 @@
+from dataclasses import dataclass, field
+from datetime import timedelta
+from enum import Enum
+import os
+import socket
+from typing import cast, Dict
+from uuid import uuid4
+
+from core.env import Environment
+
+
+def default_node_id():
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}"
+
+
+class PoolKind(Enum):
+    THREAD = "thread"
+    PROCESS = "process"
+
+
+@dataclass
+class AsyncJobSettings:
+    pool: PoolKind = PoolKind.THREAD
+    max_workers: int = field(default_factory=lambda: min(8, os.cpu_count() or 1))
+    cpu_workers: int = field(default_factory=lambda: os.cpu_count() or 1)
+    limits: Dict[str, int] = field(default_factory=dict)
+    node_id: str = field(default_factory=default_node_id)
+    lease: timedelta = timedelta(minutes=3)
+    claim_batch: int = 16
+
+    def limit_for(self, key: str):
+        return self.limits.get(key)
+
+    def pool_for(self, cpu_bound: bool):
+        return PoolKind.PROCESS if cpu_bound else self.pool
+
+    def capacity(self, pool: PoolKind):
+        if pool == self.pool:
+            return self.max_workers
+        return self.cpu_workers
+
+    @staticmethod
+    def _parse_limits(value: str|dict|None) -> Dict[str, int]:
+        if not value:
+            return {}
+        if isinstance(value, dict):
+            return {str(k): int(v) for k, v in value.items()}
+        result = {}
+        for entry in str(value).split(","):
+            if not entry.strip():
+                continue
+            key, limit = entry.split("=", 1)
+            result[key.strip()] = int(limit)
+        return result
+
+    @classmethod
+    def from_env(cls, env: Environment):
+        result = cls()
+        pool = cast(str|None, env.get("ASYNCJOB_POOL"))
+        if pool is not None:
+            result.pool = PoolKind(pool.lower())
+        max_workers = cast(int|None, env.get("ASYNCJOB_WORKERS"))
+        if max_workers is not None:
+            result.max_workers = int(max_workers)
+        cpu_workers = cast(int|None, env.get("ASYNCJOB_CPU_WORKERS"))
+        if cpu_workers is not None:
+            result.cpu_workers = int(cpu_workers)
+        limits = cast(str|dict|None, env.get("ASYNCJOB_LIMITS"))
+        result.limits = cls._parse_limits(limits)
+        node_id = cast(str|None, env.get("ASYNCJOB_NODE_ID"))
+        if node_id:
+            result.node_id = node_id
+        lease = cast(int|None, env.get("ASYNCJOB_LEASE_SECONDS"))
+        if lease is not None:
+            result.lease = timedelta(seconds=int(lease))
+        claim_batch = cast(int|None, env.get("ASYNCJOB_CLAIM_BATCH"))
+        if claim_batch is not None:
+            result.claim_batch = int(claim_batch)
+        return result
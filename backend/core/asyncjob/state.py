@@ -1,4 +1,14 @@
-from asyncio import Event
+import asyncio
+from asyncio import AbstractEventLoop, Event
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import AsyncIterator, Callable, Tuple
+
+from ..data.sql.columns import utcnow_tz
+
+PROGRESS_INTERVAL = 0.1
+# queue positions are computed when asked, so watchers of a queued job look again this often
+QUEUE_POLL_INTERVAL = 1.0
 
 
 class JobCancelledError(Exception):
@@ -11,9 +21,18 @@ class State:
     cancelled: bool = False
     event: Event
     error: str|None = None
+    queued_at_utc: datetime|None = None
+    started_at_utc: datetime|None = None
+    version: int = 0
+    loop: AbstractEventLoop|None
+    _lock: Lock
+    _notify_pending: bool = False
+    _place: Callable[[], Tuple[int|None, int]]|None = None
 
-    def __init__(self):
+    def __init__(self, loop: AbstractEventLoop|None = None):
         self.event = Event()
+        self.loop = loop
+        self._lock = Lock()
 
     def set_progress(self, progress: float):
         assert 0.0 <= progress and progress <= 1.0
@@ -22,25 +41,112 @@ class State:
         if self.cancelled:
             raise JobCancelledError()
         self.progress = progress
-        self.event.set()
+        self._changed()
+
+    def set_queued(self, place: Callable[[], Tuple[int|None, int]]):
+        """Marks the job as queued, `place` returns its position and the number of queued jobs"""
+        if self.queued_at_utc is None:
+            self.queued_at_utc = utcnow_tz()
+        self._place = place
+        self._changed()
+
+    def set_started(self):
+        self.started_at_utc = utcnow_tz()
+        self._place = None
+        self._changed()
+
+    @property
+    def queue_place(self) -> Tuple[int|None, int]:
+        if self._place is None or not self.queued:
+            return None, 0
+        return self._place()
+
+    @property
+    def queue_position(self):
+        return self.queue_place[0]
+
+    @property
+    def queue_depth(self):
+        return self.queue_place[1]
 
     def complete(self):
         self.completed = True
-        self.event.set()
+        self._changed()
 
     def cancel(self):
         self.cancelled = True
-        self.event.set()
+        self._changed()
 
     def set_error(self, error: str):
         self.error = error
+        self._changed()
+
+    @property
+    def queued(self):
+        return self.started_at_utc is None and not self.finished
+
+    @property
+    def wait_time(self):
+        if self.queued_at_utc is None:
+            return timedelta()
+        return (self.started_at_utc or utcnow_tz()) - self.queued_at_utc
 
     @property
     def finished(self):
         return self.completed or self.cancelled
 
+    def _changed(self):
+        with self._lock:
+            self.version += 1
+            if self._notify_pending:
+                # a wake-up is already on its way to the loop, it will pick this change up as well
+                return
+            self._notify_pending = True
+        if self.loop is None or self.loop.is_closed():
+            self.__notify()
+        elif self.__on_loop_thread():
+            self.__notify()
+        else:
+            self.loop.call_soon_threadsafe(self.__notify)
+
+    def __on_loop_thread(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def __notify(self):
+        with self._lock:
+            self._notify_pending = False
+        self.event.set()
+
     async def wait(self):
         await self.event.wait()
 
     def reset(self):
         self.event.clear()
+
+    async def updates(self, interval: float = PROGRESS_INTERVAL) -> AsyncIterator["State"]:
+        """Yields the state whenever it changes, at most once per interval, until the job finishes"""
+        seen = -1
+        seen_place = None
+        while True:
+            place = self.queue_place
+            if self.version != seen or place != seen_place:
+                seen, seen_place = self.version, place
+                yield self
+                if self.finished:
+                    return
+                if interval > 0:
+                    await asyncio.sleep(interval)
+                continue
+            self.event.clear()
+            if self.version != seen:
+                continue
+            if not self.queued:
+                await self.event.wait()
+                continue
+            try:
+                await asyncio.wait_for(self.event.wait(), QUEUE_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
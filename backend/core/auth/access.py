@@ -1,20 +1,24 @@
+from dataclasses import dataclass
 from enum import Enum as PyEnum
 import logging
-from sqlalchemy import event
-from sqlalchemy.orm import class_mapper, Session, QueryContext, InstrumentedAttribute
-from typing import Dict, Tuple, Type
+from sqlalchemy import event, false, inspect, or_
+from sqlalchemy.orm import class_mapper, object_session, with_loader_criteria, InstrumentedAttribute, Mapper, ORMExecuteState, Session, QueryContext
+from sqlalchemy.sql import ColumnElement
+from typing import Any, Dict, Iterable, List, Tuple, Type
 from uuid import UUID
 
 from .data import User
 from .handlers import AuthError, AuthHandlerMixin
-from .owner import OwnerInfo, traverse_chain
+from .owner import NO_INFO as NO_OWNER_INFO, OwnerChainEntry, OwnerInfo, preload_owners, resolve_owner_chain, resolve_owner_info, resolve_owner_link
 
 from ..data.sql.database import Model
 
 logger = logging.getLogger(__name__)
 
 __all__ = [
+    "ACCESS_FILTER",
     "AccessLevel",
+    "access_criteria",
     "ensure_access",
     "will_read",
     "will_write",
@@ -29,6 +33,9 @@ class AccessLevel(PyEnum):
     PUBLIC_READABLE = "PUBLIC_READALBE"
     PUBLIC_WRITABLE = "PUBLIC_WRITABLE"
 
+    # position in ACCESS_ORDER, comparisons run on every loaded entity
+    rank: int
+
     @staticmethod
     def min():
         return ACCESS_ORDER[0]
@@ -38,16 +45,16 @@ class AccessLevel(PyEnum):
         return ACCESS_ORDER[-1]
 
     def __lt__(self, other):
-        return ACCESS_ORDER.index(self) < ACCESS_ORDER.index(other)
+        return self.rank < other.rank
 
     def __le__(self, other):
-        return ACCESS_ORDER.index(self) <= ACCESS_ORDER.index(other)
+        return self.rank <= other.rank
 
     def __gt__(self, other):
-        return ACCESS_ORDER.index(self) > ACCESS_ORDER.index(other)
+        return self.rank > other.rank
 
     def __ge__(self, other):
-        return ACCESS_ORDER.index(self) >= ACCESS_ORDER.index(other)
+        return self.rank >= other.rank
 
 ACCESS_ORDER = [
     AccessLevel.SERVICE,
@@ -57,6 +64,8 @@ ACCESS_ORDER = [
     AccessLevel.PUBLIC_READABLE,
     AccessLevel.PUBLIC_WRITABLE,
 ]
+for rank, level in enumerate(ACCESS_ORDER):
+    level.rank = rank
 
 def access_info(**kwargs):
     return {
@@ -79,7 +88,7 @@ def find_access_info(entity_type: Type[Model]) -> AccessInfo:
         column_attrs = class_mapper(entity_type).column_attrs
         for column_attr in column_attrs:
             attr: InstrumentedAttribute = getattr(entity_type, column_attr.key)
-            if attr.type.python_type == AccessLevel:
+            if getattr(attr.type, "enum_class", None) is AccessLevel:
                 if access_info_obj is not None:
                     raise ValueError(f"Multiple access fields for entity type {entity_type}")
                 attr_info = attr.info
@@ -90,8 +99,25 @@ def find_access_info(entity_type: Type[Model]) -> AccessInfo:
         TYPE_ACCESS_INFO[entity_type] = access_info_obj
     return access_info_obj
 
+@dataclass
+class ModelAccess:
+    access_info: AccessInfo
+    owner_info: OwnerInfo
+    chain: List[OwnerChainEntry]
+
+TYPE_MODEL_ACCESS: Dict[Type, ModelAccess] = {}
+def describe_model(entity_type: Type[Model]) -> ModelAccess:
+    """Returns the access metadata of the model, compiled once the mappers are configured"""
+    model_access = TYPE_MODEL_ACCESS.get(entity_type)
+    if model_access is None:
+        owner_info = resolve_owner_info(entity_type)
+        chain = resolve_owner_chain(entity_type, owner_info) if owner_info is not NO_OWNER_INFO else []
+        model_access = ModelAccess(find_access_info(entity_type), owner_info, chain)
+        TYPE_MODEL_ACCESS[entity_type] = model_access
+    return model_access
+
 def get_own_access_level(entity: Model) -> AccessLevel:
-    access_info = find_access_info(type(entity))
+    access_info = describe_model(type(entity)).access_info
     if access_info is not NO_INFO:
         return getattr(entity, access_info.key)
     else:
@@ -100,15 +126,97 @@ def get_own_access_level(entity: Model) -> AccessLevel:
             return implicit
     return AccessLevel.PRIVATE
 
+@dataclass
+class ResolvedAccess:
+    access: AccessLevel
+    owner: User|None
+    owner_info: OwnerInfo|None
+
+ACCESS_CACHE = "access_cache"
+
+def access_cache(session: Session) -> Dict[Any, ResolvedAccess]:
+    """Resolved access of the entities loaded by the session, keyed by their identity"""
+    cache = session.info.get(ACCESS_CACHE)
+    if cache is None:
+        cache = session.info[ACCESS_CACHE] = {}
+    return cache
+
+def clear_access_cache(session: Session|None):
+    if session is not None:
+        session.info.pop(ACCESS_CACHE, None)
+
+def resolve_session_access(session: Session, entity: Model) -> ResolvedAccess:
+    identity = inspect(entity).identity_key
+    cache = access_cache(session)
+    resolved = cache.get(identity) if identity is not None else None
+    if resolved is not None:
+        return resolved
+    access = get_own_access_level(entity)
+    owner_info = describe_model(type(entity)).owner_info
+    if owner_info is NO_OWNER_INFO:
+        resolved = ResolvedAccess(AccessLevel.min(), None, None)
+    else:
+        # owners are usually shared, resolving them once serves all of their entities
+        owner = getattr(entity, owner_info.member)
+        if owner is None or isinstance(owner, User):
+            resolved = ResolvedAccess(access, owner, owner_info)
+        else:
+            parent = resolve_session_access(session, owner)
+            resolved = ResolvedAccess(max(access, parent.access), parent.owner, parent.owner_info)
+    if identity is not None:
+        cache[identity] = resolved
+    return resolved
+
+def resolve_access(entity: Model) -> ResolvedAccess:
+    session = object_session(entity)
+    assert session is not None, "Entity must be attached to a session"
+    with session.no_autoflush:
+        return resolve_session_access(session, entity)
+
+def resolve_access_many(session: Session, entities: Iterable[Model]):
+    """Resolves the access of many entities, loading their owners with one query per type"""
+    cache = access_cache(session)
+    pending = [entity for entity in entities if inspect(entity).identity_key not in cache]
+    if not pending:
+        return
+    # referenced until resolved, otherwise the identity map may drop the owners before they are used
+    owners = preload_owners(session, pending)
+    with session.no_autoflush:
+        for entity in pending:
+            resolve_session_access(session, entity)
+    del owners
+
+def chain_criteria(entity_type: Type[Model], chain: List[OwnerChainEntry], user_id: UUID|None, levels: List[AccessLevel]) -> ColumnElement[bool]:
+    entry, rest = chain[0], chain[1:]
+    clauses: List[ColumnElement[bool]] = []
+    access_info = describe_model(entity_type).access_info
+    if access_info is not NO_INFO:
+        clauses.append(getattr(entity_type, access_info.key).in_(levels))
+    mapper = class_mapper(entity_type)
+    local_columns = list(entry.member.property.local_columns)
+    foreign_key = getattr(entity_type, mapper.get_property_by_column(local_columns[0]).key) if len(local_columns) == 1 else None
+    if foreign_key is not None:
+        # entities without an owner pass the load checks as well
+        clauses.append(foreign_key.is_(None))
+    if rest:
+        owner_type = entry.member.property.mapper.class_
+        clauses.append(entry.member.has(chain_criteria(owner_type, rest, user_id, levels)))
+    elif user_id is not None:
+        clauses.append(foreign_key == user_id if foreign_key is not None else entry.member.has(User.id == user_id))
+    return or_(*clauses) if clauses else false()
+
+def access_criteria(entity_type: Type[Model], user_id: UUID|None, min_access: AccessLevel) -> ColumnElement[bool]|None:
+    """Returns the SQL condition matching the entities that the user may access, None if they are not owned"""
+    model_access = describe_model(entity_type)
+    if model_access.owner_info is NO_OWNER_INFO:
+        return None
+    chain = model_access.chain
+    levels = [level for level in ACCESS_ORDER if level >= min_access]
+    return chain_criteria(entity_type, chain, user_id, levels)
+
 def get_access_level_and_owner(entity: Model) -> Tuple[AccessLevel, User|None, OwnerInfo|None]:
-    max_access = AccessLevel.min()
-    def update_access(entity):
-        nonlocal max_access
-        access = get_own_access_level(entity)
-        if access > max_access:
-            max_access = access
-    owner, owner_info = traverse_chain(entity, update_access)
-    return max_access, owner, owner_info
+    resolved = resolve_access(entity)
+    return resolved.access, resolved.owner, resolved.owner_info
 
 def ensure_access(user_id: UUID|None, target: Model, min_access: AccessLevel, should_raise: bool = True):
     access, owner, owner_info = get_access_level_and_owner(target)
@@ -155,11 +263,70 @@ def resolve_user_id(session: Session):
         return
     return handler.get_current_user()
 
+# execution option, set to False to skip the access filter of a select
+ACCESS_FILTER = "access_filter"
+# entities loaded by the selects running in the session, checked once each select has loaded all of its rows
+LOADED_ENTITIES = "access_loaded"
+
+@event.listens_for(Session, "do_orm_execute")
+def on_orm_execute(state: ORMExecuteState):
+    if not state.is_select or state.is_column_load:
+        return
+    session = state.session
+    if session.info.get(EnsureAccessContextManager.TAG, 0) > 0:
+        return
+    if not state.is_relationship_load and state.execution_options.get(ACCESS_FILTER, True):
+        filter_access(state)
+    if state.execution_options.get("yield_per") or state.execution_options.get("stream_results"):
+        # streamed rows are checked one by one as they load
+        return
+    return check_loaded(state)
+
+def check_loaded(state: ORMExecuteState):
+    """Runs the select and checks all entities it loaded at once, so that their owners load with one query per type"""
+    session = state.session
+    loaded: List[Model] = []
+    stack: List[List[Model]] = session.info.setdefault(LOADED_ENTITIES, [])
+    stack.append(loaded)
+    try:
+        result = state.invoke_statement().freeze()
+    finally:
+        stack.pop()
+    if loaded:
+        user_id = resolve_user_id(session)
+        with EnsureAccessContextManager(session):
+            resolve_access_many(session, loaded)
+            for target in loaded:
+                will_read(user_id, target)
+    return result()
+
+def filter_access(state: ORMExecuteState):
+    session = state.session
+    # only requests are filtered, services see everything
+    if not isinstance(session.info.get("handler"), AuthHandlerMixin):
+        return
+    with EnsureAccessContextManager(session):
+        user_id = resolve_user_id(session)
+    mappers = set(state.all_mappers)
+    if state.bind_mapper is not None:
+        mappers.add(state.bind_mapper)
+    options = []
+    for mapper in mappers:
+        criteria = access_criteria(mapper.class_, user_id, AccessLevel.PUBLIC_READABLE)
+        if criteria is not None:
+            options.append(with_loader_criteria(mapper.class_, criteria, include_aliases=True))
+    if options:
+        state.statement = state.statement.options(*options)
+
 @event.listens_for(Model, "load", propagate=True)
 def on_instance_load(target: Model, context: QueryContext):
     session: Session = context.session
     if session.info.get(EnsureAccessContextManager.TAG, 0) > 0:
         return
+    loading = session.info.get(LOADED_ENTITIES)
+    if loading:
+        loading[-1].append(target)
+        return
     user_id = resolve_user_id(session)
     with EnsureAccessContextManager(session):
         will_read(user_id, target)
@@ -170,5 +337,34 @@ def on_before_flush(session: Session, flush_context, instances):
         return
     user_id = resolve_user_id(session)
     with EnsureAccessContextManager(session):
-        for target in session.dirty:
+        targets = list(session.dirty)
+        resolve_access_many(session, targets)
+        for target in targets:
             will_write(user_id, target)
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def on_transaction_end(session: Session):
+    # other transactions may change access from now on
+    clear_access_cache(session)
+
+def on_access_changed(target: Model, value, oldvalue, initiator):
+    clear_access_cache(object_session(target))
+
+@event.listens_for(Mapper, "after_configured")
+def on_mappers_configured():
+    for mapper in Model.registry.mappers:
+        describe_model(mapper.class_)
+        resolve_owner_link(mapper.class_)
+
+@event.listens_for(Model, "mapper_configured", propagate=True)
+def on_mapper_configured(mapper: Mapper, entity_type: Type[Model]):
+    for column_attr in mapper.column_attrs:
+        if getattr(column_attr.columns[0].type, "enum_class", None) is AccessLevel:
+            event.listen(getattr(entity_type, column_attr.key), "set", on_access_changed)
+    owner_info = resolve_owner_info(entity_type)
+    if owner_info is not NO_OWNER_INFO:
+        relationship = mapper.relationships[owner_info.member]
+        event.listen(getattr(entity_type, relationship.key), "set", on_access_changed)
+        for column in relationship.local_columns:
+            event.listen(getattr(entity_type, mapper.get_property_by_column(column).key), "set", on_access_changed)
@@ -0,0 +1,61 @@
+"""Microbenchmark of the access checks that run for every loaded entity.
+Run from the backend directory with `python -m core.auth.bench_access`."""
+from argparse import ArgumentParser
+import timeit
+from uuid import uuid4
+
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+# the auth modules import the core through the app, like the server does
+import core.app.main  # noqa: F401
+from core.auth.access import ACCESS_ORDER, AccessLevel, clear_access_cache, get_access_level_and_owner
+from core.auth.data import User, UserRole
+from miniapps.files.data import FileMetadata, FileStorage
+
+
+def index_lt(a: AccessLevel, b: AccessLevel):
+    """The comparison before levels carried their rank"""
+    return ACCESS_ORDER.index(a) < ACCESS_ORDER.index(b)
+
+
+def make_file():
+    """A file owned through its storage, attached to a session that never touches a database"""
+    session = Session()
+    user = User("bench", "bench-Passw0rd!", UserRole.USER)
+    storage = FileStorage(id=uuid4(), user=user, name="bench")
+    file = FileMetadata(id=uuid4(), name="bench", storage=storage, access=AccessLevel.PUBLIC_READABLE)
+    for entity in (user, storage, file):
+        make_transient_to_detached(entity)
+        session.add(entity)
+    return session, file
+
+
+def main():
+    parser = ArgumentParser(description="Times the access level comparisons and resolution")
+    parser.add_argument("-n", dest="number", type=int, default=100_000)
+    parser.add_argument("-r", dest="repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    a, b = AccessLevel.PRIVATE, AccessLevel.PUBLIC_READABLE
+    session, file = make_file()
+
+    def resolve_uncached():
+        clear_access_cache(session)
+        return get_access_level_and_owner(file)
+
+    cases = [
+        ("ACCESS_ORDER.index(a) < ACCESS_ORDER.index(b)", lambda: index_lt(a, b)),
+        ("a.rank < b.rank", lambda: a.rank < b.rank),
+        ("a < b", lambda: a < b),
+        ("max(a, b, key=ACCESS_ORDER.index)", lambda: max(a, b, key=ACCESS_ORDER.index)),
+        ("max(a, b)", lambda: max(a, b)),
+        ("get_access_level_and_owner, cached", lambda: get_access_level_and_owner(file)),
+        ("get_access_level_and_owner, resolved", resolve_uncached),
+    ]
+    for name, fn in cases:
+        best = min(timeit.repeat(fn, number=args.number, repeat=args.repeat))
+        print(f"{name:<42} {best / args.number * 1e9:8.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
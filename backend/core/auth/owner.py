@@ -1,7 +1,7 @@
 from dataclasses import dataclass
 from sqlalchemy import select
-from sqlalchemy.orm import class_mapper, object_session, InstrumentedAttribute, joinedload
-from typing import Callable, Dict, List, Tuple, Type
+from sqlalchemy.orm import class_mapper, object_session, InstrumentedAttribute, MANYTOONE, Session, joinedload
+from typing import Any, Callable, Dict, Iterable, List, Set, Tuple, Type
 
 from .data import User
 
@@ -9,10 +9,13 @@ from ..data.sql.database import Model
 
 __all__ = [
     "owner_info",
+    "preload_owners",
     "resolve_owner_info",
     "traverse_chain",
 ]
 
+PRELOAD_BATCH_SIZE = 500
+
 def owner_info(**kwargs):
     return {
         "owner": True,
@@ -49,6 +52,30 @@ def resolve_owner_info(entity_type: Type[Model]) -> OwnerInfo:
     return owner_info
 
 
+@dataclass
+class OwnerLink:
+    owner_class: Type[Model]
+    key: str
+
+TYPE_OWNER_LINK: Dict[Type[Model], OwnerLink|None] = {}
+def resolve_owner_link(entity_type: Type[Model]) -> OwnerLink|None:
+    """Returns the attribute holding the primary key of the owner, if the owner can be looked up by it"""
+    if entity_type in TYPE_OWNER_LINK:
+        return TYPE_OWNER_LINK[entity_type]
+    link = None
+    owner_info = resolve_owner_info(entity_type)
+    if owner_info is not NO_INFO:
+        mapper = class_mapper(entity_type)
+        relationship = mapper.relationships[owner_info.member]
+        owner_mapper = relationship.mapper
+        pairs = relationship.local_remote_pairs or []
+        if relationship.direction is MANYTOONE and len(pairs) == 1 and len(owner_mapper.primary_key) == 1 \
+                and pairs[0][1] is owner_mapper.primary_key[0]:
+            link = OwnerLink(owner_mapper.class_, mapper.get_property_by_column(pairs[0][0]).key)
+    TYPE_OWNER_LINK[entity_type] = link
+    return link
+
+
 @dataclass
 class OwnerChainEntry:
     member: InstrumentedAttribute
@@ -110,3 +137,36 @@ def traverse_chain(
                 break
         assert owner is None or isinstance(owner, User)
         return owner, info
+
+def preload_owners(session: Session, entities: Iterable[Model]):
+    """Loads the owner chains of the entities with one query per owner type and level, instead of one per entity.
+    Returns the owners, the identity map only holds them while they are referenced."""
+    level = list(entities)
+    loaded: List[Model] = []
+    with session.no_autoflush:
+        while level:
+            owners: Dict[int, Model] = {}
+            missing: Dict[Type[Model], Set[Any]] = {}
+            for entity in level:
+                link = resolve_owner_link(type(entity))
+                if link is None:
+                    continue
+                owner_id = getattr(entity, link.key)
+                if owner_id is None:
+                    continue
+                identity = class_mapper(link.owner_class).identity_key_from_primary_key([owner_id])
+                owner = session.identity_map.get(identity)
+                if owner is None:
+                    missing.setdefault(link.owner_class, set()).add(owner_id)
+                else:
+                    owners[id(owner)] = owner
+            for owner_class, owner_ids in missing.items():
+                primary_key = class_mapper(owner_class).primary_key[0]
+                ids = list(owner_ids)
+                for start in range(0, len(ids), PRELOAD_BATCH_SIZE):
+                    statement = select(owner_class).where(primary_key.in_(ids[start:start + PRELOAD_BATCH_SIZE]))
+                    for owner in session.scalars(statement):
+                        owners[id(owner)] = owner
+            level = list(owners.values())
+            loaded.extend(level)
+    return loaded
@@ -1,5 +1,6 @@
 from asyncio import AbstractEventLoop, get_event_loop, sleep
 from datetime import datetime
+import inspect
 import logging
 import time
 from typing import Any, Callable, Dict
@@ -51,10 +52,21 @@ class Scheduler:
                 if schedule.match(now):
                     start = time.time()
                     try:
-                        fn()
+                        result = fn()
+                        if inspect.isawaitable(result):
+                            # coroutines run on their own, they must not hold up the other jobs
+                            self.loop.create_task(self.__await(fn, result))
+                            continue
                     except Exception as e:
                         logger.error(f"Error while running scheduled job `{fn}`")
                         logger.exception(e)
                     elapsed = time.time() - start
                     if elapsed > 1:
                         logger.warning(f"Job `{fn}` took {elapsed} seconds to run")
+
+    async def __await(self, fn: CronjobCallable, result: Any):
+        try:
+            await result
+        except Exception as e:
+            logger.error(f"Error while running scheduled job `{fn}`")
+            logger.exception(e)
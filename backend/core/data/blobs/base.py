@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
 from enum import Enum
-from typing import BinaryIO
+from typing import BinaryIO, List, Tuple
 
 from .address import Address
 
@@ -69,6 +69,10 @@ class Blobs(ABC):
         with self.open(address, OpenMode.WRITE) as fh:
             return fh.write(data)
 
+    def version(self, address: Address) -> str|None:
+        """Cheap token that changes whenever the content changes, None if unknown"""
+        return None
+
     @abstractmethod
     def delete(self, address: Address):
         ...
@@ -80,7 +84,17 @@ class Blobs(ABC):
     @abstractmethod
     def copy(self, src: Address, dst: Address):
         ...
+
+    def copy_many(self, pairs: List[Tuple[Address, Address]]):
+        for src, dst in pairs:
+            self.copy(src, dst)
     
     @abstractmethod
     def rename(self, src: Address, dst: Address):
         ...
+
+    def after_fork(self):
+        pass
+
+    def collect_garbage(self) -> int:
+        return 0
@@ -0,0 +1,282 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import hashlib
+import logging
+from multiprocessing.util import Finalize
+import os
+import shutil
+from threading import Lock
+import time
+from typing import List, Tuple, cast
+import uuid
+
+from .base import Address, BlobIO, Blobs, OpenMode
+from .fs import FsBlobIO
+
+logger = logging.getLogger(__name__)
+
+COPY_CHUNK_SIZE = 256 * 1024
+ENTRY_SUFFIX = ".blob"
+PARTIAL_SUFFIX = ".part"
+WORKER_PREFIX = "worker-"
+
+
+@dataclass
+class CacheEntry:
+    path: str
+    version: str|None
+    size: int
+    validated_at: float
+
+
+class CachedBlobIO(BlobIO):
+    """Looks the blob up when entered, so that a miss is fetched wherever the blob is entered rather than opened"""
+    _inner: BlobIO|None
+
+    def __init__(self, manager: "CachedBlobs", address: Address, mode: OpenMode):
+        super().__init__(manager, address, mode)
+        self._inner = None
+
+    @property
+    def inner(self):
+        assert self._inner is not None, "Blob must be entered first"
+        return self._inner
+
+    def __enter__(self):
+        self._inner = cast(CachedBlobs, self._manager)._enter_read(self._address)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._inner is not None:
+            self._inner.__exit__(exc_type, exc_value, traceback)
+            self._inner = None
+
+    def close(self):
+        self.__exit__(None, None, None)
+
+    def flush(self):
+        pass
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, n: int = -1) -> bytes:
+        return self.inner.read(n)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self.inner.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.inner.tell()
+
+    def write(self, data: bytes|bytearray) -> int:
+        raise IOError("Blob is opened for reading")
+
+
+class CachedBlobs(Blobs):
+    """Keeps recently read blobs on the local disk, evicting the least recently used ones.
+    Writes through this instance invalidate at once, writes by other processes or nodes
+    are only noticed once an entry is revalidated, after `revalidate_after` seconds."""
+
+    inner: Blobs
+    base_root: str
+    root: str
+    max_size: int
+    max_entry_size: int
+    revalidate_after: float
+    entries: "OrderedDict[str, CacheEntry]"
+    size: int
+    hits: int
+    misses: int
+    evictions: int
+    _lock: Lock
+
+    def __init__(self, inner: Blobs, root: str, max_size: int, max_entry_size: int|None = None, revalidate_after: float = 60.0):
+        self.inner = inner
+        self.base_root = root
+        self.root = root
+        self.max_size = max_size
+        self.max_entry_size = max_entry_size if max_entry_size is not None else max_size // 16
+        self.revalidate_after = revalidate_after
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = Lock()
+        self.__clear_root()
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "size": self.size,
+            }
+
+    def after_fork(self):
+        self._lock = Lock()
+        # the entries stay with the parent, evicting them here would delete files the parent still serves
+        self.root = os.path.join(self.base_root, f"{WORKER_PREFIX}{os.getpid()}")
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__clear_root()
+        Finalize(None, shutil.rmtree, args=(self.root,), kwargs={"ignore_errors": True}, exitpriority=0)
+        self.inner.after_fork()
+
+    def collect_garbage(self):
+        return self.inner.collect_garbage()
+
+    def version(self, address: Address):
+        return self.inner.version(address)
+
+    def exists(self, address: Address):
+        return self.inner.exists(address)
+
+    def delete(self, address: Address):
+        self.invalidate(address, tree=True)
+        return self.inner.delete(address)
+
+    def open(self, address: Address, mode: OpenMode) -> BlobIO:
+        if mode != OpenMode.READ:
+            self.invalidate(address)
+            return self.inner.open(address, mode)
+        return CachedBlobIO(self, address, mode)
+
+    def copy(self, src: Address, dst: Address):
+        self.invalidate(dst)
+        return self.inner.copy(src, dst)
+
+    def copy_many(self, pairs: List[Tuple[Address, Address]]):
+        for _, dst in pairs:
+            self.invalidate(dst)
+        return self.inner.copy_many(pairs)
+
+    def rename(self, src: Address, dst: Address):
+        self.invalidate(src, tree=True)
+        self.invalidate(dst, tree=True)
+        return self.inner.rename(src, dst)
+
+    def _enter_read(self, address: Address) -> BlobIO:
+        path = self.__lookup(address)
+        if path is not None:
+            try:
+                return FsBlobIO(path, self, address, OpenMode.READ).__enter__()
+            except FileNotFoundError:
+                # evicted since it was looked up
+                pass
+        # taken before the contents, a write in between is caught by the next revalidation
+        version = self.inner.version(address)
+        src = self.inner.open(address, OpenMode.READ).__enter__()
+        try:
+            size = src.seek(0, os.SEEK_END)
+            src.seek(0)
+            if size > self.max_entry_size:
+                # too large to be cached, read from the inner store without copying
+                return src
+            path = self.__fetch(address, version, src)
+        except BaseException as e:
+            src.__exit__(type(e), e, e.__traceback__)
+            raise
+        src.__exit__(None, None, None)
+        try:
+            return FsBlobIO(path, self, address, OpenMode.READ).__enter__()
+        except FileNotFoundError:
+            # evicted right away by concurrent fetches
+            return self.inner.open(address, OpenMode.READ).__enter__()
+
+    def invalidate(self, address: Address, tree: bool = False):
+        """Drops the cached blob, with `tree` also those below it as a directory"""
+        key = str(address)
+        prefix = key.rstrip("/") + "/"
+        with self._lock:
+            keys = [k for k in self.entries if k == key or k.startswith(prefix)] if tree else [key]
+            entries = [entry for entry in (self.entries.pop(k, None) for k in keys) if entry is not None]
+            for entry in entries:
+                self.size -= entry.size
+        for entry in entries:
+            self.__remove(entry.path)
+
+    def __path(self, key: str):
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, name + ENTRY_SUFFIX)
+
+    def __lookup(self, address: Address):
+        key = str(address)
+        with self._lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.validated_at > self.revalidate_after:
+            version = self.inner.version(address)
+            if version is None or version != entry.version:
+                self.invalidate(address)
+                return None
+            entry.validated_at = time.monotonic()
+        with self._lock:
+            if self.entries.get(key) is not entry:
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return entry.path
+
+    def __fetch(self, address: Address, version: str|None, src: BlobIO):
+        """Copies the opened blob into the cache"""
+        with self._lock:
+            self.misses += 1
+        partial_path = os.path.join(self.root, uuid.uuid4().hex + PARTIAL_SUFFIX)
+        size = 0
+        try:
+            with open(partial_path, "wb") as dst:
+                while chunk := src.read(COPY_CHUNK_SIZE):
+                    size += len(chunk)
+                    dst.write(chunk)
+        except BaseException:
+            self.__remove(partial_path)
+            raise
+        key = str(address)
+        path = self.__path(key)
+        os.replace(partial_path, path)
+        with self._lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous.size
+            self.entries[key] = CacheEntry(path, version, size, time.monotonic())
+            self.size += size
+            evicted = self.__evict()
+        for entry in evicted:
+            self.__remove(entry.path)
+        return path
+
+    def __evict(self):
+        evicted = []
+        while self.size > self.max_size and len(self.entries) > 1:
+            _, entry = self.entries.popitem(last=False)
+            self.size -= entry.size
+            self.evictions += 1
+            evicted.append(entry)
+        return evicted
+
+    def __remove(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def __clear_root(self):
+        os.makedirs(self.root, exist_ok=True)
+        for name in os.listdir(self.root):
+            if name.endswith(ENTRY_SUFFIX) or name.endswith(PARTIAL_SUFFIX):
+                self.__remove(os.path.join(self.root, name))
+            elif name.startswith(WORKER_PREFIX):
+                # left behind by workers of an earlier run
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
@@ -0,0 +1,341 @@
+from datetime import datetime
+import hashlib
+import logging
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..sql.columns import DateTime, Integer, String, Mapped, mapped_column, ensure_str_fit, utcnow_tz
+from ..sql.database import Database, Model
+
+from .base import Address, BlobIO, Blobs, OpenMode
+
+logger = logging.getLogger(__name__)
+
+CAS_NAMESPACE = "cas"
+HASH_CHUNK_SIZE = 1024 * 1024
+GC_BATCH_SIZE = 256
+
+
+class BlobContent(Model):
+    __tablename__ = "BlobContent"
+    digest: Mapped[str] = mapped_column(String(64), primary_key=True)
+    size: Mapped[int] = mapped_column(Integer)
+    refcount: Mapped[int] = mapped_column(Integer, default=0, index=True)
+    created_at_utc: Mapped[datetime] = mapped_column(DateTime)
+
+
+class BlobRef(Model):
+    __tablename__ = "BlobRef"
+    address: Mapped[str] = mapped_column(String(3072//4), primary_key=True)
+    digest: Mapped[str] = mapped_column(String(64), index=True)
+
+
+def addr_to_id(address: Address) -> str:
+    id = str(address)
+    ensure_str_fit("address", id, BlobRef.address)
+    return id
+
+
+class CasBlobIO(BlobIO):
+    """Writes into a temporary object and hands it over to the content store once closed"""
+
+    _manager: "CasBlobs"
+    _temp: Address
+    _inner: BlobIO
+    _hash: "hashlib._Hash|None"
+    _size: int
+    _closed: bool
+
+    def __init__(self, manager: "CasBlobs", address: Address, mode: OpenMode, temp: Address, sequential: bool):
+        super().__init__(manager, address, mode)
+        self._temp = temp
+        self._inner = manager.inner.open(temp, mode)
+        self._hash = hashlib.sha256() if sequential else None
+        self._size = 0
+        self._closed = False
+
+    def __enter__(self):
+        self._inner.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._closed = True
+            self._inner.__exit__(exc_type, exc_value, traceback)
+            self._manager.inner.delete(self._temp)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._inner.__exit__(None, None, None)
+        if self._hash is not None:
+            digest, size = self._hash.hexdigest(), self._size
+        else:
+            digest, size = self._manager._hash(self._temp)
+        self._manager._store(self._address, self._temp, digest, size)
+
+    def flush(self):
+        self._inner.flush()
+
+    def read(self, n: int = -1) -> bytes:
+        self._hash = None
+        return self._inner.read(n)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        position = self._inner.seek(offset, whence)
+        if position != self._size:
+            # out of order writes cannot be hashed on the fly, hash the whole object on close
+            self._hash = None
+        return position
+
+    def tell(self) -> int:
+        return self._inner.tell()
+
+    def write(self, data: bytes|bytearray) -> int:
+        written = self._inner.write(data)
+        if self._hash is not None:
+            self._hash.update(data)
+            self._size += len(data)
+        return written
+
+
+class CasBlobs(Blobs):
+    """Stores every distinct content once, addresses only reference it by its SHA-256 digest"""
+
+    inner: Blobs
+    database: Database
+
+    def __init__(self, inner: Blobs, database: Database):
+        self.inner = inner
+        self.database = database
+
+    @staticmethod
+    def content_address(digest: str):
+        return Address(CAS_NAMESPACE, Address.join_keys(digest[:2], digest))
+
+    def after_fork(self):
+        self.inner.after_fork()
+
+    def exists(self, address: Address):
+        with self.database.make_session() as session:
+            if session.get(BlobRef, addr_to_id(address)) is not None:
+                return True
+        return self.inner.exists(address)
+
+    def version(self, address: Address):
+        with self.database.make_session() as session:
+            ref = session.get(BlobRef, addr_to_id(address))
+            if ref is not None:
+                return ref.digest
+        return self.inner.version(address)
+
+    def delete(self, address: Address):
+        with self.database.make_session() as session:
+            if self.__unpoint(session, address):
+                session.commit()
+                return
+            # a directory, its files are released together with it
+            if self.__unpoint_tree(session, address):
+                session.commit()
+        self.inner.delete(address)
+
+    def open(self, address: Address, mode: OpenMode) -> BlobIO:
+        with self.database.make_session() as session:
+            ref = session.get(BlobRef, addr_to_id(address))
+            digest = ref.digest if ref is not None else None
+        temp = Address.random(CAS_NAMESPACE, "incoming", temporary=True)
+        if mode == OpenMode.READ:
+            if digest is None:
+                return self.inner.open(address, mode)
+            return self.inner.open(self.content_address(digest), mode)
+        elif mode == OpenMode.APPEND:
+            if digest is not None:
+                self.inner.copy(self.content_address(digest), temp)
+            elif self.inner.exists(address):
+                self.inner.copy(address, temp)
+            return CasBlobIO(self, address, mode, temp, sequential=False)
+        return CasBlobIO(self, address, mode, temp, sequential=True)
+
+    def copy(self, src: Address, dst: Address):
+        with self.database.make_session() as session:
+            ref = session.get(BlobRef, addr_to_id(src))
+            digest = ref.digest if ref is not None else None
+        if digest is None:
+            digest = self.__adopt(src)
+        with self.database.make_session() as session:
+            content = self.__lock_content(session, digest)
+            if content is None:
+                raise FileNotFoundError(str(src))
+            content.refcount += 1
+            self.__point(session, dst, digest)
+            session.commit()
+        self.__drop_legacy(dst)
+
+    def rename(self, src: Address, dst: Address):
+        with self.database.make_session() as session:
+            src_id = addr_to_id(src)
+            ref = session.get(BlobRef, src_id, with_for_update=True)
+            if ref is None:
+                self.__unpoint(session, dst)
+                moved = self.__move_tree(session, src, dst)
+                session.commit()
+                try:
+                    self.inner.rename(src, dst)
+                except FileNotFoundError:
+                    # a directory holding only content addressed files has nothing in the inner store
+                    if not moved:
+                        raise
+                return
+            self.__unpoint(session, dst)
+            session.execute(update(BlobRef).where(BlobRef.address == src_id).values(address=addr_to_id(dst)))
+            session.commit()
+        self.__drop_legacy(dst)
+
+    def collect_garbage(self):
+        with self.database.make_session() as session:
+            statement = select(BlobContent) \
+                .where(BlobContent.refcount <= 0) \
+                .limit(GC_BATCH_SIZE) \
+                .with_for_update(skip_locked=True)
+            digests = []
+            for content in session.scalars(statement).all():
+                digests.append(content.digest)
+                session.delete(content)
+            # the rows go first, contents are never deleted while a row still refers to them
+            session.commit()
+        collected = sum(1 for digest in digests if self.__delete_content(digest))
+        if collected:
+            logger.info("Collected %d unreferenced blob(s)", collected)
+        return collected
+
+    def __delete_content(self, digest: str):
+        """Deletes unreferenced contents, unless they were stored again since their row was deleted"""
+        with self.database.make_session() as session:
+            try:
+                # the uncommitted row holds off writers storing the same content until the blob is gone
+                session.add(BlobContent(digest=digest, size=0, refcount=0, created_at_utc=utcnow_tz()))
+                session.flush()
+            except IntegrityError:
+                return False
+            try:
+                self.inner.delete(self.content_address(digest))
+            finally:
+                session.rollback()
+        return True
+
+    def _hash(self, address: Address):
+        hash = hashlib.sha256()
+        size = 0
+        with self.inner.open(address, OpenMode.READ) as fh:
+            while True:
+                chunk = fh.read(HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                hash.update(chunk)
+                size += len(chunk)
+        return hash.hexdigest(), size
+
+    def _store(self, address: Address, temp: Address, digest: str, size: int):
+        content_address = self.content_address(digest)
+        for attempt in range(2):
+            with self.database.make_session() as session:
+                try:
+                    content = self.__lock_content(session, digest)
+                    if content is None:
+                        content = BlobContent(digest=digest, size=size, refcount=0, created_at_utc=utcnow_tz())
+                        session.add(content)
+                        session.flush()
+                    if self.inner.exists(content_address):
+                        self.inner.delete(temp)
+                    else:
+                        self.inner.rename(temp, content_address)
+                    content.refcount += 1
+                    self.__point(session, address, digest)
+                    session.commit()
+                    break
+                except IntegrityError:
+                    # another writer stored the same content (or address) concurrently
+                    session.rollback()
+                    if attempt > 0:
+                        raise
+        if temp != address:
+            self.__drop_legacy(address)
+
+    def __adopt(self, address: Address):
+        """Moves an object stored before content addressing was enabled into the content store"""
+        digest, size = self._hash(address)
+        self._store(address, address, digest, size)
+        return digest
+
+    def __lock_content(self, session: Session, digest: str):
+        statement = select(BlobContent) \
+            .where(BlobContent.digest == digest) \
+            .with_for_update()
+        return session.scalars(statement).one_or_none()
+
+    def __release(self, session: Session, digest: str):
+        statement = update(BlobContent) \
+            .where(BlobContent.digest == digest) \
+            .values(refcount=BlobContent.refcount - 1)
+        session.execute(statement)
+
+    def __point(self, session: Session, address: Address, digest: str):
+        ref = session.get(BlobRef, addr_to_id(address), with_for_update=True)
+        if ref is None:
+            session.add(BlobRef(address=addr_to_id(address), digest=digest))
+            session.flush()
+        else:
+            self.__release(session, ref.digest)
+            ref.digest = digest
+
+    def __unpoint(self, session: Session, address: Address):
+        ref = session.get(BlobRef, addr_to_id(address), with_for_update=True)
+        if ref is None:
+            return False
+        self.__release(session, ref.digest)
+        session.delete(ref)
+        session.flush()
+        return True
+
+    def __refs_under(self, session: Session, address: Address):
+        prefix = addr_to_id(address).removesuffix("/") + "/"
+        statement = select(BlobRef) \
+            .where(BlobRef.address.startswith(prefix, autoescape=True)) \
+            .with_for_update()
+        return prefix, list(session.scalars(statement).all())
+
+    def __unpoint_tree(self, session: Session, address: Address):
+        _, refs = self.__refs_under(session, address)
+        for ref in refs:
+            self.__release(session, ref.digest)
+            session.delete(ref)
+        session.flush()
+        return len(refs)
+
+    def __move_tree(self, session: Session, src: Address, dst: Address):
+        """Points every address below src to the same place below dst, returns how many were moved"""
+        src_prefix, refs = self.__refs_under(session, src)
+        if not refs:
+            return 0
+        dst_prefix = addr_to_id(dst).removesuffix("/") + "/"
+        moves = [(ref.address, dst_prefix + ref.address[len(src_prefix):]) for ref in refs]
+        for _, new_id in moves:
+            ensure_str_fit("address", new_id, BlobRef.address)
+        # whatever the target already held is replaced
+        self.__unpoint_tree(session, dst)
+        session.expunge_all()
+        for old_id, new_id in moves:
+            statement = update(BlobRef) \
+                .where(BlobRef.address == old_id) \
+                .values(address=new_id) \
+                .execution_options(synchronize_session=False)
+            session.execute(statement)
+        return len(moves)
+
+    def __drop_legacy(self, address: Address):
+        if self.inner.exists(address):
+            self.inner.delete(address)
@@ -71,6 +71,14 @@ class FsBlobs(Blobs):
         path = self._addr_to_path(address, create_dirs=False)
         return os.path.isfile(path)
 
+    def version(self, address: Address):
+        path = self._addr_to_path(address, create_dirs=False)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
     def delete(self, address: Address):
         path = self._addr_to_path(address, create_dirs=False)
         if os.path.isfile(path):
@@ -1,17 +1,27 @@
 import boto3
 import botocore.exceptions
+from concurrent.futures import ThreadPoolExecutor
 from mypy_boto3_s3 import S3Client
+import io
 import os
 import tempfile
-from typing import BinaryIO, cast
+from typing import Any, BinaryIO, Dict, List, Tuple, cast
 
 from .base import Address, Blobs, BlobIO, OpenMode
 
+READ_AHEAD_SIZE = 1024 * 1024
+PART_SIZE = 8 * 1024 * 1024
+COPY_WORKERS = 8
+MISSING_CODES = ("404", "403", "NoSuchKey")
+
+
+def is_missing(error: botocore.exceptions.ClientError):
+    return error.response["Error"]["Code"] in MISSING_CODES  # type: ignore
+
 
 class S3BlobIO(BlobIO):
     _manager: "S3Blobs"
     key: str
-    temp_file: BinaryIO|tempfile._TemporaryFileWrapper
 
     @property
     def client(self):
@@ -20,22 +30,219 @@ class S3BlobIO(BlobIO):
     @property
     def bucket(self):
         return self._manager.bucket
-    
-    @property
-    def internal_file(self) -> BinaryIO:
-        return cast(BinaryIO, self.temp_file.file)  # type: ignore
 
     def __init__(self, manager: "S3Blobs", address: Address, mode: OpenMode, key: str):
         super().__init__(manager, address, mode)
         self.key = key
 
+
+class S3ReadIO(S3BlobIO):
+    """Reads the object with ranged requests, only fetching what is actually read"""
+
+    size: int
+    position: int
+    buffer: bytes
+    buffer_start: int
+
+    def __enter__(self):
+        try:
+            obj = self.client.head_object(Bucket=self.bucket, Key=self.key)
+        except botocore.exceptions.ClientError as e:
+            if is_missing(e):
+                raise FileNotFoundError(self.key)
+            raise
+        self.size = obj["ContentLength"]
+        self.position = 0
+        self.buffer = b""
+        self.buffer_start = 0
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.buffer = b""
+
+    def flush(self):
+        pass
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, n: int = -1) -> bytes:
+        if n is None or n < 0:
+            n = self.size - self.position
+        n = min(n, self.size - self.position)
+        if n <= 0:
+            return b""
+        offset = self.position - self.buffer_start
+        if offset < 0 or offset + n > len(self.buffer):
+            self.__fetch(self.position, max(n, READ_AHEAD_SIZE))
+            offset = 0
+        result = self.buffer[offset:offset + n]
+        self.position += len(result)
+        return result
+
+    def __fetch(self, start: int, length: int):
+        end = min(start + length, self.size) - 1
+        obj = self.client.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={start}-{end}")
+        self.buffer = obj["Body"].read()
+        self.buffer_start = start
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError("Invalid whence value")
+        if position < 0:
+            raise ValueError("Negative seek position")
+        self.position = position
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+    def write(self, data: bytes|bytearray) -> int:
+        raise io.UnsupportedOperation("write")
+
+
+class S3WriteIO(S3BlobIO):
+    """Uploads the object in parts while it is written, keeping at most a couple of parts in memory"""
+
+    position: int
+    buffer: bytearray
+    buffer_start: int
+    upload_id: str|None
+    parts: List[Dict[str, Any]]
+    finished: bool
+
+    def __enter__(self):
+        self.position = 0
+        self.buffer = bytearray()
+        self.buffer_start = 0
+        self.upload_id = None
+        self.parts = []
+        self.finished = False
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def close(self):
+        if self.finished:
+            return
+        self.finished = True
+        if self.upload_id is None:
+            self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer))
+        else:
+            if self.buffer:
+                self.__upload_part(len(self.buffer))
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+                MultipartUpload={"Parts": self.parts},  # type: ignore
+            )
+        self.buffer = bytearray()
+
+    def abort(self):
+        if self.finished:
+            return
+        self.finished = True
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        self.buffer = bytearray()
+
+    def flush(self):
+        pass
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, n: int = -1) -> bytes:
+        offset = self.position - self.buffer_start
+        if offset < 0:
+            raise io.UnsupportedOperation("Cannot read data that was already uploaded")
+        end = len(self.buffer) if n is None or n < 0 else offset + n
+        result = bytes(self.buffer[offset:end])
+        self.position += len(result)
+        return result
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.buffer_start + len(self.buffer) + offset
+        else:
+            raise ValueError("Invalid whence value")
+        if position < self.buffer_start:
+            raise io.UnsupportedOperation("Cannot seek into data that was already uploaded")
+        self.position = position
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+    def write(self, data: bytes|bytearray) -> int:
+        offset = self.position - self.buffer_start
+        if offset < 0:
+            raise io.UnsupportedOperation("Cannot overwrite data that was already uploaded")
+        if offset > len(self.buffer):
+            self.buffer.extend(bytes(offset - len(self.buffer)))
+        self.buffer[offset:offset + len(data)] = data
+        self.position += len(data)
+        # only parts fully behind the cursor are uploaded, so small seeks back keep working
+        while self.position - self.buffer_start >= 2 * PART_SIZE:
+            self.__upload_part(PART_SIZE)
+        return len(data)
+
+    def __upload_part(self, size: int):
+        if self.upload_id is None:
+            upload = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key)
+            self.upload_id = upload["UploadId"]
+        number = len(self.parts) + 1
+        part = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=number,
+            Body=bytes(self.buffer[:size]),
+        )
+        self.parts.append({"ETag": part["ETag"], "PartNumber": number})
+        del self.buffer[:size]
+        self.buffer_start += size
+
+
+class S3AppendIO(S3BlobIO):
+    """Appending needs the existing content, so the object is downloaded and uploaded again as a whole"""
+
+    temp_file: BinaryIO|tempfile._TemporaryFileWrapper
+
+    @property
+    def internal_file(self) -> BinaryIO:
+        return cast(BinaryIO, self.temp_file.file)  # type: ignore
+
     def __enter__(self):
-        mode_str = "w+b" if self._mode != OpenMode.APPEND else "a+b"
-        self.temp_file = cast(BinaryIO, tempfile.TemporaryFile(mode_str))
+        self.temp_file = cast(BinaryIO, tempfile.TemporaryFile("a+b"))
         try:
             self.client.download_fileobj(self.bucket, self.key, self.internal_file)
         except botocore.exceptions.ClientError as e:
-            if e.response["Error"]["Code"] not in ("404", "403"):  # type: ignore
+            if not is_missing(e):
                 raise
         self.internal_file.seek(0)
         return self
@@ -46,19 +253,13 @@ class S3BlobIO(BlobIO):
         del self.temp_file
 
     def close(self):
-        if self._mode == OpenMode.WRITE:
-            self.temp_file.flush()
-            self.temp_file.seek(0)
-            self.client.upload_fileobj(self.internal_file, self.bucket, self.key)
+        self.temp_file.flush()
+        self.temp_file.seek(0)
+        self.client.upload_fileobj(self.internal_file, self.bucket, self.key)
         self.temp_file.close()
 
     def flush(self):
         self.temp_file.flush()
-        if self._mode == OpenMode.WRITE:
-            pos = self.temp_file.tell()
-            self.temp_file.seek(0)
-            self.client.upload_fileobj(self.internal_file, self.bucket, self.key)
-            self.temp_file.seek(pos)
 
     def read(self, n: int = -1):
         return self.temp_file.read(n)
@@ -75,15 +276,22 @@ class S3BlobIO(BlobIO):
 
 class S3Blobs(Blobs):
     bucket: str
+    endpoint_url: str|None
     session: boto3.Session
     client: S3Client
 
-    def __init__(self, bucket: str):
+    def __init__(self, bucket: str, endpoint_url: str|None = None):
         credentials, bucket_name = tuple(bucket.split("@"))
         aws_id, aws_secret = tuple(credentials.split(":"))
         self.bucket = bucket_name
+        self.endpoint_url = endpoint_url
         self.session = boto3.Session(aws_id, aws_secret)
-        self.client = self.session.client("s3")
+        self.client = self.session.client("s3", endpoint_url=endpoint_url)
+
+    def after_fork(self):
+        credentials = self.session.get_credentials()
+        self.session = boto3.Session(credentials.access_key, credentials.secret_key)
+        self.client = self.session.client("s3", endpoint_url=self.endpoint_url)
 
     def __addr_to_key(self, address: Address) -> str:
         path = str(address)
@@ -95,10 +303,17 @@ class S3Blobs(Blobs):
         return path
 
     def exists(self, address: Address) -> bool:
+        return self.version(address) is not None
+
+    def version(self, address: Address):
         key = self.__addr_to_key(address)
-        obj = self.client.head_object(Bucket=self.bucket, Key=key)
-        metadata = obj["Metadata"]
-        return metadata["Status"] in ["active", "inactive"]
+        try:
+            obj = self.client.head_object(Bucket=self.bucket, Key=key)
+        except botocore.exceptions.ClientError as e:
+            if is_missing(e):
+                return None
+            raise
+        return obj["ETag"]
 
     def delete(self, address: Address):
         key = self.__addr_to_key(address)
@@ -106,17 +321,35 @@ class S3Blobs(Blobs):
 
     def open(self, address: Address, mode: OpenMode) -> S3BlobIO:
         key = self.__addr_to_key(address)
-        return S3BlobIO(self, address, mode, key)  # type: ignore
+        match mode:
+            case OpenMode.READ:
+                return S3ReadIO(self, address, mode, key)  # type: ignore
+            case OpenMode.WRITE:
+                return S3WriteIO(self, address, mode, key)  # type: ignore
+            case OpenMode.APPEND:
+                return S3AppendIO(self, address, mode, key)  # type: ignore
+        raise ValueError(f"Unknown open mode {mode}")
 
-    def copy(self, src: Address, dst: Address):
-        src_key = self.__addr_to_key(src)
-        dst_key = self.__addr_to_key(dst)
+    def __copy(self, src_key: str, dst_key: str):
         copy_source = {"Bucket": self.bucket, "Key": src_key}
-        self.client.copy_object(Bucket=self.bucket, CopySource=copy_source, Key=dst_key)  # type: ignore
+        try:
+            # managed copy, switches to multipart copies for objects over 5GB
+            self.client.copy(copy_source, self.bucket, dst_key)  # type: ignore
+        except botocore.exceptions.ClientError as e:
+            if is_missing(e):
+                raise FileNotFoundError(src_key)
+            raise
+
+    def copy(self, src: Address, dst: Address):
+        self.__copy(self.__addr_to_key(src), self.__addr_to_key(dst))
+
+    def copy_many(self, pairs: List[Tuple[Address, Address]]):
+        # copies happen inside S3, issuing them concurrently hides the per-request latency
+        with ThreadPoolExecutor(COPY_WORKERS) as executor:
+            for _ in executor.map(lambda pair: self.copy(*pair), pairs):
+                pass
 
     def rename(self, src: Address, dst: Address):
         src_key = self.__addr_to_key(src)
-        dst_key = self.__addr_to_key(dst)
-        copy_source = {"Bucket": self.bucket, "Key": src_key}
-        self.client.copy_object(Bucket=self.bucket, CopySource=copy_source, Key=dst_key)  # type: ignore
+        self.__copy(src_key, self.__addr_to_key(dst))
         self.client.delete_object(Bucket=self.bucket, Key=src_key)
@@ -15,6 +15,10 @@ class BlobSettings:
     fs_root: str|None = None
     sql_conn_str: str|None = None
     s3_bucket: str|None = None
+    s3_endpoint: str|None = None
+    cas: bool = False
+    cache_root: str|None = None
+    cache_size: int = 1 << 30
 
     def build(self) -> Blobs:
         if self.fs_root is not None:
@@ -22,11 +26,23 @@ class BlobSettings:
         elif self.sql_conn_str is not None:
             return SqlBlobs(self.sql_conn_str)
         elif self.s3_bucket is not None:
-            return S3Blobs(self.s3_bucket)
+            return S3Blobs(self.s3_bucket, self.s3_endpoint)
         raise ValueError("No blobs configured")
     
     @classmethod
     def from_env(cls, env: Environment):
+        result = cls.__backend_from_env(env)
+        result.cas = str(env.get("BLOB_CAS", False)).lower() in ("1", "true", "yes")
+        cache_root = cast(Optional[str], env.get("BLOB_CACHE_ROOT"))
+        if cache_root is not None:
+            result.cache_root = os.path.abspath(cache_root)
+        cache_size = cast(Optional[int], env.get("BLOB_CACHE_SIZE"))
+        if cache_size is not None:
+            result.cache_size = int(cache_size)
+        return result
+
+    @classmethod
+    def __backend_from_env(cls, env: Environment):
         fs_root = cast(Optional[str], env.get("BLOB_FS_ROOT"))
         if fs_root is not None:
             return cls(fs_root=os.path.abspath(fs_root))
@@ -35,5 +51,6 @@ class BlobSettings:
             return cls(sql_conn_str=sql_conn_str)
         s3_bucket = cast(Optional[str], env.get("BLOB_S3"))
         if s3_bucket is not None:
-            return cls(s3_bucket=s3_bucket)
+            s3_endpoint = cast(Optional[str], env.get("BLOB_S3_ENDPOINT"))
+            return cls(s3_bucket=s3_bucket, s3_endpoint=s3_endpoint)
         return cls()
@@ -1,61 +1,120 @@
-from sqlalchemy import create_engine, Engine, String, BLOB
-from sqlalchemy import select, delete
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker, Session, object_session
+from sqlalchemy import create_engine, Engine, BigInteger, ForeignKey, Integer, LargeBinary, String, BLOB
+from sqlalchemy import delete, insert, literal, select, update
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker, Session
 
 from ..sql.columns import ensure_str_fit
 
 from .base import Address, BlobIO, OpenMode, Blobs
 
+CHUNK_SIZE = 256 * 1024
+
 
 class BlobModel(DeclarativeBase):
     pass
 
 
 class Blob(BlobModel):
+    """Blob stored in a single row, only read to move it over to chunked storage"""
     __tablename__ = "_DataBlob"
 
     address: Mapped[str] = mapped_column(String(3072//4), primary_key=True)
     data: Mapped[bytes] = mapped_column(BLOB, nullable=True, default=None)
 
 
+class BlobObject(BlobModel):
+    __tablename__ = "_DataBlobObject"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    address: Mapped[str] = mapped_column(String(3072//4), unique=True)
+    size: Mapped[int] = mapped_column(BigInteger, default=0)
+
+
+class BlobChunk(BlobModel):
+    __tablename__ = "_DataBlobChunk"
+
+    object_id: Mapped[int] = mapped_column(ForeignKey(BlobObject.id, ondelete="CASCADE"), primary_key=True)
+    chunk_index: Mapped[int] = mapped_column(Integer, primary_key=True)
+    data: Mapped[bytes] = mapped_column(LargeBinary(CHUNK_SIZE))
+
+
 def addr_to_id(address: Address) -> str:
     id = str(address)
-    ensure_str_fit("address", id, Blob.address)
+    ensure_str_fit("address", id, BlobObject.address)
     return id
 
 
 class SqlBlobIO(BlobIO):
-    blob: Blob
+    _manager: "SqlBlobs"
+    session: Session
+    object: BlobObject
     cursor: int
+    chunk_index: int|None
+    chunk: bytearray
+    chunk_stored: bool
+    dirty: bool
+    finished: bool
 
-    def __init__(self, blob: Blob, manager: Blobs, address: Address, mode: OpenMode):
+    def __init__(self, manager: "SqlBlobs", address: Address, mode: OpenMode):
         super().__init__(manager, address, mode)
-        self.blob = blob
         self.cursor = 0
-
-    @property
-    def session(self):
-        session = object_session(self.blob)
-        assert session, "Blob is not attached to a session"
-        return session
+        self.chunk_index = None
+        self.chunk = bytearray()
+        self.chunk_stored = False
+        self.dirty = False
+        self.finished = False
 
     def __enter__(self):
+        self.session = self._manager.make_session()
+        try:
+            self.object = self._manager._get_object(self.session, self._address, create=self._mode != OpenMode.READ)
+            if self._mode == OpenMode.WRITE:
+                self.session.execute(delete(BlobChunk).where(BlobChunk.object_id == self.object.id))
+                self.object.size = 0
+            elif self._mode == OpenMode.APPEND:
+                self.cursor = self.object.size
+        except:
+            self.session.close()
+            raise
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        pass
-    
+        if exc_type is None:
+            self.close()
+        elif not self.finished:
+            self.finished = True
+            self.session.rollback()
+            self.session.close()
+
     def close(self):
-        pass
-    
+        if self.finished:
+            return
+        self.finished = True
+        try:
+            self.flush()
+        finally:
+            self.session.close()
+
     def flush(self):
+        self.__store_chunk()
         self.session.commit()
 
     def read(self, n: int = -1) -> bytes:
-        if n == -1:
-            return self.blob.data[self.cursor:]
+        end = self.object.size if n is None or n < 0 else min(self.cursor + n, self.object.size)
+        if end <= self.cursor:
+            return b""
+        index = self.cursor // CHUNK_SIZE
+        if end > (index + 1) * CHUNK_SIZE:
+            self.__store_chunk()
+            parts = self.__load_range(self.cursor, end)
         else:
-            return self.blob.data[self.cursor:self.cursor+n]
+            # small reads, like those of tarfile and zipfile, are served from the chunk kept since the last one
+            self.__select_chunk(index)
+            offset = self.cursor - index * CHUNK_SIZE
+            part = bytes(self.chunk[offset:offset + end - self.cursor])
+            parts = [part, bytes(end - self.cursor - len(part))]
+        result = b"".join(parts)
+        self.cursor += len(result)
+        return result
 
     def seek(self, offset: int, whence: int = 0) -> int:
         if whence == 0:
@@ -63,7 +122,7 @@ class SqlBlobIO(BlobIO):
         elif whence == 1:
             self.cursor += offset
         elif whence == 2:
-            self.cursor = len(self.blob.data) + offset
+            self.cursor = self.object.size + offset
         else:
             raise ValueError("Invalid whence value")
         return self.cursor
@@ -72,55 +131,162 @@ class SqlBlobIO(BlobIO):
         return self.cursor
 
     def write(self, data: bytes|bytearray) -> int:
-        self.blob.data = self.blob.data[:self.cursor] + data + self.blob.data[self.cursor+len(data):]
-        self.cursor += len(data)
-        return len(data)
+        if self._mode == OpenMode.APPEND:
+            self.cursor = self.object.size
+        written = 0
+        while written < len(data):
+            index, offset = divmod(self.cursor, CHUNK_SIZE)
+            self.__select_chunk(index)
+            count = min(CHUNK_SIZE - offset, len(data) - written)
+            if offset > len(self.chunk):
+                self.chunk.extend(bytes(offset - len(self.chunk)))
+            self.chunk[offset:offset + count] = data[written:written + count]
+            self.dirty = True
+            written += count
+            self.cursor += count
+            self.object.size = max(self.object.size, self.cursor)
+        return written
+
+    def __load_range(self, start: int, end: int):
+        first, last = start // CHUNK_SIZE, (end - 1) // CHUNK_SIZE
+        statement = select(BlobChunk.chunk_index, BlobChunk.data) \
+            .where(BlobChunk.object_id == self.object.id) \
+            .where(BlobChunk.chunk_index.between(first, last)) \
+            .order_by(BlobChunk.chunk_index)
+        chunks = {index: data for index, data in self.session.execute(statement)}
+        # the last chunk is kept, the next read usually continues in it
+        self.chunk_index = last
+        self.chunk = bytearray(chunks.get(last, b""))
+        self.chunk_stored = last in chunks
+        parts = []
+        for index in range(first, last + 1):
+            data = chunks.get(index, b"")
+            chunk_start = index * CHUNK_SIZE
+            lo = max(start - chunk_start, 0)
+            hi = min(end - chunk_start, CHUNK_SIZE)
+            part = data[lo:hi]
+            if len(part) < hi - lo:
+                part += bytes(hi - lo - len(part))
+            parts.append(part)
+        return parts
+
+    def __select_chunk(self, index: int):
+        if self.chunk_index == index:
+            return
+        self.__store_chunk()
+        data = None
+        if index * CHUNK_SIZE < self.object.size:
+            statement = select(BlobChunk.data) \
+                .where(BlobChunk.object_id == self.object.id) \
+                .where(BlobChunk.chunk_index == index)
+            data = self.session.scalars(statement).one_or_none()
+        self.chunk_index = index
+        self.chunk = bytearray(data or b"")
+        self.chunk_stored = data is not None
+
+    def __store_chunk(self):
+        if not self.dirty or self.chunk_index is None:
+            return
+        if self.chunk_stored:
+            statement = update(BlobChunk) \
+                .where(BlobChunk.object_id == self.object.id) \
+                .where(BlobChunk.chunk_index == self.chunk_index) \
+                .values(data=bytes(self.chunk))
+            self.session.execute(statement)
+        else:
+            self.session.execute(insert(BlobChunk).values(object_id=self.object.id, chunk_index=self.chunk_index, data=bytes(self.chunk)))
+            self.chunk_stored = True
+        self.session.flush()
+        self.dirty = False
 
 
 class SqlBlobs(Blobs):
     engine: Engine
-    session: Session
+    make_session: sessionmaker
 
     def __init__(self, connection_string: str):
         self.engine = create_engine(connection_string, pool_recycle=1800)
         BlobModel.metadata.create_all(self.engine)
-        self.session = Session(self.engine)
+        self.make_session = sessionmaker(bind=self.engine)
+
+    def after_fork(self):
+        self.engine.dispose(close=False)
+
+    def _get_object(self, session: Session, address: Address, create: bool = False):
+        id = addr_to_id(address)
+        obj = session.scalars(select(BlobObject).where(BlobObject.address == id)).one_or_none()
+        if obj is None:
+            obj = self.__migrate(session, id)
+        if obj is None:
+            if not create:
+                raise FileNotFoundError(str(address))
+            obj = BlobObject(address=id, size=0)
+            session.add(obj)
+            session.flush()
+        return obj
+
+    def __migrate(self, session: Session, id: str):
+        """Moves a blob written before chunked storage into chunks"""
+        blob = session.get(Blob, id)
+        if blob is None:
+            return None
+        data = blob.data or b""
+        obj = BlobObject(address=id, size=len(data))
+        session.add(obj)
+        session.flush()
+        for index, start in enumerate(range(0, len(data), CHUNK_SIZE)):
+            session.add(BlobChunk(object_id=obj.id, chunk_index=index, data=data[start:start + CHUNK_SIZE]))
+        session.delete(blob)
+        session.flush()
+        return obj
+
+    def __taken(self, session: Session, id: str):
+        if session.scalars(select(BlobObject.id).where(BlobObject.address == id)).first() is not None:
+            return True
+        return session.get(Blob, id) is not None
 
     def exists(self, address: Address):
-        statement = select(Blob).where(Blob.address == addr_to_id(address))
-        return self.session.execute(statement).one_or_none() is not None
+        with self.make_session() as session:
+            return self.__taken(session, addr_to_id(address))
+
+    def version(self, address: Address):
+        id = addr_to_id(address)
+        with self.make_session() as session:
+            obj = session.scalars(select(BlobObject).where(BlobObject.address == id)).one_or_none()
+            if obj is None:
+                return None
+            return f"{obj.id:x}-{obj.size:x}"
 
     def delete(self, address: Address):
-        statement = delete(Blob).where(Blob.address == addr_to_id(address))
-        self.session.execute(statement)
-        self.session.commit()
+        id = addr_to_id(address)
+        with self.make_session() as session:
+            obj_ids = select(BlobObject.id).where(BlobObject.address == id).scalar_subquery()
+            session.execute(delete(BlobChunk).where(BlobChunk.object_id == obj_ids))
+            session.execute(delete(BlobObject).where(BlobObject.address == id))
+            session.execute(delete(Blob).where(Blob.address == id))
+            session.commit()
 
     def open(self, address: Address, mode: OpenMode):
-        statement = select(Blob).where(Blob.address == addr_to_id(address))
-        blob = self.session.scalars(statement).one()
-        return SqlBlobIO(blob, self, address, mode)  # type: ignore
+        return SqlBlobIO(self, address, mode)  # type: ignore
 
     def copy(self, src: Address, dst: Address):
-        src_statement = select(Blob).where(Blob.address == addr_to_id(src))
-        src_blob = self.session.scalars(src_statement).one()
-        dst_statement = select(Blob).where(Blob.address == addr_to_id(dst))
-        dst_blob = self.session.scalars(dst_statement).first()
-        if dst_blob is not None:
-            raise FileExistsError(dst)
-        dst_blob = Blob(address=addr_to_id(dst), data=src_blob.data)
-        self.session.add(dst_blob)
-        self.session.commit()
+        with self.make_session() as session:
+            src_obj = self._get_object(session, src)
+            if self.__taken(session, addr_to_id(dst)):
+                raise FileExistsError(dst)
+            dst_obj = BlobObject(address=addr_to_id(dst), size=src_obj.size)
+            session.add(dst_obj)
+            session.flush()
+            # chunks are copied by the database, they never pass through this process
+            chunks = select(literal(dst_obj.id), BlobChunk.chunk_index, BlobChunk.data) \
+                .where(BlobChunk.object_id == src_obj.id)
+            session.execute(insert(BlobChunk).from_select(["object_id", "chunk_index", "data"], chunks))
+            session.commit()
 
     def rename(self, src: Address, dst: Address):
-        src_statement = select(Blob).where(Blob.address == addr_to_id(src))
-        src_blob = self.session.scalars(src_statement).first()
-        if src_blob is None:
-            raise FileNotFoundError()
-        dst_statement = select(Blob).where(Blob.address == addr_to_id(dst))
-        dst_blob = self.session.scalars(dst_statement).one_or_none()
-        if dst_blob is not None:
-            raise FileExistsError(dst)
-        dst_blob = Blob(address=addr_to_id(dst), data=src_blob.data)
-        self.session.delete(src_blob)
-        self.session.add(dst_blob)
-        self.session.commit()
+        with self.make_session() as session:
+            src_obj = self._get_object(session, src)
+            if self.__taken(session, addr_to_id(dst)):
+                raise FileExistsError(dst)
+            src_obj.address = addr_to_id(dst)
+            session.commit()
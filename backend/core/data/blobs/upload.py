@@ -0,0 +1,60 @@
+import hashlib
+
+from .address import Address
+from .base import Blobs, BlobIO, OpenMode
+
+
+class BlobUpload:
+    """Spools incoming chunks into a temporary blob and moves it in place once complete"""
+
+    blobs: Blobs
+    address: Address
+    temp_address: Address
+    size: int
+    finished: bool
+    _hash: "hashlib._Hash"
+    _handle: BlobIO|None = None
+
+    def __init__(self, blobs: Blobs, address: Address):
+        self.blobs = blobs
+        self.address = address
+        self.temp_address = Address.random(address.namespace, "uploads", temporary=True)
+        self.size = 0
+        self.finished = False
+        self._hash = hashlib.sha256()
+
+    @property
+    def digest(self):
+        return self._hash.hexdigest()
+
+    def __open(self):
+        if self._handle is None:
+            handle = self.blobs.open(self.temp_address, OpenMode.WRITE)
+            self._handle = handle.__enter__()
+        return self._handle
+
+    def __close(self):
+        if self._handle is not None:
+            handle, self._handle = self._handle, None
+            handle.__exit__(None, None, None)
+
+    def write(self, chunk: bytes):
+        assert not self.finished, "Upload already finished"
+        self.__open().write(chunk)
+        self._hash.update(chunk)
+        self.size += len(chunk)
+
+    def finish(self):
+        if self.finished:
+            return
+        self.__open()
+        self.__close()
+        if self.blobs.exists(self.address):
+            self.blobs.delete(self.address)
+        self.blobs.rename(self.temp_address, self.address)
+        self.finished = True
+
+    def abort(self):
+        self.__close()
+        if not self.finished:
+            self.blobs.delete(self.temp_address)
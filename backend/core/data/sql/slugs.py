@@ -2,7 +2,7 @@ import re
 import sqlalchemy
 from sqlalchemy import Column, String
 import sqlalchemy.event
-from sqlalchemy.orm import class_mapper, Session, InstrumentedAttribute
+from sqlalchemy.orm import class_mapper, InstrumentedAttribute, Mapper, Session
 from sqlalchemy.orm.state import InstanceState
 from typing import Dict, List, Type, TYPE_CHECKING
 from uuid import uuid4
@@ -95,6 +95,13 @@ def generate_slug(entity: "Model", slug_info: SlugInfo, origins: List[str]) -> s
     # TODO check if slug is unique (and generate a new suffix if needed)
     return slug
 
+@sqlalchemy.event.listens_for(Mapper, "mapper_configured")
+def on_mapper_configured(mapper: Mapper, entity_type: Type["Model"]):
+    # compiled ahead, so that flushes only look the slug setup up
+    slug_info = find_slug_info(entity_type)
+    if slug_info is not NO_SLUG:
+        find_origin_names(entity_type, slug_info)
+
 @sqlalchemy.event.listens_for(Session, "before_flush")
 def on_before_flush(session: Session, flush_context, instances):
     def process_slugs(entities):
@@ -20,6 +20,7 @@ class SqlTypeKind(PyEnum):
 
 SQL_TO_SCALAR = {
     sqlalchemy.Integer: int,
+    sqlalchemy.BigInteger: float,  # GraphQL integers are 32-bit
     sqlalchemy.Float: float,
     sqlalchemy.Boolean: bool,
     sqlalchemy.String: str,
@@ -7,8 +7,12 @@ from typing import cast
 from ..app.main import AppContext, App
 from ..asyncjob.context import AsyncJobContext
 from ..asyncjob.engine import AsyncJobs
+from ..asyncjob.settings import AsyncJobSettings
 from ..context import BaseContext
 from ..cronjob.engine import Scheduler
+from ..cronjob.schedule import Schedule
+from ..data.blobs.cache import CachedBlobs
+from ..data.blobs.cas import CasBlobs
 from ..data.blobs.settings import BlobSettings
 from ..data.context import SqlSettings, DataContext
 from ..data.sql.database import Database
@@ -47,9 +51,17 @@ def build_manager(env: Environment, context: BaseContext):
     msg = Messages()
     cron = Scheduler(asyncio.get_event_loop())
     blobs = blob_settings.build()
+    if blob_settings.cas:
+        cas = blobs = CasBlobs(blobs, database)
+        async def collect_garbage():
+            # deletes blobs and locks rows, which must not happen on the event loop
+            await asyncio.get_running_loop().run_in_executor(None, cas.collect_garbage)
+        cron.schedule(collect_garbage, Schedule.hourly())
+    if blob_settings.cache_root is not None:
+        blobs = CachedBlobs(blobs, blob_settings.cache_root, blob_settings.cache_size)
     context = AsyncJobContext(context, database, blobs, msg, cron)
 
-    asyncjobs = AsyncJobs(context)
+    asyncjobs = AsyncJobs(context, AsyncJobSettings.from_env(env))
     context = MiniappContext(context, asyncjobs)
 
     miniapp_types = load_miniapps(context)
@@ -0,0 +1,45 @@
+from tornado.httputil import HTTPServerRequest, parse_body_arguments
+from typing import Any, List, Protocol
+
+STREAMED_BODY_MAX_SIZE = 1 << 36
+
+
+class BodySink(Protocol):
+    def write(self, chunk: bytes) -> Any:
+        ...
+
+    def finish(self) -> Any:
+        ...
+
+    def abort(self) -> Any:
+        ...
+
+
+class BufferedBody:
+    """Collects a streamed request body in memory and parses it like a regular request"""
+
+    request: HTTPServerRequest
+    chunks: List[bytes]
+
+    def __init__(self, request: HTTPServerRequest):
+        self.request = request
+        self.chunks = []
+
+    def write(self, chunk: bytes):
+        self.chunks.append(chunk)
+
+    def finish(self):
+        self.request.body = b"".join(self.chunks)
+        self.chunks.clear()
+        parse_body_arguments(
+            self.request.headers.get("Content-Type", ""),
+            self.request.body,
+            self.request.body_arguments,
+            self.request.files,
+            self.request.headers,
+        )
+        for name, values in self.request.body_arguments.items():
+            self.request.arguments.setdefault(name, []).extend(values)
+
+    def abort(self):
+        self.chunks.clear()
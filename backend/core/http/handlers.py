@@ -1,9 +1,10 @@
 import logging
 from sqlalchemy.exc import PendingRollbackError
 import traceback
-from tornado.web import RequestHandler
+from tornado.ioloop import IOLoop
+from tornado.web import GZipContentEncoding, RequestHandler
 from tornado.websocket import WebSocketHandler
-from typing import Any
+from typing import Any, BinaryIO
 
 from .context import ServerContext
 
@@ -11,6 +12,8 @@ from ..data.sql.database import Session
 
 logger = logging.getLogger(__name__)
 
+STREAM_CHUNK_SIZE = 256 * 1024
+
 
 class SessionHandlerMixin(RequestHandler):
     _session: Session|None = None
@@ -57,6 +60,22 @@ class HttpApiHandler(SessionHandlerMixin, RequestHandler):
         self.set_status(204)
         self.finish()
 
+    def disable_compression(self):
+        self._transforms = [t for t in self._transforms if not isinstance(t, GZipContentEncoding)]
+
+    async def write_stream(self, fh: BinaryIO, start: int, length: int, chunk_size: int = STREAM_CHUNK_SIZE):
+        loop = IOLoop.current()
+        await loop.run_in_executor(None, fh.seek, start)
+        remaining = length
+        while remaining > 0:
+            chunk = await loop.run_in_executor(None, fh.read, min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            self.write(chunk)
+            await self.flush()
+        return length - remaining
+
     def write_error(self, status_code: int, **kwargs: Any) -> None:
         result = {"code": status_code, "error": self._reason}
         if self.settings.get("serve_traceback") and "exc_info" in kwargs:
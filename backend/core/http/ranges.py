@@ -0,0 +1,91 @@
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+
+class RangeNotSatisfiableError(ValueError):
+    pass
+
+
+@dataclass
+class ByteRange:
+    start: int
+    end: int
+
+    @property
+    def length(self):
+        return self.end - self.start + 1
+
+    def content_range(self, total: int):
+        return f"bytes {self.start}-{self.end}/{total}"
+
+    @staticmethod
+    def unsatisfied(total: int):
+        return f"bytes */{total}"
+
+    @classmethod
+    def parse(cls, header: str|None, total: int) -> "ByteRange|None":
+        """Parses a single-range `Range` header, returns `None` if the whole content should be served"""
+        if not header:
+            return None
+        unit, _, spec = header.strip().partition("=")
+        if unit.strip().lower() != "bytes" or not spec or "," in spec:
+            # unknown units and multipart ranges are ignored - the whole content is served instead
+            return None
+        first, dash, last = spec.strip().partition("-")
+        if not dash:
+            return None
+        try:
+            first_pos = int(first) if first else None
+            last_pos = int(last) if last else None
+        except ValueError:
+            return None
+        if first_pos is None:
+            if not last_pos or last_pos <= 0:
+                raise RangeNotSatisfiableError(header)
+            start, end = max(total - last_pos, 0), total - 1
+        else:
+            start = first_pos
+            end = last_pos if last_pos is not None else total - 1
+        if start >= total:
+            raise RangeNotSatisfiableError(header)
+        if start < 0 or end < start:
+            return None
+        return cls(start, min(end, total - 1))
+
+
+def _as_utc(value: datetime):
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def http_date(value: datetime):
+    return format_datetime(_as_utc(value), usegmt=True)
+
+
+def if_none_match(header: str|None, etag: str):
+    """Checks if an `If-None-Match` precondition lists the entity tag, so that it has not changed"""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # the weak comparison applies, W/ prefixes are ignored on both sides
+    etag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def if_range_matches(header: str|None, etag: str, last_modified: datetime|None):
+    """Checks if an `If-Range` precondition allows serving a partial response"""
+    if not header:
+        return True
+    header = header.strip()
+    if header.startswith("\"") or header.startswith("W/"):
+        # weak validators never match If-Range
+        return header == etag
+    if last_modified is None:
+        return False
+    try:
+        return _as_utc(parsedate_to_datetime(header)) == _as_utc(last_modified).replace(microsecond=0)
+    except (TypeError, ValueError):
+        return False
@@ -1,9 +1,12 @@
 from abc import ABC, abstractmethod
+from sqlalchemy import select
 from typing import Callable, Type, TYPE_CHECKING
 
 from .context import MiniappContext
 
+from ..asyncjob.data import JobPromise
 from ..asyncjob.handlers import AsyncJobHandler
+from ..cronjob.schedule import Schedule
 
 if TYPE_CHECKING:
     from .miniapp import Miniapp
@@ -45,3 +48,26 @@ class AsyncjobRegistry(MiniappRegistry):
 
     def start(self, miniapp: "Miniapp", context: MiniappContext):
         context.asyncjobs.handlers.add(miniapp.id, self.handler_type.TYPE, self.handler_type)
+
+
+class PeriodicJobRegistry(MiniappRegistry):
+    """Schedules an asyncjob periodically, unless a previous one is still pending"""
+    handler_type: Type[AsyncJobHandler]
+    schedule: Schedule
+
+    def __init__(self, handler_type: Type[AsyncJobHandler], schedule: Schedule):
+        self.handler_type = handler_type
+        self.schedule = schedule
+
+    def start(self, miniapp: "Miniapp", context: MiniappContext):
+        def schedule_job():
+            with context.database.make_session() as session:
+                statement = select(JobPromise.id) \
+                    .where(JobPromise.issuer == miniapp.id) \
+                    .where(JobPromise.type == self.handler_type.TYPE) \
+                    .where(JobPromise.completed_at_utc == None) \
+                    .limit(1)
+                if session.scalars(statement).first() is not None:
+                    return
+            context.asyncjobs.schedule(miniapp.id, self.handler_type.TYPE, None)
+        context.cron.schedule(schedule_job, self.schedule)
@@ -0,0 +1,24 @@
+"""asyncjob-priority
+
+Revision ID: 5b1e7c3a9d20
+Revises: cddd57819c72
+Create Date: 2026-10-18 09:12:41.305117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1e7c3a9d20'
+down_revision = 'cddd57819c72'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('JobPromise', sa.Column('priority', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('JobPromise', 'priority')
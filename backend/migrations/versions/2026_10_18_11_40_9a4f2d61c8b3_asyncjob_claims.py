@@ -0,0 +1,28 @@
+"""asyncjob-claims
+
+Revision ID: 9a4f2d61c8b3
+Revises: 5b1e7c3a9d20
+Create Date: 2026-10-18 11:40:03.918264
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4f2d61c8b3'
+down_revision = '5b1e7c3a9d20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('JobPromise', sa.Column('claimed_by', sa.String(length=64), nullable=True))
+    op.add_column('JobPromise', sa.Column('lease_expires_at_utc', sa.DateTime(), nullable=True))
+    op.add_column('JobPromise', sa.Column('heartbeat_at_utc', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('JobPromise', 'heartbeat_at_utc')
+    op.drop_column('JobPromise', 'lease_expires_at_utc')
+    op.drop_column('JobPromise', 'claimed_by')
@@ -0,0 +1,40 @@
+"""blob-cas
+
+Revision ID: c37e81b0f5a2
+Revises: 9a4f2d61c8b3
+Create Date: 2026-10-18 13:25:17.540921
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c37e81b0f5a2'
+down_revision = '9a4f2d61c8b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('BlobContent',
+    sa.Column('digest', sa.String(length=64), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('refcount', sa.Integer(), nullable=False),
+    sa.Column('created_at_utc', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('digest')
+    )
+    op.create_index(op.f('ix_BlobContent_refcount'), 'BlobContent', ['refcount'], unique=False)
+    op.create_table('BlobRef',
+    sa.Column('address', sa.String(length=768), nullable=False),
+    sa.Column('digest', sa.String(length=64), nullable=False),
+    sa.PrimaryKeyConstraint('address')
+    )
+    op.create_index(op.f('ix_BlobRef_digest'), 'BlobRef', ['digest'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_BlobRef_digest'), table_name='BlobRef')
+    op.drop_table('BlobRef')
+    op.drop_index(op.f('ix_BlobContent_refcount'), table_name='BlobContent')
+    op.drop_table('BlobContent')
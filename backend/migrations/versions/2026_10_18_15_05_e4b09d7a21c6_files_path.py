@@ -0,0 +1,88 @@
+"""files-path
+
+Revision ID: e4b09d7a21c6
+Revises: c37e81b0f5a2
+Create Date: 2026-10-18 15:05:42.118305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b09d7a21c6'
+down_revision = 'c37e81b0f5a2'
+branch_labels = None
+depends_on = None
+
+
+def unique_name(name: str, taken: set) -> str:
+    stem, dot, ext = name.rpartition('.')
+    if not stem:
+        stem, dot, ext = name, '', ''
+    n = 1
+    while True:
+        candidate = f'{stem} ({n}){dot}{ext}'
+        if candidate not in taken:
+            return candidate
+        n += 1
+
+
+def rename_duplicates() -> None:
+    """Renames siblings sharing a name, which the unique constraint no longer allows.
+    Their contents were stored under one path, so the most recently modified keeps the name."""
+    files = sa.table('FileMetadata',
+        sa.column('id'),
+        sa.column('parent_id'),
+        sa.column('name'),
+        sa.column('mtime_utc'),
+    )
+    bind = op.get_bind()
+    duplicates = sa.select(files.c.parent_id, files.c.name) \
+        .where(files.c.parent_id != None) \
+        .group_by(files.c.parent_id, files.c.name) \
+        .having(sa.func.count() > 1)
+    for parent_id, name in bind.execute(duplicates).all():
+        taken = set(bind.execute(sa.select(files.c.name).where(files.c.parent_id == parent_id)).scalars())
+        siblings = bind.execute(sa.select(files.c.id)
+            .where(files.c.parent_id == parent_id)
+            .where(files.c.name == name)
+            .order_by(files.c.mtime_utc.desc())).scalars().all()
+        for id in siblings[1:]:
+            new_name = unique_name(name, taken)
+            taken.add(new_name)
+            bind.execute(sa.update(files).where(files.c.id == id).values(name=new_name))
+
+
+def backfill_paths() -> None:
+    files = sa.table('FileMetadata',
+        sa.column('id'),
+        sa.column('parent_id'),
+        sa.column('name'),
+        sa.column('path'),
+    )
+    bind = op.get_bind()
+    rows = bind.execute(sa.select(files.c.id, files.c.parent_id, files.c.name)).all()
+    children = {}
+    for id, parent_id, name in rows:
+        children.setdefault(parent_id, []).append((id, name))
+    pending = [(id, '/') for id, _ in children.get(None, [])]
+    while pending:
+        id, path = pending.pop()
+        bind.execute(sa.update(files).where(files.c.id == id).values(path=path))
+        for child_id, name in children.get(id, []):
+            pending.append((child_id, path.removesuffix('/') + '/' + name))
+
+
+def upgrade() -> None:
+    op.add_column('FileMetadata', sa.Column('path', sa.String(length=4095), nullable=False, server_default='/'))
+    rename_duplicates()
+    backfill_paths()
+    op.create_index('ix_FileMetadata_storage_path', 'FileMetadata', ['storage_id', 'path'], unique=False, mysql_length={'path': 255})
+    op.create_unique_constraint('uq_FileMetadata_parent_name', 'FileMetadata', ['parent_id', 'name'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_FileMetadata_parent_name', 'FileMetadata', type_='unique')
+    op.drop_index('ix_FileMetadata_storage_path', table_name='FileMetadata')
+    op.drop_column('FileMetadata', 'path')
@@ -0,0 +1,57 @@
+"""files-aggregates
+
+Revision ID: 7c2e5a9f14d8
+Revises: e4b09d7a21c6
+Create Date: 2026-10-18 16:20:08.402617
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2e5a9f14d8'
+down_revision = 'e4b09d7a21c6'
+branch_labels = None
+depends_on = None
+
+DIRECTORY_MIME = 'application/x-bcloud-dir'
+
+
+def backfill_aggregates() -> None:
+    files = sa.table('FileMetadata',
+        sa.column('id'),
+        sa.column('parent_id'),
+        sa.column('mime_type'),
+        sa.column('size'),
+        sa.column('tree_size'),
+        sa.column('tree_files'),
+        sa.column('tree_dirs'),
+    )
+    bind = op.get_bind()
+    rows = bind.execute(sa.select(files.c.id, files.c.parent_id, files.c.mime_type, files.c.size)).all()
+    parents = {id: parent_id for id, parent_id, _, _ in rows}
+    totals = {id: [0, 0, 0] for id, _, mime_type, _ in rows if mime_type == DIRECTORY_MIME}
+    for id, parent_id, mime_type, size in rows:
+        delta = (0, 0, 1) if mime_type == DIRECTORY_MIME else (size or 0, 1, 0)
+        while parent_id in totals:
+            total = totals[parent_id]
+            for i in range(3):
+                total[i] += delta[i]
+            parent_id = parents.get(parent_id)
+    for id, (tree_size, tree_files, tree_dirs) in totals.items():
+        if tree_size or tree_files or tree_dirs:
+            bind.execute(sa.update(files).where(files.c.id == id).values(tree_size=tree_size, tree_files=tree_files, tree_dirs=tree_dirs))
+
+
+def upgrade() -> None:
+    op.add_column('FileMetadata', sa.Column('tree_size', sa.BigInteger(), nullable=False, server_default='0'))
+    op.add_column('FileMetadata', sa.Column('tree_files', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('FileMetadata', sa.Column('tree_dirs', sa.Integer(), nullable=False, server_default='0'))
+    backfill_aggregates()
+
+
+def downgrade() -> None:
+    op.drop_column('FileMetadata', 'tree_dirs')
+    op.drop_column('FileMetadata', 'tree_files')
+    op.drop_column('FileMetadata', 'tree_size')
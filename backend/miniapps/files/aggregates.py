@@ -0,0 +1,25 @@
+import logging
+from sqlalchemy import select
+
+from .data import FileStorage
+from .tools.aggregates import reconcile
+
+from core.asyncjob.handlers import AsyncJobHandler
+
+logger = logging.getLogger(__name__)
+
+
+class ReconcileAggregatesHandler(AsyncJobHandler):
+    TYPE = "aggregates.reconcile"
+
+    def run(self):
+        with self.context.database.make_session() as session:
+            storage_ids = session.scalars(select(FileStorage.id)).all()
+        repaired = 0
+        for i, storage_id in enumerate(storage_ids):
+            with self.context.database.make_session() as session:
+                repaired += reconcile(session, storage_id)
+                session.commit()
+            self.set_progress((i + 1) / len(storage_ids))
+        if repaired:
+            logger.warning("Repaired drifted aggregates of %d directories", repaired)
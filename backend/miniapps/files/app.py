@@ -1,12 +1,16 @@
 import mimetypes
 
-from core.miniapp.miniapp import Miniapp, ModuleRegistry, SqlEventRegistry, ClassRegistry, MiniappContext
+from core.cronjob.schedule import Schedule
+from core.miniapp.miniapp import Miniapp, ModuleRegistry, SqlEventRegistry, ClassRegistry, AsyncjobRegistry, PeriodicJobRegistry, MiniappContext
 
+from .aggregates import ReconcileAggregatesHandler
+from .bulk import BulkHandler
 from .storage import StorageModule
 from .files import FilesModule, DeleteFileEvent
 from .contents import ContentsModule
-from .previews.module import PreviewModule
+from .previews.module import PreviewModule, PreviewContentsModule, PreviewIndexHandler
 from .importing import GoogleDriveImporter
+from .trandcoding.module import TranscodeModule, TranscodingHandler
 from .wopi import WopiModule, WopiMapping
 
 
@@ -19,7 +23,14 @@ class FilesMiniapp(Miniapp):
             ModuleRegistry(FilesModule),
             ModuleRegistry(ContentsModule),
             ModuleRegistry(PreviewModule),
+            ModuleRegistry(PreviewContentsModule),
+            ModuleRegistry(TranscodeModule),
             SqlEventRegistry(DeleteFileEvent),
+            AsyncjobRegistry(TranscodingHandler),
+            AsyncjobRegistry(ReconcileAggregatesHandler),
+            AsyncjobRegistry(BulkHandler),
+            AsyncjobRegistry(PreviewIndexHandler),
+            PeriodicJobRegistry(ReconcileAggregatesHandler, Schedule.daily()),
             ClassRegistry(GoogleDriveImporter),
             dependencies=["profile"],
         )
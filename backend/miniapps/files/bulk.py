@@ -0,0 +1,66 @@
+from dataclasses import dataclass
+from typing import List
+from uuid import UUID
+
+from .tools.files import FileManager
+
+from core.asyncjob.handlers import AsyncJobHandler
+from core.auth.data import Activity
+from core.data.sql.columns import utcnow_tz
+
+BATCH_SIZE = 256
+MAX_LOGGED_PATHS = 100
+
+
+@dataclass
+class BulkJob:
+    job_id: int
+
+
+class BulkHandler(AsyncJobHandler):
+    TYPE = "bulk"
+    PAYLOAD_SCHEMA = ["user_id", "operation", "paths"]
+    OPERATIONS = ("copy", "move", "delete")
+
+    def run(self):
+        user_id = UUID(self.context.get_payload("user_id", expected_type=str))
+        operation = self.context.get_payload("operation", expected_type=str)
+        if operation not in self.OPERATIONS:
+            raise ValueError(f"Unknown bulk operation '{operation}'")
+        dst = self.context.get_payload("dst", expected_type=str)
+        if operation != "delete" and dst is None:
+            raise ValueError("Missing destination")
+        paths = FileManager.outermost(self.context.get_payload("paths", default=[], expected_type=List[str]))
+        done = 0
+        failed: List[str] = []
+        for start in range(0, len(paths), BATCH_SIZE):
+            batch = paths[start:start + BATCH_SIZE]
+            with self.context.database.make_session() as session:
+                files = FileManager(self.context.blobs, user_id, session)
+                match operation:
+                    case "copy":
+                        copies, batch_failed = files.copy_many(batch, dst)  # type: ignore
+                        done += len(copies)
+                    case "move":
+                        moved, batch_failed = files.move_many(batch, dst)  # type: ignore
+                        done += len(moved)
+                    case _:
+                        deleted, batch_failed = files.delete_many(batch)
+                        done += deleted
+                session.commit()
+            failed.extend(batch_failed)
+            self.set_progress((start + len(batch)) / len(paths))
+        with self.context.database.make_session() as session:
+            session.add(Activity(
+                created_at_utc=utcnow_tz(),
+                issuer="files",
+                user_id=user_id,
+                type=f"files.bulk_{operation}",
+                payload={
+                    "count": done,
+                    "dst": dst,
+                    "paths": paths[:MAX_LOGGED_PATHS],
+                    "failed": failed[:MAX_LOGGED_PATHS],
+                },
+            ))
+            session.commit()
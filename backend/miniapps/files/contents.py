@@ -1,7 +1,23 @@
+import hashlib
+import os
+from tornado.ioloop import IOLoop
+
+from .data import FileMetadata
+from .previews.index import PreviewIndexStore, likely_archive
+from .previews.module import PreviewIndexHandler
 from .tools import fspath
+from .tools.archive import ArchiveWriter, TarArchiveWriter, ZipArchiveWriter
 from .tools.files import FileManager
+from .tools.listing import ListingSort
 
 from core.api.modules.rest import RestMiniappModule, get, post, ApiResponse
+from core.data.blobs.base import OpenMode
+from core.data.blobs.upload import BlobUpload
+from core.http.body import BufferedBody
+from core.http.ranges import ByteRange, RangeNotSatisfiableError, http_date, if_range_matches
+
+ARCHIVE_CHUNK_SIZE = 256 * 1024
+ARCHIVE_PAGE_SIZE = 256
 
 
 class ContentsModule(RestMiniappModule):
@@ -18,57 +34,174 @@ class ContentsModule(RestMiniappModule):
         return self.manager.contents
     
     def _url_to_path(self, url: str):
-        slash_idx = url.find("/")
-        if slash_idx < 0:
-            return url
-        storage_id = url[:slash_idx]
-        path = url[slash_idx:]
-        return fspath.join(storage_id, path)
-
-    def _read_internal(self, path: str, disposition_fmt: str) -> ApiResponse:
+        return fspath.from_url(url)
+
+    def _etag(self, file: FileMetadata):
+        mtime = int(file.mtime_utc.timestamp() * 1000000) if file.mtime_utc else 0
+        return f"\"{file.id.hex}-{mtime:x}-{file.size or 0:x}\""
+
+    async def _read_internal(self, path: str, disposition_fmt: str) -> ApiResponse|None:
         file = self.manager.by_path(path)
         if file is None:
             return ApiResponse(status=404)
+        etag = self._etag(file)
+        if self.request.headers.get("If-None-Match") == etag:
+            return ApiResponse(status=304, ETag=etag)
+        loop = IOLoop.current()
+        blob = self.contents.open(file, OpenMode.READ)
         try:
-            content = self.contents.read(file)
+            await loop.run_in_executor(None, blob.__enter__)
         except FileNotFoundError:
             return ApiResponse(status=204)
-        disposition = disposition_fmt.format(file.name)
-        response = ApiResponse()
-        response.set_header("Content-Disposition", disposition)
-        if file.mime_type:
-            response.set_header("Content-Type", file.mime_type)
-        if not content:
-            response.set_status(204)
-            response.set_header("Content-Length", str(0))
-        else:
-            response.set_status(200)
-            response.set_header("Content-Length", str(len(content)))
-            response.write(content)
-        return response
+        try:
+            size = await loop.run_in_executor(None, blob.seek, 0, os.SEEK_END)
+            file.accessed()
+            self.set_header("Content-Disposition", disposition_fmt.format(file.name))
+            if file.mime_type:
+                self.set_header("Content-Type", file.mime_type)
+            if size == 0:
+                self.set_status(204)
+                self.set_header("Content-Length", str(0))
+                return
+            self.set_header("Accept-Ranges", "bytes")
+            self.set_header("ETag", etag)
+            if file.mtime_utc:
+                self.set_header("Last-Modified", http_date(file.mtime_utc))
+            byte_range = None
+            if if_range_matches(self.request.headers.get("If-Range"), etag, file.mtime_utc):
+                try:
+                    byte_range = ByteRange.parse(self.request.headers.get("Range"), size)
+                except RangeNotSatisfiableError:
+                    self.clear_header("Content-Disposition")
+                    self.clear_header("Content-Type")
+                    return ApiResponse(status=416, **{"Content-Range": ByteRange.unsatisfied(size)})
+            if byte_range is None:
+                byte_range = ByteRange(0, size - 1)
+                self.set_status(200)
+            else:
+                self.set_status(206)
+                self.set_header("Content-Range", byte_range.content_range(size))
+                self.disable_compression()
+            self.set_header("Content-Length", str(byte_range.length))
+            if self.request.method != "HEAD":
+                await self.write_stream(blob, byte_range.start, byte_range.length)
+        finally:
+            await loop.run_in_executor(None, blob.__exit__, None, None, None)
 
-    @get("/api/files/contents/(.*)", name="files.contents.read")
-    def read_content(self, path: str) -> ApiResponse:
+    @get("/api/files/contents/(.*)", name="files.contents.read", head=True)
+    async def read_content(self, path: str):
         path = self._url_to_path(path)
-        return self._read_internal(path, "inline")
+        return await self._read_internal(path, "inline")
 
-    @post("/api/files/contents/(.*)", name="files.contents.write")
-    def write_content(self, path: str):
-        if self.request.files:
-            content = self.request.files["file"][0]["body"]
-        else:
-            content = self.request.body
-        if content is None:
-            raise ValueError("No content provided")
+    def _open_upload(self, path: str):
+        file = self.manager.by_path(self._url_to_path(path))
+        if file is None:
+            return ApiResponse(status=404)
+        content_type = self.request.headers.get("Content-Type", "")
+        if content_type.startswith("multipart/form-data"):
+            return BufferedBody(self.request)
+        return self.contents.upload(file)
+
+    @post("/api/files/contents/(.*)", name="files.contents.write", body=_open_upload)
+    def write_content(self, path: str, body: BlobUpload|BufferedBody):
         path = self._url_to_path(path)
         file = self.manager.by_path(path)
         if file is None:
             return ApiResponse(status=404)
-        mime_type = self.request.headers.get("Content-Type")
-        self.contents.write(file, content, mime_type=mime_type)
-        self.log_activity("files.write", {"path": file.abspath, "mime": file.mime_type, "size": len(content)})
+        if isinstance(body, BlobUpload):
+            mime_type = self.request.headers.get("Content-Type")
+            self.contents.complete_upload(file, body, mime_type=mime_type)
+            size, digest = body.size, body.digest
+        else:
+            if not self.request.files:
+                raise ValueError("No content provided")
+            content_file = self.request.files["file"][0]
+            content = content_file["body"]
+            self.contents.write(file, content, mime_type=content_file.get("content_type"))
+            size, digest = len(content), hashlib.sha256(content).hexdigest()
+        PreviewIndexStore(self.context.blobs).invalidate(file)
+        if likely_archive(file):
+            self.context.asyncjobs.schedule("files", PreviewIndexHandler.TYPE, {"file_id": str(file.id)})
+        self.log_activity("files.write", {"path": file.abspath, "mime": file.mime_type, "size": size, "sha256": digest})
 
-    @get("/api/files/download/(.*)", name="files.contents.download")
-    def download_content(self, path: str) -> ApiResponse:
+    @get("/api/files/download/(.*)", name="files.contents.download", head=True)
+    async def download_content(self, path: str):
         path = self._url_to_path(path)
-        return self._read_internal(path, "attachment; filename=\"{}\"")
+        return await self._read_internal(path, "attachment; filename=\"{}\"")
+
+    def _archive_writer(self, format: str) -> ArchiveWriter|None:
+        match format:
+            case "zip":
+                return ZipArchiveWriter(deflate=True)
+            case "zip-store":
+                return ZipArchiveWriter(deflate=False)
+            case "tar":
+                return TarArchiveWriter()
+        return None
+
+    async def _archive_drain(self, writer: ArchiveWriter):
+        data = writer.take()
+        if data:
+            self.write(data)
+            await self.flush()
+
+    def _archive_pump(self, blob, writer: ArchiveWriter):
+        chunk = blob.read(ARCHIVE_CHUNK_SIZE)
+        if chunk:
+            writer.write(chunk)
+        return len(chunk)
+
+    async def _archive_file(self, writer: ArchiveWriter, file: FileMetadata, name: str):
+        loop = IOLoop.current()
+        blob = self.contents.open(file, OpenMode.READ)
+        try:
+            await loop.run_in_executor(None, blob.__enter__)
+        except FileNotFoundError:
+            writer.begin_file(name, 0, file.mtime_utc)
+            writer.end_file()
+            return
+        try:
+            size = await loop.run_in_executor(None, blob.seek, 0, os.SEEK_END)
+            await loop.run_in_executor(None, blob.seek, 0)
+            writer.begin_file(name, size, file.mtime_utc)
+            # compression runs in the executor together with the read
+            while await loop.run_in_executor(None, self._archive_pump, blob, writer):
+                await self._archive_drain(writer)
+            writer.end_file()
+        finally:
+            await loop.run_in_executor(None, blob.__exit__, None, None, None)
+
+    @get("/api/files/archive/(.*)", name="files.contents.archive", head=True)
+    async def download_archive(self, path: str):
+        path = self._url_to_path(path)
+        dir = self.manager.by_path(path)
+        if dir is None or not dir.isdir:
+            return ApiResponse(status=404)
+        writer = self._archive_writer(self.get_query_argument("format", "zip"))
+        if writer is None:
+            return ApiResponse(status=400)
+        self.set_header("Content-Type", writer.MIME_TYPE)
+        self.set_header("Content-Disposition", f"attachment; filename=\"{dir.name}{writer.EXTENSION}\"")
+        self.disable_compression()
+        if self.request.method == "HEAD":
+            return
+        prefix_length = len(dir.path.removesuffix(fspath.SEP))
+        writer.add_dir(dir.name, dir.mtime_utc)
+        cursor = None
+        while True:
+            # the subtree is read a page at a time, in path order, like a walk of the tree
+            listing = self.manager.list(path, ListingSort.NAME, recursive=True, cursor=cursor, limit=ARCHIVE_PAGE_SIZE)
+            for file in listing.items:
+                name = dir.name + file.path[prefix_length:]
+                if file.isdir:
+                    writer.add_dir(name, file.mtime_utc)
+                elif file.isfile:
+                    await self._archive_file(writer, file, name)
+                await self._archive_drain(writer)
+                self.session.expunge(file)
+            cursor = listing.next_cursor
+            if cursor is None:
+                break
+        writer.close()
+        await self._archive_drain(writer)
+        self.log_activity("files.archive", {"path": dir.abspath})
@@ -1,6 +1,7 @@
 from datetime import datetime, timezone
 from enum import Enum as PyEnum
-from sqlalchemy import ForeignKey, Enum
+from sqlalchemy import BigInteger, ForeignKey, Enum, Index, UniqueConstraint, select
+from sqlalchemy.orm import object_session
 from typing import Generator, List, Tuple, Optional
 from uuid import UUID as PyUUID, uuid4
 
@@ -9,7 +10,7 @@ from .tools import fspath
 from core.auth.access import AccessLevel, access_info
 from core.auth.data import User
 from core.auth.owner import owner_info
-from core.data.sql.columns import DateTime, Integer, String, UUID
+from core.data.sql.columns import DateTime, Integer, String, UUID, STRING_MAX
 from core.data.sql.columns import Mapped, mapped_column, relationship
 from core.data.sql.database import Model
 from core.data.sql.slugs import SLUG_LENGTH, slug_info
@@ -29,10 +30,18 @@ class FileType(PyEnum):
 
 class FileMetadata(Model):
     __tablename__ = "FileMetadata"
+    __table_args__ = (
+        UniqueConstraint("parent_id", "name", name="uq_FileMetadata_parent_name"),
+        Index("ix_FileMetadata_storage_path", "storage_id", "path", mysql_length={"path": 255}),
+    )
     id: Mapped[PyUUID] = mapped_column(UUID, primary_key=True, default=uuid4)
     name: Mapped[str] = mapped_column(String(512))
     mime_type: Mapped[str|None] = mapped_column(String(MIME_MAX_LENGTH), default=None, nullable=True)
     size: Mapped[int|None] = mapped_column(Integer, default=None, nullable=True)
+    path: Mapped[str] = mapped_column(String(STRING_MAX), default=fspath.SEP)
+    tree_size: Mapped[int] = mapped_column(BigInteger, default=0)
+    tree_files: Mapped[int] = mapped_column(Integer, default=0)
+    tree_dirs: Mapped[int] = mapped_column(Integer, default=0)
     parent_id: Mapped[PyUUID|None] = mapped_column(ForeignKey("FileMetadata.id", onupdate="CASCADE", ondelete="CASCADE"), nullable=True, default=None)
     parent: Mapped["FileMetadata"] = relationship("FileMetadata", remote_side=[id])
     children: Mapped[List["FileMetadata"]] = relationship("FileMetadata", uselist=True, back_populates="parent")
@@ -54,8 +63,8 @@ class FileMetadata(Model):
         return self.storage.user
 
     @property
-    def total_size(self) -> int:
-        return sum(c.total_size for c in self.children) + (self.size or 0)
+    def total_size(self) -> float:
+        return (self.size or 0) + (self.tree_size or 0)
     
     @property
     def isroot(self) -> bool:
@@ -83,23 +92,25 @@ class FileMetadata(Model):
     
     @property
     def abspath(self) -> str:
-        parts = []
-        file = self
-        while file and not file.isroot:
-            parts.append(file.name)
-            file = file.parent
-        parts.reverse()
-        storage_id = self.storage.id
-        return fspath.join(storage_id, *parts)
+        return fspath.join(self.storage.id, self.path)
+
+    def child_path(self, name: str) -> str:
+        return self.path.removesuffix(fspath.SEP) + fspath.SEP + name
+
+    def ancestor_paths(self) -> List[str]:
+        _, parts = fspath.get_parts(self.path)
+        return [fspath.SEP + fspath.SEP.join(parts[:i]) for i in range(len(parts))]
     
     def get_child(self, name) -> Optional["FileMetadata"]:
         if self.islink:
             raise NotImplementedError()
-        else:
-            target = self
-        for child in target.children:
-            if child.name == name:
-                return child
+        session = object_session(self)
+        if session is None:
+            return next((c for c in self.children if c.name == name), None)
+        statement = select(FileMetadata) \
+            .where(FileMetadata.parent_id == self.id) \
+            .where(FileMetadata.name == name)
+        return session.scalars(statement).one_or_none()
 
     def walk(self) -> Generator[Tuple["FileMetadata", List["FileMetadata"], List["FileMetadata"]], None, None]:
         stack: List["FileMetadata"] = [self]
@@ -130,5 +141,13 @@ class FileStorage(Model):
     root_dir: Mapped[FileMetadata] = relationship(FileMetadata, uselist=False, back_populates="root_storage", foreign_keys=[FileMetadata.root_storage_id])
 
     @property
-    def total_size(self) -> int:
+    def total_size(self) -> float:
         return self.root_dir.total_size
+
+    @property
+    def total_files(self) -> int:
+        return self.root_dir.tree_files
+
+    @property
+    def total_dirs(self) -> int:
+        return self.root_dir.tree_dirs
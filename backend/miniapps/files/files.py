@@ -1,12 +1,19 @@
 from sqlalchemy.orm import Session
+from typing import List
 from uuid import UUID
 
 
+from .bulk import BulkHandler, BulkJob
 from .data import FileMetadata
+from .previews.index import PreviewIndexStore, likely_archive
+from .tools import fspath
+from .tools.errors import StorageNotSpecified
 from .tools.files import FileManager
+from .tools.listing import FileListing, ListingSort
 
 from core.api.modules.gql import GqlMiniappModule, query, mutation
 from core.auth.access import AccessLevel
+from core.auth.handlers import AuthError
 from core.graphql.result import SuccessResult
 from core.miniapp.sql import MiniappSqlEvent
 
@@ -31,6 +38,19 @@ class FilesModule(GqlMiniappModule):
     @query()
     def exists(self, path: str) -> SuccessResult:
         return SuccessResult(self.manager.exists(path))
+
+    @query()
+    def list(
+        self,
+        path: str,
+        sort: ListingSort = ListingSort.NAME,
+        descending: bool = False,
+        mime_types: List[str]|None = None,
+        recursive: bool = False,
+        cursor: str|None = None,
+        limit: int|None = None,
+    ) -> FileListing:
+        return self.manager.list(path, sort, descending, mime_types, recursive, cursor, limit)
     
     @mutation()
     def makefile(self, path: str, mime_type: str|None = None) -> FileMetadata:
@@ -67,6 +87,38 @@ class FilesModule(GqlMiniappModule):
         self.log_activity("files.rename", {"src": src, "dst": dst})
         return self.manager.rename(src, dst)
 
+    @mutation()
+    def copy_many(self, paths: List[str], dst: str) -> BulkJob:
+        return self.__schedule_bulk("copy", paths, dst)
+
+    @mutation()
+    def move_many(self, paths: List[str], dst: str) -> BulkJob:
+        return self.__schedule_bulk("move", paths, dst)
+
+    @mutation()
+    def delete_many(self, paths: List[str]) -> BulkJob:
+        return self.__schedule_bulk("delete", paths)
+
+    def __schedule_bulk(self, operation: str, paths: List[str], dst: str|None = None):
+        if self.user_id is None:
+            raise AuthError()
+        # storages are checked once here, so a foreign path fails the mutation instead of the job
+        storage_ids = set()
+        for path in [*paths, dst] if dst else paths:
+            storage_id, _ = fspath.strip_storage(path)
+            if storage_id is None:
+                raise StorageNotSpecified(path)
+            storage_ids.add(storage_id)
+        for storage_id in storage_ids:
+            self.manager.storage.get(storage_id)
+        job_id = self.context.asyncjobs.schedule("files", BulkHandler.TYPE, {
+            "user_id": str(self.user_id),
+            "operation": operation,
+            "paths": paths,
+            "dst": dst,
+        })
+        return BulkJob(job_id)
+
     @mutation()
     def set_access(self, path: str, access: AccessLevel) -> FileMetadata:
         file = self.manager.by_path(path)
@@ -89,3 +141,5 @@ class DeleteFileEvent(MiniappSqlEvent):
             if manager is None:
                 manager = FileManager.for_service(self.context.blobs, session)
             manager.contents.delete(entity)
+            if likely_archive(entity):
+                PreviewIndexStore(self.context.blobs).invalidate(entity)
@@ -1,10 +1,14 @@
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 from dataclasses import dataclass
-import io
-from typing import List, BinaryIO
+from threading import Lock
+from typing import Any, BinaryIO, Dict, List, Tuple
 
 import mimetypes
-mimetypes.guess_type
+
+HEADER_SIZE = 512
+SKIP_CHUNK_SIZE = 256 * 1024
+INDEX_CACHE_SIZE = 64
 
 
 @dataclass
@@ -20,9 +24,36 @@ class ArchiveFileList:
 
 
 @dataclass
-class ArchiveFileContent:
-    data: bytes
-    mime: str|None = None
+class ArchiveMember:
+    path: str
+    size: int|None
+    # start of the member data within the (decompressed) stream, None if it cannot be seeked to
+    offset: int|None = None
+
+
+@dataclass
+class ArchiveIndex:
+    format: str
+    compression: str|None
+    members: List[ArchiveMember]
+
+    def member(self, path: str):
+        return next((m for m in self.members if m.path == path), None)
+
+    def file_list(self):
+        return ArchiveFileList([ArchiveFile(m.path, mimetypes.guess_type(m.path)[0], m.size) for m in self.members])
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "format": self.format,
+            "compression": self.compression,
+            "members": [[m.path, m.size, m.offset] for m in self.members],
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]):
+        members = [ArchiveMember(path, size, offset) for path, size, offset in data["members"]]
+        return cls(data["format"], data["compression"], members)
 
 
 class UnknownArchiveError(Exception):
@@ -30,108 +61,253 @@ class UnknownArchiveError(Exception):
         super().__init__("Unknown archive type")
 
 
-class ArchivePreview(ABC):
-    MULTIFILE: bool
+class MemberReader:
+    """Reads at most `size` bytes of a stream, closing whatever was opened for it afterwards"""
+    stream: BinaryIO
+    remaining: int|None
+    closables: List[Any]
+
+    def __init__(self, stream: BinaryIO, size: int|None, *closables: Any):
+        self.stream = stream
+        self.remaining = size
+        self.closables = list(closables)
+
+    def read(self, n: int = -1) -> bytes:
+        if self.remaining is not None:
+            if n is None or n < 0 or n > self.remaining:
+                n = self.remaining
+        data = self.stream.read(n)
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        return data
+
+    def close(self):
+        for closable in reversed(self.closables):
+            closable.close()
+        self.closables = []
+
+    def __enter__(self):
+        return self
 
-    blob: BinaryIO
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
-    def __init__(self, blob: BinaryIO):
-        self.blob = blob
 
+def seek_forward(stream: BinaryIO, offset: int):
+    """Decompressing streams emulate seeking, skipping ahead in chunks keeps the memory bounded"""
+    position = stream.tell()
+    if offset < position:
+        stream.seek(0)
+        position = 0
+    while position < offset:
+        skipped = len(stream.read(min(SKIP_CHUNK_SIZE, offset - position)))
+        if not skipped:
+            raise EOFError("Archive ended before the member")
+        position += skipped
+
+
+class Compression(ABC):
+    NAME: str
+    MAGIC: bytes
+
+    @classmethod
+    def sniff(cls, header: bytes):
+        for compression in Compression.__subclasses__():
+            if header.startswith(compression.MAGIC):
+                return compression
+        return None
+
+    @classmethod
+    def by_name(cls, name: str|None):
+        return next((c for c in Compression.__subclasses__() if c.NAME == name), None)
+
+    @classmethod
     @abstractmethod
-    def _unarchive(self) -> BinaryIO:
+    def open(cls, blob: BinaryIO) -> BinaryIO:
         ...
 
+
+class ArchivePreview(ABC):
+    FORMAT: str
+    MAGIC: List[Tuple[int, bytes]]
+
+    @classmethod
+    def sniff(cls, header: bytes):
+        for preview in ArchivePreview.__subclasses__():
+            if any(header[offset:offset + len(magic)] == magic for offset, magic in preview.MAGIC):
+                return preview
+        return None
+
+    @classmethod
+    def by_format(cls, format: str):
+        for preview in ArchivePreview.__subclasses__():
+            if preview.FORMAT == format:
+                return preview
+        raise UnknownArchiveError()
+
+    @classmethod
     @abstractmethod
-    def _list_files(self) -> List[ArchiveFile]:
+    def _index(cls, stream: BinaryIO, name: str, compressed: bool) -> List[ArchiveMember]:
         ...
-    
+
+    @classmethod
     @abstractmethod
-    def _read_file(self, path: str) -> ArchiveFileContent:
+    def _open_member(cls, stream: BinaryIO, member: ArchiveMember, *closables: Any) -> MemberReader:
         ...
-    
-    @classmethod
-    def _open(cls, blob: BinaryIO) -> "ArchivePreview":
-        for cls in ArchivePreview.__subclasses__():
-            try:
-                obj = cls(blob)
-                if obj.MULTIFILE:
-                   return obj
-                else:
-                    unarchived_blob = obj._unarchive()
-                    return cls._open(unarchived_blob)
-            except:
-                pass
-        raise UnknownArchiveError()
-    
+
     @classmethod
-    def list_files(cls, blob: BinaryIO):
-        return ArchiveFileList(cls._open(blob)._list_files())
-    
+    def index(cls, blob: BinaryIO, name: str):
+        """Identifies the archive by its magic bytes and lists its members in a single pass"""
+        header = blob.read(HEADER_SIZE)
+        blob.seek(0)
+        compression = Compression.sniff(header)
+        stream = blob
+        if compression is not None:
+            stream = compression.open(blob)
+            header = stream.read(HEADER_SIZE)
+            stream.seek(0)
+        preview = cls.sniff(header)
+        if preview is None:
+            if compression is None:
+                raise UnknownArchiveError()
+            preview = RawArchivePreview
+        try:
+            members = preview._index(stream, name, compression is not None)
+        finally:
+            if stream is not blob:
+                stream.close()
+        return ArchiveIndex(preview.FORMAT, compression and compression.NAME, members)
+
     @classmethod
-    def read_file(cls, blob: BinaryIO, path: str):
-        return cls._open(blob)._read_file(path)
+    def open_member(cls, blob: BinaryIO, index: ArchiveIndex, member: ArchiveMember):
+        compression = Compression.by_name(index.compression)
+        preview = cls.by_format(index.format)
+        if compression is None:
+            if member.offset is not None:
+                # a plain archive seeks straight to the member, only decompressed streams have to skip ahead
+                blob.seek(member.offset)
+            return preview._open_member(blob, member)
+        stream = compression.open(blob)
+        try:
+            return preview._open_member(stream, member, stream)
+        except:
+            stream.close()
+            raise
+
+
+class ArchiveIndexCache:
+    """Least recently used member indices, keyed by the file and its version"""
+    entries: "OrderedDict[str, ArchiveIndex]"
+    capacity: int
+    _lock: Lock
+
+    def __init__(self, capacity: int = INDEX_CACHE_SIZE):
+        self.entries = OrderedDict()
+        self.capacity = capacity
+        self._lock = Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            index = self.entries.get(key)
+            if index is not None:
+                self.entries.move_to_end(key)
+            return index
+
+    def put(self, key: str, index: ArchiveIndex):
+        with self._lock:
+            self.entries[key] = index
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
 
 
 import zipfile
 class ZipArchivePreview(ArchivePreview):
-    MULTIFILE = True
+    FORMAT = "zip"
+    MAGIC = [(0, b"PK\x03\x04"), (0, b"PK\x05\x06")]
 
-    def _list_files(self):
-        result: List[ArchiveFile] = []
-        with zipfile.ZipFile(self.blob) as zf:
-            for file in zf.filelist:
-                result.append(ArchiveFile(file.filename, size=file.file_size))
-        return result
-    
-    def _read_file(self, path: str):
-        with zipfile.ZipFile(self.blob) as zf:
-            with zf.open(path) as fh:
-                return ArchiveFileContent(fh.read())
+    @classmethod
+    def _index(cls, stream: BinaryIO, name: str, compressed: bool):
+        with zipfile.ZipFile(stream) as zf:
+            return [ArchiveMember(info.filename, info.file_size) for info in zf.infolist()]
+
+    @classmethod
+    def _open_member(cls, stream: BinaryIO, member: ArchiveMember, *closables: Any):
+        zf = zipfile.ZipFile(stream)
+        try:
+            fh = zf.open(member.path)
+        except:
+            zf.close()
+            raise
+        return MemberReader(fh, member.size, *closables, zf, fh)  # type: ignore
 
 
 import tarfile
 class TarArchivePreview(ArchivePreview):
-    MULTIFILE = True
+    FORMAT = "tar"
+    MAGIC = [(257, b"ustar")]
 
-    def _list_files(self):
-        result: List[ArchiveFile] = []
-        with tarfile.open(fileobj=self.blob) as tf:
-            for file in tf.getmembers():
-                result.append(ArchiveFile(file.name, size=file.size))
+    @classmethod
+    def _index(cls, stream: BinaryIO, name: str, compressed: bool):
+        result: List[ArchiveMember] = []
+        # a plain archive seeks from header to header, stream mode reads a decompressed one once from start to end
+        with tarfile.open(fileobj=stream, mode="r|" if compressed else "r:") as tf:
+            for info in tf:
+                offset = info.offset_data if info.isfile() else None
+                result.append(ArchiveMember(info.name, info.size, offset))
         return result
-    
-    def _read_file(self, path: str):
-        with tarfile.open(fileobj=self.blob) as tf:
-            fh = tf.extractfile(path)
-            if fh is None:
-                raise FileNotFoundError(path)
-            with fh:
-                return ArchiveFileContent(fh.read())
+
+    @classmethod
+    def _open_member(cls, stream: BinaryIO, member: ArchiveMember, *closables: Any):
+        if member.offset is None:
+            raise FileNotFoundError(member.path)
+        seek_forward(stream, member.offset)
+        return MemberReader(stream, member.size, *closables)
+
+
+class RawArchivePreview(ArchivePreview):
+    """A single compressed file, previewed as an archive holding just that file"""
+    FORMAT = "raw"
+    MAGIC = []
+
+    @classmethod
+    def _index(cls, stream: BinaryIO, name: str, compressed: bool):
+        size = 0
+        while chunk := stream.read(SKIP_CHUNK_SIZE):
+            size += len(chunk)
+        path = name.rsplit(".", 1)[0] if "." in name else name
+        return [ArchiveMember(path, size, 0)]
+
+    @classmethod
+    def _open_member(cls, stream: BinaryIO, member: ArchiveMember, *closables: Any):
+        return MemberReader(stream, member.size, *closables)
 
 
 import gzip
-class GZipArchivePreview(ArchivePreview):
-    MULTIFILE = False
+class GZipCompression(Compression):
+    NAME = "gzip"
+    MAGIC = b"\x1f\x8b"
 
-    def _unarchive(self):
-        with gzip.open(self.blob) as fh:
-            return io.BytesIO(fh.read())
+    @classmethod
+    def open(cls, blob: BinaryIO):
+        return gzip.GzipFile(fileobj=blob, mode="rb")  # type: ignore
 
 
 import bz2
-class Bz2ArchivePreview(ArchivePreview):
-    MULTIFILE = False
-    
-    def _unarchive(self):
-        with bz2.open(self.blob) as fh:
-            return io.BytesIO(fh.read())
+class Bz2Compression(Compression):
+    NAME = "bz2"
+    MAGIC = b"BZh"
+
+    @classmethod
+    def open(cls, blob: BinaryIO):
+        return bz2.BZ2File(blob, mode="rb")  # type: ignore
 
 
 import lzma
-class LzmaArchivePreview(ArchivePreview):
-    MULTIFILE = False
-    
-    def _unarchive(self):
-        with lzma.open(self.blob) as fh:
-            return io.BytesIO(fh.read())
+class LzmaCompression(Compression):
+    NAME = "xz"
+    MAGIC = b"\xfd7zXZ\x00"
+
+    @classmethod
+    def open(cls, blob: BinaryIO):
+        return lzma.LZMAFile(blob, mode="rb")  # type: ignore
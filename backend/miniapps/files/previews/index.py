@@ -0,0 +1,73 @@
+import json
+from typing import BinaryIO, Callable
+
+from .archives import ArchiveIndex, ArchiveIndexCache, ArchivePreview
+
+from ..data import FileMetadata
+from ..tools import fspath
+from ..tools.contents import FileContents, NAMESPACE_PREVIEW_INDEX
+
+from core.data.blobs.base import Blobs
+
+# only these are indexed ahead of time, anything else is still sniffed when previewed
+INDEXED_EXTENSIONS = {".zip", ".jar", ".tar", ".tgz", ".tbz2", ".txz", ".gz", ".bz2", ".xz"}
+
+memory_cache = ArchiveIndexCache()
+
+
+def likely_archive(file: FileMetadata):
+    return not file.isdir and fspath.ext(file.name).lower() in INDEXED_EXTENSIONS
+
+
+def index_version(file: FileMetadata):
+    mtime = int(file.mtime_utc.timestamp() * 1000000) if file.mtime_utc else 0
+    return f"{file.id.hex}-{mtime:x}-{file.size or 0:x}"
+
+
+class PreviewIndexStore:
+    """Member indices of archives, persisted next to the contents and kept per file version"""
+    contents: FileContents
+
+    def __init__(self, blobs: Blobs):
+        self.contents = FileContents(blobs, NAMESPACE_PREVIEW_INDEX)
+
+    def __address(self, file: FileMetadata):
+        # keyed by the id rather than the path, so the index survives renames and moves
+        return self.contents.address(fspath.join(file.storage_id, file.id.hex))
+
+    def load(self, file: FileMetadata):
+        version = index_version(file)
+        index = memory_cache.get(version)
+        if index is not None:
+            return index
+        try:
+            data = json.loads(self.contents.blobs.read(self.__address(file)))
+        except (FileNotFoundError, ValueError):
+            return None
+        if data.get("version") != version:
+            return None
+        index = ArchiveIndex.from_json(data["index"])
+        memory_cache.put(version, index)
+        return index
+
+    def save(self, file: FileMetadata, index: ArchiveIndex):
+        version = index_version(file)
+        data = json.dumps({"version": version, "index": index.to_json()})
+        self.contents.blobs.write(self.__address(file), data.encode("utf-8"))
+        memory_cache.put(version, index)
+
+    def invalidate(self, file: FileMetadata):
+        self.contents.blobs.delete(self.__address(file))
+
+    def build(self, file: FileMetadata, blob: BinaryIO):
+        index = ArchivePreview.index(blob, file.name)
+        self.save(file, index)
+        return index
+
+    def get(self, file: FileMetadata, open_blob: Callable[[], BinaryIO]):
+        """Returns the index of the archive, only reading the archive itself when nothing is stored for its version"""
+        index = self.load(file)
+        if index is None:
+            with open_blob() as blob:
+                index = self.build(file, blob)
+        return index
@@ -1,12 +1,22 @@
-from .archives import ArchiveFileList, ArchivePreview
+import mimetypes
+from tornado.ioloop import IOLoop
+from uuid import UUID
 
+from .archives import ArchiveFileList, ArchivePreview, UnknownArchiveError
+from .index import PreviewIndexStore
+
+from ..data import FileMetadata
+from ..tools import fspath
 from ..tools.files import FileManager
 
 from core.api.modules.rest import ApiResponse, RestMiniappModule, get
 from core.api.modules.gql import GqlMiniappModule, query
+from core.asyncjob.handlers import AsyncJobHandler
 from core.auth.handlers import AuthError
 from core.data.blobs.base import OpenMode
 
+STREAM_CHUNK_SIZE = 256 * 1024
+
 
 class PreviewModule(GqlMiniappModule):
     _manager: FileManager|None = None
@@ -24,8 +34,8 @@ class PreviewModule(GqlMiniappModule):
         file = self.manager.by_path(path)
         if file is None:
             raise FileNotFoundError(path)
-        with self.manager.contents.open(file, OpenMode.READ) as blob:
-            return ArchivePreview.list_files(blob)
+        store = PreviewIndexStore(self.context.blobs)
+        return store.get(file, lambda: self.manager.contents.open(file, OpenMode.READ)).file_list()
 
 
 class PreviewContentsModule(RestMiniappModule):
@@ -40,13 +50,57 @@ class PreviewContentsModule(RestMiniappModule):
         return self._manager
 
     @get("/api/files/preview/(.*)", name="files.preview.read")
-    def archive_file(self, path: str):
-        file = self.manager.by_path(path)
+    async def archive_file(self, path: str):
+        member_path = self.get_query_argument("member")
+        file = self.manager.by_path(fspath.from_url(path))
         if file is None:
-            raise FileNotFoundError(path)
-        with self.manager.contents.open(file, OpenMode.READ) as blob:
-            file_contents = ArchivePreview.read_file(blob, path)
-            response = ApiResponse()
-            response.content = file_contents.data
-            response.add_header("Content-Type", file_contents.mime or "application/octet-stream")
-            return response
+            return ApiResponse(status=404)
+        loop = IOLoop.current()
+        blob = self.manager.contents.open(file, OpenMode.READ)
+        try:
+            await loop.run_in_executor(None, blob.__enter__)
+        except FileNotFoundError:
+            return ApiResponse(status=404)
+        try:
+            store = PreviewIndexStore(self.context.blobs)
+            index = await loop.run_in_executor(None, store.load, file)
+            if index is None:
+                index = await loop.run_in_executor(None, store.build, file, blob)
+            member = index.member(member_path)
+            if member is None:
+                return ApiResponse(status=404)
+            reader = await loop.run_in_executor(None, ArchivePreview.open_member, blob, index, member)
+            try:
+                mime, _ = mimetypes.guess_type(member.path)
+                self.set_header("Content-Type", mime or "application/octet-stream")
+                if member.size is not None:
+                    self.set_header("Content-Length", str(member.size))
+                while chunk := await loop.run_in_executor(None, reader.read, STREAM_CHUNK_SIZE):
+                    self.write(chunk)
+                    await self.flush()
+            finally:
+                await loop.run_in_executor(None, reader.close)
+        finally:
+            await loop.run_in_executor(None, blob.__exit__, None, None, None)
+
+
+class PreviewIndexHandler(AsyncJobHandler):
+    """Indexes a freshly written archive, so that the first preview does not have to"""
+    TYPE = "previews.index"
+    PAYLOAD_SCHEMA = ["file_id"]
+
+    def run(self):
+        file_id = UUID(self.context.get_payload("file_id", expected_type=str))
+        with self.context.database.make_session() as session:
+            files = FileManager.for_service(self.context.blobs, session)
+            file = session.get(FileMetadata, file_id)
+            if file is None or file.isdir:
+                return
+            store = PreviewIndexStore(self.context.blobs)
+            if store.load(file) is not None:
+                return
+            try:
+                with files.contents.open(file, OpenMode.READ) as blob:
+                    store.build(file, blob)
+            except (FileNotFoundError, UnknownArchiveError):
+                pass
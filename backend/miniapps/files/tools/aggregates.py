@@ -0,0 +1,94 @@
+from dataclasses import dataclass
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+from typing import Dict, List
+from uuid import UUID
+
+from ..data import FileMetadata, DIRECTORY_MIME
+
+
+@dataclass
+class TreeTotals:
+    size: int = 0
+    files: int = 0
+    dirs: int = 0
+
+    def __neg__(self):
+        return TreeTotals(-self.size, -self.files, -self.dirs)
+
+    def __iadd__(self, other: "TreeTotals"):
+        self.size += other.size
+        self.files += other.files
+        self.dirs += other.dirs
+        return self
+
+    @classmethod
+    def of(cls, file: FileMetadata):
+        """Totals of the file, including everything below it if it is a directory"""
+        if file.isdir:
+            return cls(file.tree_size or 0, file.tree_files or 0, (file.tree_dirs or 0) + 1)
+        return cls(file.size or 0, 1, 0)
+
+
+def propagate(session: Session, file: FileMetadata, totals: TreeTotals, include_self: bool = False):
+    """Adds the totals to the aggregates of every directory above the file"""
+    if not (totals.size or totals.files or totals.dirs):
+        return
+    ancestors = file.ancestor_paths()
+    if include_self:
+        ancestors.append(file.path)
+    if not ancestors:
+        return
+    statement = update(FileMetadata) \
+        .where(FileMetadata.storage_id == file.storage.id) \
+        .where(FileMetadata.path.in_(ancestors)) \
+        .values(
+            tree_size=FileMetadata.tree_size + totals.size,
+            tree_files=FileMetadata.tree_files + totals.files,
+            tree_dirs=FileMetadata.tree_dirs + totals.dirs) \
+        .execution_options(synchronize_session="evaluate")
+    session.execute(statement)
+
+
+def reconcile(session: Session, storage_id: UUID):
+    """Recomputes the aggregates of every directory in the storage, returns how many had drifted"""
+    # every propagation also updates the root, locking it keeps them out until the storage is done
+    statement = select(FileMetadata.id) \
+        .where(FileMetadata.root_storage_id == storage_id) \
+        .with_for_update()
+    if session.scalars(statement).one_or_none() is None:
+        return 0
+    statement = select(
+        FileMetadata.id,
+        FileMetadata.parent_id,
+        FileMetadata.mime_type,
+        FileMetadata.size,
+        FileMetadata.tree_size,
+        FileMetadata.tree_files,
+        FileMetadata.tree_dirs,
+    ).where(FileMetadata.storage_id == storage_id)
+    rows = session.execute(statement).all()
+    parents: Dict[UUID, UUID|None] = {row.id: row.parent_id for row in rows}
+    totals: Dict[UUID, TreeTotals] = {row.id: TreeTotals() for row in rows if row.mime_type == DIRECTORY_MIME}
+    for row in rows:
+        isdir = row.mime_type == DIRECTORY_MIME
+        size, files, dirs = (0, 0, 1) if isdir else (row.size or 0, 1, 0)
+        parent_id = row.parent_id
+        while parent_id is not None:
+            total = totals.get(parent_id)
+            if total is None:
+                break
+            total.size += size
+            total.files += files
+            total.dirs += dirs
+            parent_id = parents.get(parent_id)
+    repairs: List[dict] = []
+    for row in rows:
+        total = totals.get(row.id)
+        if total is None:
+            continue
+        if (row.tree_size, row.tree_files, row.tree_dirs) != (total.size, total.files, total.dirs):
+            repairs.append({"id": row.id, "tree_size": total.size, "tree_files": total.files, "tree_dirs": total.dirs})
+    if repairs:
+        session.execute(update(FileMetadata), repairs)
+    return len(repairs)
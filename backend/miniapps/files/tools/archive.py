@@ -0,0 +1,153 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+import tarfile
+from typing import IO
+import zipfile
+
+ZIP_MIN_DATE = (1980, 1, 1, 0, 0, 0)
+
+
+class ChunkSink:
+    """Write-only stream collecting the archive bytes until they are taken out"""
+    buffer: bytearray
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self.buffer.extend(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+class ArchiveWriter(ABC):
+    """Writes an archive sequentially, the output is taken out in chunks as it is produced"""
+    MIME_TYPE: str
+    EXTENSION: str
+
+    sink: ChunkSink
+
+    def __init__(self):
+        self.sink = ChunkSink()
+
+    def take(self):
+        return self.sink.take()
+
+    @abstractmethod
+    def add_dir(self, name: str, mtime: datetime):
+        ...
+
+    @abstractmethod
+    def begin_file(self, name: str, size: int, mtime: datetime):
+        ...
+
+    @abstractmethod
+    def write(self, data: bytes):
+        ...
+
+    @abstractmethod
+    def end_file(self):
+        ...
+
+    @abstractmethod
+    def close(self):
+        ...
+
+
+class ZipArchiveWriter(ArchiveWriter):
+    MIME_TYPE = "application/zip"
+    EXTENSION = ".zip"
+
+    zip: zipfile.ZipFile
+    compression: int
+    entry: IO[bytes]|None
+
+    def __init__(self, deflate: bool):
+        super().__init__()
+        self.compression = zipfile.ZIP_DEFLATED if deflate else zipfile.ZIP_STORED
+        # the sink cannot seek, so entries are written with trailing data descriptors
+        self.zip = zipfile.ZipFile(self.sink, "w", compression=self.compression)  # type: ignore
+        self.entry = None
+
+    def __info(self, name: str, mtime: datetime):
+        date_time = max(mtime.timetuple()[:6], ZIP_MIN_DATE)
+        info = zipfile.ZipInfo(name, date_time)  # type: ignore
+        info.compress_type = self.compression
+        return info
+
+    def add_dir(self, name: str, mtime: datetime):
+        info = self.__info(name.removesuffix("/") + "/", mtime)
+        info.compress_type = zipfile.ZIP_STORED
+        info.external_attr = 0o40755 << 16 | 0x10
+        self.zip.writestr(info, b"")
+
+    def begin_file(self, name: str, size: int, mtime: datetime):
+        info = self.__info(name, mtime)
+        info.external_attr = 0o100644 << 16
+        info.file_size = size
+        self.entry = self.zip.open(info, "w", force_zip64=size >= zipfile.ZIP64_LIMIT)
+
+    def write(self, data: bytes):
+        assert self.entry is not None, "No file entry started"
+        self.entry.write(data)
+
+    def end_file(self):
+        assert self.entry is not None, "No file entry started"
+        self.entry.close()
+        self.entry = None
+
+    def close(self):
+        self.zip.close()
+
+
+class TarArchiveWriter(ArchiveWriter):
+    """Writes the tar blocks directly, tarfile would copy a whole member at once"""
+    MIME_TYPE = "application/x-tar"
+    EXTENSION = ".tar"
+
+    remaining: int
+    padding: int
+
+    def __init__(self):
+        super().__init__()
+        self.remaining = 0
+        self.padding = 0
+
+    def __header(self, info: tarfile.TarInfo, mtime: datetime):
+        info.mtime = int(mtime.timestamp())
+        self.sink.write(info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape"))
+
+    def add_dir(self, name: str, mtime: datetime):
+        info = tarfile.TarInfo(name.removesuffix("/") + "/")
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+        self.__header(info, mtime)
+
+    def begin_file(self, name: str, size: int, mtime: datetime):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mode = 0o644
+        self.__header(info, mtime)
+        self.remaining = size
+        self.padding = -size % tarfile.BLOCKSIZE
+
+    def write(self, data: bytes):
+        # the header already promised a size, content that changed meanwhile is cut to it
+        data = data[:self.remaining]
+        self.remaining -= len(data)
+        self.sink.write(data)
+
+    def end_file(self):
+        self.sink.write(tarfile.NUL * (self.remaining + self.padding))
+        self.remaining = 0
+        self.padding = 0
+
+    def close(self):
+        self.sink.write(tarfile.NUL * (2 * tarfile.BLOCKSIZE))
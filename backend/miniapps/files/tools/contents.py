@@ -1,12 +1,16 @@
 from dataclasses import dataclass
+from sqlalchemy.orm import object_session
+from typing import List, Tuple
 from uuid import UUID
 
 from . import fspath
+from .aggregates import TreeTotals, propagate
 from ..data import FileMetadata
 
 from core.data.sql.columns import ensure_str_fit
 from core.data.blobs.address import Address
 from core.data.blobs.base import Blobs, OpenMode
+from core.data.blobs.upload import BlobUpload
 
 
 @dataclass
@@ -15,6 +19,7 @@ class Namespace:
     update_orm: bool
 
 NAMESPACE_CONTENT = Namespace("content", True)
+NAMESPACE_PREVIEW_INDEX = Namespace("preview-index", False)
 
 
 class FileContents:
@@ -53,17 +58,30 @@ class FileContents:
     def write(self, file: FileMetadata, content: bytes|None, mime_type: str|None = None):
         if content is None:
             self.blobs.delete(self.address(file))
-            file.size = None
+            self.__resize(file, None)
             file.mime_type = None
         else:
             self.blobs.write(self.address(file), content)
-            file.size = len(content)
+            self.__resize(file, len(content))
             if mime_type:
                 ensure_str_fit("MIME-Type", mime_type, FileMetadata.mime_type)
                 file.mime_type = mime_type
         if self.namespace.update_orm:
                 file.modified()
     
+    def upload(self, file: FileMetadata):
+        return BlobUpload(self.blobs, self.address(file))
+
+    def complete_upload(self, file: FileMetadata, upload: BlobUpload, mime_type: str|None = None):
+        assert upload.finished, "Upload not finished"
+        assert upload.address == self.address(file), "Upload belongs to another file"
+        self.__resize(file, upload.size)
+        if mime_type:
+            ensure_str_fit("MIME-Type", mime_type, FileMetadata.mime_type)
+            file.mime_type = mime_type
+        if self.namespace.update_orm:
+            file.modified()
+
     def delete(self, file: FileMetadata):
         self.blobs.delete(self.address(file))
         if self.namespace.update_orm:
@@ -75,10 +93,21 @@ class FileContents:
     def copy(self, src: FileMetadata, dst: FileMetadata):
         self.blobs.copy(self.address(src), self.address(dst))
         if self.namespace.update_orm:
-            dst.size = src.size
+            self.__resize(dst, src.size)
             dst.modified()
 
+    def copy_many(self, pairs: List[Tuple[FileMetadata, FileMetadata]]):
+        """Copies only the contents, sizes and aggregates are up to the caller"""
+        self.blobs.copy_many([(self.address(src), self.address(dst)) for src, dst in pairs])
+
     def rename(self, src: FileMetadata, dst: str):
         self.blobs.rename(self.address(src), self.address(dst))
         if self.namespace.update_orm:
             src.modified()
+
+    def __resize(self, file: FileMetadata, size: int|None):
+        delta = (size or 0) - (file.size or 0)
+        file.size = size
+        session = object_session(file)
+        if delta and session is not None:
+            propagate(session, file, TreeTotals(size=delta))
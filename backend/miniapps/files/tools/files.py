@@ -1,12 +1,15 @@
 from datetime import datetime, timezone
 import mimetypes
-from sqlalchemy import select
+from typing import Dict, List, Set, Tuple
+from sqlalchemy import func, literal, select, update
 from sqlalchemy.orm import Session
 from uuid import UUID
 
 from . import fspath
+from .aggregates import TreeTotals, propagate
 from .contents import FileContents, NAMESPACE_CONTENT
 from .errors import *
+from .listing import FileListing, ListingQuery, ListingSort
 from .storage import StorageManager
 from ..data import FileMetadata, FileType
 from ..data import DIRECTORY_MIME, LINK_MIME
@@ -58,16 +61,36 @@ class FileManager:
         storage_id, parts = fspath.get_parts(path)
         if storage_id is None:
             return None
-        dir = self.storage.root(storage_id)
+        root = self.storage.root(storage_id)
+        file = self.__by_stored_path(root, parts)
+        if file is None and self.__has_links(root):
+            # paths through links are not stored, resolve them step by step
+            file = self.__walk(root, parts)
+        if file is not None and follow_last_link:
+            file = self._follow_link(file)
+        return file
+
+    def __by_stored_path(self, root: FileMetadata, parts: List[str]):
+        if not parts:
+            return root
+        statement = select(FileMetadata) \
+            .where(FileMetadata.storage_id == root.storage_id) \
+            .where(FileMetadata.path == fspath.SEP + fspath.SEP.join(parts))
+        return self.session.scalars(statement).one_or_none()
+
+    def __has_links(self, root: FileMetadata):
+        statement = select(FileMetadata.id) \
+            .where(FileMetadata.storage_id == root.storage_id) \
+            .where(FileMetadata.mime_type == LINK_MIME) \
+            .limit(1)
+        return self.session.scalars(statement).first() is not None
+
+    def __walk(self, dir: FileMetadata|None, parts: List[str]):
         for step in parts:
             dir = self._follow_link(dir)
-            if dir is None:
-                break
-            dir = dir.get_child(step)
             if dir is None or not dir.isdir:
-                break
-        if dir is not None and follow_last_link:
-            dir = self._follow_link(dir)
+                return None
+            dir = dir.get_child(step)
         return dir
     
     def by_id(self, id: UUID):
@@ -78,6 +101,24 @@ class FileManager:
     
     def exists(self, path: str):
         return self.by_path(path) is not None
+
+    def list(
+        self,
+        path: str,
+        sort: ListingSort = ListingSort.NAME,
+        descending: bool = False,
+        mime_types: List[str]|None = None,
+        recursive: bool = False,
+        cursor: str|None = None,
+        limit: int|None = None,
+    ) -> FileListing:
+        """Lists a page of the directory, or of everything below it when recursive"""
+        dir = self.by_path(path)
+        if dir is None or not dir.isdir:
+            raise DirectoryNotFound(path)
+        query = ListingQuery(dir, sort, descending, mime_types, recursive, limit)
+        items = self.session.scalars(query.statement(cursor)).all()
+        return query.page(list(items))
     
     def unique_name(self, path: str):
         if not self.exists(path):
@@ -110,9 +151,12 @@ class FileManager:
         old_file = dir.get_child(basename)
         if old_file is not None:
             raise FileAlreadyExists(path)
+        file_path = dir.child_path(basename)
+        ensure_str_fit("File path", file_path, FileMetadata.path)
         now = datetime.now().astimezone(timezone.utc)
         file = FileMetadata(
             name=basename,
+            path=file_path,
             mime_type=mime_type,
             parent=dir,
             storage=dir.storage,
@@ -120,6 +164,7 @@ class FileManager:
             mtime_utc=now,
             ctime_utc=now)
         self.session.add(file)
+        propagate(self.session, file, TreeTotals(files=1))
         return file
     
     def copyfile(self, src: str, dst: str):
@@ -132,42 +177,120 @@ class FileManager:
             raise FileNotFoundError(src)
         if src_file.isroot:
             raise ValueError("Cannot copy root directory")
+        if src_file.isdir:
+            return self.__copytree(src_file, dst)
         dst_file = self.makefile(dst, src_file.mime_type)
         self.contents.copy(src_file, dst_file)
         dst_file.ctime_utc = src_file.ctime_utc
         dst_file.mtime_utc = src_file.mtime_utc
         dst_file.atime_utc = src_file.atime_utc
         return dst_file
+
+    def __copytree(self, src_dir: FileMetadata, dst: str):
+        if self.exists(dst):
+            raise FileAlreadyExists(dst)
+        dst_parent = self.by_path(fspath.normpath(fspath.dirname(dst)))
+        if dst_parent is None or not dst_parent.isdir:
+            raise DirectoryNotFound(dst)
+        if dst_parent.path == src_dir.path or dst_parent.path.startswith(src_dir.path + fspath.SEP):
+            raise ValueError("Cannot copy a directory into itself")
+        dst_dir = self.makedirs(dst)
+        dst_dir.tree_size = src_dir.tree_size
+        dst_dir.tree_files = src_dir.tree_files
+        dst_dir.tree_dirs = src_dir.tree_dirs
+        # parents sort before their children, so every copy finds its parent already copied
+        statement = select(FileMetadata) \
+            .where(FileMetadata.storage_id == src_dir.storage_id) \
+            .where(FileMetadata.path.startswith(src_dir.path + fspath.SEP, autoescape=True)) \
+            .order_by(FileMetadata.path)
+        copies: Dict[UUID, FileMetadata] = {src_dir.id: dst_dir}
+        blob_copies: List[Tuple[FileMetadata, FileMetadata]] = []
+        for file in self.session.scalars(statement).all():
+            parent = copies[file.parent_id]  # type: ignore
+            copy = FileMetadata(
+                name=file.name,
+                path=parent.child_path(file.name),
+                mime_type=file.mime_type,
+                size=file.size,
+                parent=parent,
+                storage=parent.storage,
+                tree_size=file.tree_size,
+                tree_files=file.tree_files,
+                tree_dirs=file.tree_dirs,
+                atime_utc=file.atime_utc,
+                mtime_utc=file.mtime_utc,
+                ctime_utc=file.ctime_utc)
+            ensure_str_fit("File path", copy.path, FileMetadata.path)
+            self.session.add(copy)
+            copies[file.id] = copy
+            if not file.isdir:
+                blob_copies.append((file, copy))
+        self.contents.copy_many(blob_copies)
+        propagate(self.session, dst_dir, TreeTotals(src_dir.tree_size, src_dir.tree_files, src_dir.tree_dirs))
+        return dst_dir
     
     def makedirs(self, path: str):
         storage_id, parts = fspath.get_parts(path)
         if storage_id is None:
             raise StorageNotSpecified(path)
         dir = self.storage.root(storage_id)
-        for i, parti in enumerate(parts):
+        start = 0
+        if not self.__has_links(dir):
+            dir, start = self.__deepest_dir(dir, parts)
+        for i in range(start, len(parts)):
+            parti = parts[i]
             nextdir = dir.get_child(parti)
             nextdir = self._follow_link(nextdir)
-            if nextdir is None or not nextdir.isdir:
+            if nextdir is not None and not nextdir.isdir:
+                raise FileAlreadyExists(fspath.join(storage_id, *parts[:i + 1]))
+            if nextdir is None:
                 now = datetime.now().astimezone(timezone.utc)
                 for j, partj in enumerate(parts):
                     ensure_str_fit("Directory name", partj, FileMetadata.name)
+                ensure_str_fit("Directory path", fspath.SEP + fspath.SEP.join(parts), FileMetadata.path)
+                first_newdir: FileMetadata|None = None
                 for j in range(i, len(parts)):
                     partj = parts[j]
                     newdir = FileMetadata(
                         name=partj,
+                        path=dir.child_path(partj),
                         mime_type=DIRECTORY_MIME,
                         parent=dir,
                         storage=dir.storage,
+                        tree_size=0,
+                        tree_files=0,
+                        tree_dirs=len(parts) - j - 1,
                         atime_utc=now,
                         mtime_utc=now,
                         ctime_utc=now)
                     self.session.add(newdir)
+                    if first_newdir is None:
+                        first_newdir = newdir
                     dir = newdir
+                assert first_newdir is not None
+                propagate(self.session, first_newdir, TreeTotals(dirs=len(parts) - i))
                 break
             else:
                 dir = nextdir
         return dir
     
+    def __deepest_dir(self, root: FileMetadata, parts: List[str]):
+        """Finds the deepest existing directory of the path with a single query"""
+        if not parts:
+            return root, 0
+        prefixes = [fspath.SEP + fspath.SEP.join(parts[:i + 1]) for i in range(len(parts))]
+        statement = select(FileMetadata) \
+            .where(FileMetadata.storage_id == root.storage_id) \
+            .where(FileMetadata.path.in_(prefixes))
+        existing = {file.path: file for file in self.session.scalars(statement)}
+        dir, depth = root, 0
+        for i, prefix in enumerate(prefixes):
+            file = existing.get(prefix)
+            if file is None or not file.isdir:
+                break
+            dir, depth = file, i + 1
+        return dir, depth
+
     def makelink(self, path: str, target: str):
         target_meta = self.by_path(target)
         if target_meta is None:
@@ -185,6 +308,7 @@ class FileManager:
             raise ValueError("Cannot delete root directory")
         if metadata.isfile or metadata.isdir:
             self.contents.delete(metadata)
+        propagate(self.session, metadata, -TreeTotals.of(metadata))
         self.session.delete(metadata)
         # TODO delete links to this file
 
@@ -198,8 +322,6 @@ class FileManager:
             raise FileNotFoundError(src)
         if src_meta.isroot:
             raise ValueError("Cannot rename root directory")
-        if not isinstance(src_storage, UUID):
-            src = fspath.join(src_meta.storage_id, src_path)
         if not isinstance(dst_storage, UUID):
             dst = fspath.join(src_meta.storage_id, dst_path)
         dst_dir = fspath.normpath(fspath.dirname(dst))
@@ -209,12 +331,148 @@ class FileManager:
         dst_basename = fspath.basename(dst)
         if not dst_basename:
             raise ValueError("File name cannot be empty")
+        totals = TreeTotals.of(src_meta)
+        propagate(self.session, src_meta, -totals)
+        self.__move(src_meta, dst_dir_meta, dst_basename)
+        propagate(self.session, src_meta, totals)
+        return src_meta
+
+    def __move(self, src_meta: FileMetadata, dst_dir_meta: FileMetadata, dst_basename: str):
+        """Moves the file and everything below it, the aggregates are left to the caller"""
         ensure_str_fit("File name", dst_basename, FileMetadata.name)
-        dst_meta = dst_dir_meta.get_child(dst_basename)
-        if dst_meta is not None:
-            raise FileAlreadyExists(dst)
-        self.contents.rename(src_meta, dst)
+        new_path = dst_dir_meta.child_path(dst_basename)
+        if dst_dir_meta.get_child(dst_basename) is not None:
+            raise FileAlreadyExists(fspath.join(dst_dir_meta.storage_id, new_path))
+        old_path = src_meta.path
+        if dst_dir_meta.path == old_path or dst_dir_meta.path.startswith(old_path + fspath.SEP):
+            raise ValueError("Cannot move a directory into itself")
+        ensure_str_fit("File path", new_path, FileMetadata.path)
+        self.contents.rename(src_meta, fspath.join(src_meta.storage_id, new_path))
+        if src_meta.isdir:
+            statement = update(FileMetadata) \
+                .where(FileMetadata.storage_id == src_meta.storage_id) \
+                .where(FileMetadata.path.startswith(old_path + fspath.SEP, autoescape=True)) \
+                .values(path=literal(new_path) + func.substr(FileMetadata.path, len(old_path) + 1)) \
+                .execution_options(synchronize_session="fetch")
+            self.session.execute(statement)
         src_meta.parent = dst_dir_meta
         src_meta.name = dst_basename
+        src_meta.path = new_path
         src_meta.modified()
-        return src_meta
+
+    @staticmethod
+    def outermost(paths: List[str]):
+        """Drops duplicates and the paths that are below another one of the paths"""
+        kept: Set[str] = set()
+        for path in sorted({fspath.normpath(path) for path in paths}, key=lambda path: len(fspath.get_parts(path)[1])):
+            storage_id, parts = fspath.get_parts(path)
+            if not any(fspath.join(storage_id, *parts[:i]) in kept for i in range(len(parts))):
+                kept.add(path)
+        return [path for path in dict.fromkeys(fspath.normpath(path) for path in paths) if path in kept]
+
+    def by_paths(self, paths: List[str]) -> Dict[str, FileMetadata]:
+        """Resolves many paths with one query per storage, paths that do not exist are left out"""
+        by_storage: Dict[UUID|str, Dict[str, str]] = {}
+        for path in paths:
+            storage_id, parts = fspath.get_parts(path)
+            if storage_id is None:
+                raise StorageNotSpecified(path)
+            by_storage.setdefault(storage_id, {})[fspath.SEP + fspath.SEP.join(parts)] = path
+        result: Dict[str, FileMetadata] = {}
+        for storage_id, stored_paths in by_storage.items():
+            root = self.storage.root(storage_id)
+            statement = select(FileMetadata) \
+                .where(FileMetadata.storage_id == root.storage_id) \
+                .where(FileMetadata.path.in_(list(stored_paths)))
+            for file in self.session.scalars(statement):
+                result[stored_paths[file.path]] = file
+            missing = [path for path in stored_paths.values() if path not in result]
+            if missing and self.__has_links(root):
+                for path in missing:
+                    file = self.by_path(path, follow_last_link=False)
+                    if file is not None:
+                        result[path] = file
+        return result
+
+    def copy_many(self, paths: List[str], dst_dir: str):
+        """Copies the files and directories into the directory, returns the copies and the paths that failed"""
+        dst_dir_meta = self.by_path(dst_dir)
+        if dst_dir_meta is None or not dst_dir_meta.isdir:
+            raise DirectoryNotFound(dst_dir)
+        paths = self.outermost(paths)
+        files = self.by_paths(paths)
+        copies: List[FileMetadata] = []
+        failed = [path for path in paths if path not in files]
+        for path in paths:
+            file = files.get(path)
+            if file is None:
+                continue
+            dst = fspath.join(dst_dir_meta.storage_id, dst_dir_meta.child_path(file.name))
+            try:
+                copies.append(self.copyfile(file.abspath, dst))
+            except FileError:
+                failed.append(path)
+        return copies, failed
+
+    def move_many(self, paths: List[str], dst_dir: str):
+        """Moves the files and directories into the directory, returns the moved files and the paths that failed"""
+        dst_dir_meta = self.by_path(dst_dir)
+        if dst_dir_meta is None or not dst_dir_meta.isdir:
+            raise DirectoryNotFound(dst_dir)
+        paths = self.outermost(paths)
+        files = self.by_paths(paths)
+        moved: List[FileMetadata] = []
+        failed = [path for path in paths if path not in files]
+        moved_totals = TreeTotals()
+        removed: Dict[UUID|None, Tuple[FileMetadata, TreeTotals]] = {}
+        for path in paths:
+            file = files.get(path)
+            if file is None:
+                continue
+            if file.isroot:
+                raise ValueError("Cannot move root directory")
+            if file.storage_id != dst_dir_meta.storage_id:
+                raise ValueError("Cannot move files between storages")
+            if file.parent_id == dst_dir_meta.id:
+                continue
+            parent = file.parent
+            try:
+                self.__move(file, dst_dir_meta, file.name)
+            except FileError:
+                failed.append(path)
+                continue
+            _, totals = removed.setdefault(parent.id, (parent, TreeTotals()))
+            totals += TreeTotals.of(file)
+            moved_totals += TreeTotals.of(file)
+            moved.append(file)
+        # aggregates are adjusted once per directory instead of once per file
+        for parent, totals in removed.values():
+            propagate(self.session, parent, -totals, include_self=True)
+        propagate(self.session, dst_dir_meta, moved_totals, include_self=True)
+        return moved, failed
+
+    def delete_many(self, paths: List[str]):
+        """Deletes the files and directories, returns how many were deleted and the paths that were not found"""
+        paths = self.outermost(paths)
+        files = self.by_paths(paths)
+        removed: Dict[UUID|None, Tuple[FileMetadata, TreeTotals]] = {}
+        for file in files.values():
+            if file.isroot:
+                raise ValueError("Cannot delete root directory")
+            _, totals = removed.setdefault(file.parent_id, (file.parent, TreeTotals()))
+            totals += TreeTotals.of(file)
+        for parent, totals in removed.values():
+            propagate(self.session, parent, -totals, include_self=True)
+        # deleted through the session, so the delete hooks drop the contents and preview indices of every file,
+        # and the files below the directories go explicitly rather than relying on the foreign key cascade
+        for file in files.values():
+            if file.isdir:
+                for descendant in self.session.scalars(self.__descendants(file)):
+                    self.session.delete(descendant)
+            self.session.delete(file)
+        return len(files), [path for path in paths if path not in files]
+
+    def __descendants(self, directory: FileMetadata):
+        return select(FileMetadata) \
+            .where(FileMetadata.storage_id == directory.storage_id) \
+            .where(FileMetadata.path.startswith(directory.path + fspath.SEP, autoescape=True))
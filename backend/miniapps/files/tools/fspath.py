@@ -63,6 +63,13 @@ def join(storage_id: UUID|str|None, *parts: str):
         return f"{storage_id}{STORAGE_SEP}{SEP.join(parts)}"
     return SEP.join(parts)
 
+def from_url(url: str):
+    """Converts a `storage_id/path/to/file` URL component to a path"""
+    slash_idx = url.find(SEP)
+    if slash_idx < 0:
+        return url
+    return join(url[:slash_idx], url[slash_idx:])
+
 def normpath(path: str):
     """Normalize a pathname by collapsing redundant separators and up-level references"""
     storage_id, parts = get_parts(path)
@@ -0,0 +1,115 @@
+import base64
+from datetime import datetime
+from enum import Enum
+import json
+from sqlalchemy import func, or_, select, tuple_
+from sqlalchemy.sql import ColumnElement
+from typing import Any, List
+from uuid import UUID
+
+from . import fspath
+from ..data import FileMetadata
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+class ListingSort(Enum):
+    NAME = "NAME"
+    MTIME = "MTIME"
+    SIZE = "SIZE"
+
+
+class FileListing:
+    """A page of a directory listing, pass `next_cursor` back to get the following page"""
+    items: List[FileMetadata]
+    next_cursor: str|None
+
+    def __init__(self, items: List[FileMetadata], next_cursor: str|None):
+        self.items = items
+        self.next_cursor = next_cursor
+
+
+class ListingQuery:
+    dir: FileMetadata
+    sort: ListingSort
+    descending: bool
+    mime_types: List[str]|None
+    recursive: bool
+    limit: int
+
+    def __init__(self, dir: FileMetadata, sort: ListingSort, descending: bool, mime_types: List[str]|None, recursive: bool, limit: int|None):
+        if limit is not None and limit <= 0:
+            raise ValueError("Limit must be positive")
+        self.dir = dir
+        self.sort = sort
+        self.descending = descending
+        self.mime_types = mime_types
+        self.recursive = recursive
+        self.limit = min(limit or DEFAULT_LIMIT, MAX_LIMIT)
+
+    @property
+    def key(self) -> ColumnElement[Any]:
+        match self.sort:
+            case ListingSort.NAME:
+                # names are only unique within a directory, the whole path orders a subtree like a walk
+                return FileMetadata.path if self.recursive else FileMetadata.name  # type: ignore
+            case ListingSort.MTIME:
+                return FileMetadata.mtime_utc  # type: ignore
+            case ListingSort.SIZE:
+                return func.coalesce(FileMetadata.size, 0) + FileMetadata.tree_size
+        raise ValueError(f"Unknown sort {self.sort}")
+
+    def statement(self, cursor: str|None):
+        statement = select(FileMetadata)
+        if self.recursive:
+            statement = statement \
+                .where(FileMetadata.storage_id == self.dir.storage_id) \
+                .where(FileMetadata.path.startswith(self.dir.path.removesuffix(fspath.SEP) + fspath.SEP, autoescape=True)) \
+                .where(FileMetadata.id != self.dir.id)
+        else:
+            statement = statement.where(FileMetadata.parent_id == self.dir.id)
+        if self.mime_types:
+            clauses = []
+            for mime_type in self.mime_types:
+                if mime_type.endswith("/*"):
+                    clauses.append(FileMetadata.mime_type.startswith(mime_type[:-1], autoescape=True))
+                else:
+                    clauses.append(FileMetadata.mime_type == mime_type)
+            statement = statement.where(or_(*clauses))
+        key = self.key
+        if cursor is not None:
+            after = tuple_(key, FileMetadata.id)
+            last = self.__decode(cursor)
+            statement = statement.where(after < last if self.descending else after > last)
+        if self.descending:
+            statement = statement.order_by(key.desc(), FileMetadata.id.desc())
+        else:
+            statement = statement.order_by(key.asc(), FileMetadata.id.asc())
+        return statement.limit(self.limit + 1)
+
+    def page(self, items: List[FileMetadata]):
+        if len(items) <= self.limit:
+            return FileListing(items, None)
+        items = items[:self.limit]
+        return FileListing(items, self.__encode(items[-1]))
+
+    def __encode(self, file: FileMetadata):
+        match self.sort:
+            case ListingSort.NAME:
+                key = file.path if self.recursive else file.name
+            case ListingSort.MTIME:
+                key = file.mtime_utc.isoformat()
+            case ListingSort.SIZE:
+                key = (file.size or 0) + (file.tree_size or 0)
+        data = json.dumps([key, file.id.hex]).encode("utf-8")
+        return base64.urlsafe_b64encode(data).decode("ascii")
+
+    def __decode(self, cursor: str):
+        try:
+            key, id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            if self.sort == ListingSort.MTIME:
+                key = datetime.fromisoformat(key)
+            return key, UUID(id)
+        except (ValueError, TypeError):
+            raise ValueError("Invalid cursor")
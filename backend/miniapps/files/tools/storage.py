@@ -2,6 +2,7 @@ from sqlalchemy import delete, select
 from sqlalchemy.orm import Session, joinedload
 from uuid import UUID, uuid4
 
+from . import fspath
 from ..data import FileMetadata, FileStorage, DIRECTORY_MIME
 
 from core.api.pages import PagesInput
@@ -29,9 +30,8 @@ class StorageManager:
         statement = select(FileStorage)
         if self.user_id is not None:
             statement = statement.where(FileStorage.user_id == self.user_id)
-        def discard_service(storage: FileStorage):
-            return not storage.name.startswith(self.SERVICE_PREFIX)
-        return pages.of(self.session, statement, discard_service)
+        not_service = ~FileStorage.name.startswith(self.SERVICE_PREFIX, autoescape=True)
+        return pages.of(self.session, statement, not_service)
     
     def _get_statement(self, id_or_slug: UUID|str):
         statement = select(FileStorage)
@@ -77,6 +77,7 @@ class StorageManager:
         root = FileMetadata(
             id=uuid4(),
             name="root",
+            path=fspath.SEP,
             mime_type=DIRECTORY_MIME,
             ctime_utc=utcnow_tz(),
             mtime_utc=utcnow_tz(),
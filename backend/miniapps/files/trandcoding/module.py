@@ -4,6 +4,7 @@ from sqlalchemy import select
 from typing import Any, cast, Dict, List
 from uuid import UUID
 
+from . import pillow
 from .format import Format
 from .transcoder import ParamDef, Transcoder, TranscodeContext
 from ..tools.files import FileManager
@@ -17,6 +18,7 @@ from core.asyncjob.handlers import AsyncJobHandler
 
 @dataclass
 class RunningTranscoder:
+    job_id: int
     dst_format: Format
     progress: float
 
@@ -55,7 +57,7 @@ class TranscodeModule(GqlMiniappModule):
     def __parse_params(self, transcoder: Transcoder, values: List[ParamValue]):
         result = {}
         for param_def in transcoder.params:
-            input = next(v for v in values if v.id == param_def.id)
+            input = next((v for v in values if v.id == param_def.id), None)
             if input is None:
                 if param_def.default is None:
                     raise ValueError(f"Missing parameter '{param_def.id}'")
@@ -81,10 +83,13 @@ class TranscodeModule(GqlMiniappModule):
         if file is None:
             raise FileNotFoundError(path)
         parsed_params = self.__parse_params(transcoder, params)
-        job_id = self.context.asyncjobs.schedule("files", "transcoding", {
+        job_id = self.context.asyncjobs.schedule("files", TranscodingHandler.TYPE, {
+            "user_id": str(self.user_id),
             "file_id": str(file.id),
+            "file_path": path,
             "src_ext": src_ext,
             "dst_ext": ext,
+            "dst_mime": dst_format.mime,
             "params": parsed_params,
         })
         self.log_activity("transcode.start", {
@@ -98,7 +103,8 @@ class TranscodeModule(GqlMiniappModule):
     def running(self, path: str) -> List[RunningTranscoder]:
         statement = select(JobPromise) \
             .where(JobPromise.issuer == "files") \
-            .where(JobPromise.type == "transcoding")
+            .where(JobPromise.type == TranscodingHandler.TYPE) \
+            .where(JobPromise.completed_at_utc == None)
         promises = self.session.scalars(statement).all()
         user_id_str = str(self.user_id)
         promises = [p for p in promises if p.payload is not None and p.payload.get("user_id") == user_id_str]
@@ -108,8 +114,11 @@ class TranscodeModule(GqlMiniappModule):
             if file_path != path:
                 continue
             dst_mime = cast(str, promise.payload.get("dst_mime"))
-            state = self.context.asyncjobs.states[promise.id]
+            state = self.context.asyncjobs.states.get(promise.id)
+            if state is None:
+                continue
             result.append(RunningTranscoder(
+                job_id=promise.id,
                 dst_format=Format.by_mime(dst_mime),
                 progress=state.progress,
             ))
@@ -117,6 +126,8 @@ class TranscodeModule(GqlMiniappModule):
 
 
 class TranscodingHandler(AsyncJobHandler):
+    TYPE = "transcoding"
+    CPU_BOUND = True
     MAX_DURATION_WITHOUT_NOTIFICATION = timedelta(minutes=5)
 
     def __make_dst_path(self, src_path: str, dst_ext: str, files: FileManager):
@@ -137,6 +148,8 @@ class TranscodingHandler(AsyncJobHandler):
             raise ValueError("Missing destination extension")
         dst_format = Format.by_ext(dst_ext)
         transcoder = Transcoder.find(src_format, dst_format)
+        if transcoder is None:
+            raise ValueError(f"Conversion from '{src_ext}' to '{dst_ext}' is not supported")
         with self.context.database.make_session() as session:
             files = FileManager.for_service(self.context.blobs, session)
             file_id = UUID(self.context.get_payload("file_id", expected_type=str))
@@ -155,6 +168,7 @@ class TranscodingHandler(AsyncJobHandler):
             dst_file = files.makefile(dst_path, dst_format.mime)
             contents = FileContents(self.context.blobs, NAMESPACE_CONTENT)
             contents.write(dst_file, dst_data)
+            session.commit()
             del contents, dst_file, files, dst_data, dst_path
         duration = datetime.now() - start_time
         if duration > self.MAX_DURATION_WITHOUT_NOTIFICATION:
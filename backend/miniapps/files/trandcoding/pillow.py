@@ -46,7 +46,7 @@ for src_format in PIL_INPUT_FORMATS:
         if src_format == dst_format:
             continue
         max_quality = 95 if dst_format.format == fmt.IMAGE_JPEG else 100
-        def pil_transcode(context: TranscodeContext) -> bytes:
+        def pil_transcode(context: TranscodeContext, dst_format=dst_format, max_quality=max_quality) -> bytes:
             context.set_progress(0.0)
             input = io.BytesIO()
             input.write(context.data)
@@ -62,7 +62,8 @@ class TranscodeContext(AsyncJobRuntimeContext):
         self.params = params
 
     def set_progress(self, value: float):
-        raise NotImplementedError()
+        if self.state is not None:
+            self.state.set_progress(value)
 
 ALL_TRANSCODERS: List["Transcoder"] = []
 
@@ -104,4 +105,4 @@ class Transcoder:
     
     @classmethod
     def find(cls, input: Format, output: Format):
-        return next(t for t in ALL_TRANSCODERS if t.input == input and t.output == output)
+        return next((t for t in ALL_TRANSCODERS if t.input == input and t.output == output), None)
@@ -1,8 +1,10 @@
-from core.miniapp.miniapp import Miniapp, ModuleRegistry
+from core.cronjob.schedule import Schedule
+from core.miniapp.miniapp import Miniapp, ModuleRegistry, SqlEventRegistry, AsyncjobRegistry, PeriodicJobRegistry
 
 from .albums import AlbumsModule
-from .assets import AssetsModule
-from .contents import ContentsModule
+from .assets import AssetsModule, TimelineEvent
+from .background import PreviewsHandler, ReconcileTimelineHandler
+from .contents import ContentsModule, DeleteAssetBlobsEvent
 
 class PhotosMiniapp(Miniapp):
     def __init__(self):
@@ -10,5 +12,10 @@ class PhotosMiniapp(Miniapp):
             ModuleRegistry(AlbumsModule),
             ModuleRegistry(AssetsModule),
             ModuleRegistry(ContentsModule),
+            SqlEventRegistry(TimelineEvent),
+            SqlEventRegistry(DeleteAssetBlobsEvent),
+            AsyncjobRegistry(PreviewsHandler),
+            AsyncjobRegistry(ReconcileTimelineHandler),
+            PeriodicJobRegistry(ReconcileTimelineHandler, Schedule.daily()),
             dependencies=["profile", "files"],
         )
@@ -1,22 +1,18 @@
-from dataclasses import dataclass
-from datetime import date
+from datetime import date, datetime, time, timedelta, timezone
+from sqlalchemy import select
+from sqlalchemy.orm import Session
 from typing import List
 from uuid import UUID
 
-import sqlalchemy
-from sqlalchemy import select
-
 from core.api.pages import PagesInput, PagesResult
 from core.api.modules.gql import GqlMiniappModule, query, mutation
+from core.miniapp.sql import MiniappSqlEvent
 
 from .data import PhotoAsset, PhotoAssetKind
 from .tools.asset import PhotoAssetManager
+from .tools.timeline import TimelineBucket, TimelineLayout, layout, track_assets
 
-
-@dataclass
-class TimelineLayout:
-    date: date
-    count: int
+MAX_RANGE_ITEMS = 1000
 
 
 class AssetsModule(GqlMiniappModule):
@@ -29,21 +25,32 @@ class AssetsModule(GqlMiniappModule):
         return self._assets
 
     @query()
-    def timeline_layout(self) -> List[TimelineLayout]:
-        statement = select(PhotoAsset) \
-            .where(PhotoAsset.user_id == self.user_id) \
-            .group_by(PhotoAsset.created_at_utc) \
-            .order_by(PhotoAsset.created_at_utc.desc()) \
-            .add_columns(sqlalchemy.func.count(PhotoAsset.id))
-        rows = self.session.scalars(statement).all()
-        return [TimelineLayout(row.PhotoAsset.added_at_utc.date(), row.count) for row in rows]
-    
+    def timeline_layout(self, bucket: TimelineBucket = TimelineBucket.DAY) -> List[TimelineLayout]:
+        if self.user_id is None:
+            return []
+        return layout(self.session, self.user_id, bucket)
+
+    def __window(self, date_from: date|None, date_to: date|None):
+        statement = select(PhotoAsset).where(PhotoAsset.user_id == self.user_id)
+        if date_from is not None:
+            statement = statement.where(PhotoAsset.timeline_at_utc >= datetime.combine(date_from, time(), timezone.utc))
+        if date_to is not None:
+            # the whole last day is included
+            statement = statement.where(PhotoAsset.timeline_at_utc < datetime.combine(date_to + timedelta(days=1), time(), timezone.utc))
+        return statement
+
+    @query()
+    def timeline(self, date_from: date|None, date_to: date|None, pages: PagesInput) -> PagesResult[PhotoAsset]:
+        """Assets in the time window, newest first unless sorted otherwise, pass a cursor to scroll through them"""
+        if not pages.sort:
+            pages.sort = ["-timeline_at_utc"]
+        return pages.of(self.session, self.__window(date_from, date_to))
+
     @query()
     def by_date_range(self, date_from: date, date_to: date) -> List[PhotoAsset]:
-        statement = select(PhotoAsset) \
-            .where(PhotoAsset.user_id == self.user_id) \
-            .where(PhotoAsset.created_at_utc >= date_from) \
-            .where(PhotoAsset.created_at_utc <= date_to)
+        statement = self.__window(date_from, date_to) \
+            .order_by(PhotoAsset.timeline_at_utc.desc(), PhotoAsset.id.desc()) \
+            .limit(MAX_RANGE_ITEMS)
         return list(self.session.scalars(statement).all())
 
     @query()
@@ -61,3 +68,15 @@ class AssetsModule(GqlMiniappModule):
     @mutation()
     def create(self, kind: PhotoAssetKind) -> PhotoAsset:
         return self.assets.create(kind)
+
+
+class TimelineEvent(MiniappSqlEvent):
+    TARGET = Session
+    IDENTIFIER = "before_flush"
+
+    def run(self, session: Session, flush_context, instances):
+        def assets(entities):
+            return [entity for entity in entities if isinstance(entity, PhotoAsset)]
+        new, dirty, deleted = assets(session.new), assets(session.dirty), assets(session.deleted)
+        if new or dirty or deleted:
+            track_assets(session, new, dirty, deleted)
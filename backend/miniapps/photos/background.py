@@ -0,0 +1,48 @@
+import logging
+from uuid import UUID
+
+from sqlalchemy import select, union
+
+from core.asyncjob.handlers import AsyncJobHandler
+
+from .data import PhotoAsset, PhotoTimelineDay
+from .tools.importing import PhotoImporter
+from .tools.timeline import reconcile_counts
+
+logger = logging.getLogger(__name__)
+
+
+class PreviewsHandler(AsyncJobHandler):
+    TYPE = "previews"
+    PAYLOAD_SCHEMA = ["asset_id"]
+    CPU_BOUND = True
+
+    def run(self):
+        asset_id = UUID(self.context.get_payload("asset_id", expected_type=str))
+        with self.context.database.make_session() as session:
+            statement = select(PhotoAsset).where(PhotoAsset.id == asset_id)
+            asset = session.scalars(statement).one_or_none()
+            if asset is None:
+                return
+            self.set_progress(0.0)
+            importing = PhotoImporter(self.context, session)
+            importing.update_previews(asset)
+            session.commit()
+            self.set_progress(1.0)
+
+
+class ReconcileTimelineHandler(AsyncJobHandler):
+    TYPE = "timeline.reconcile"
+
+    def run(self):
+        with self.context.database.make_session() as session:
+            statement = union(select(PhotoAsset.user_id), select(PhotoTimelineDay.user_id))
+            user_ids = session.scalars(statement).all()
+        drifted = 0
+        for i, user_id in enumerate(user_ids):
+            with self.context.database.make_session() as session:
+                drifted += reconcile_counts(session, user_id)
+                session.commit()
+            self.set_progress((i + 1) / len(user_ids))
+        if drifted:
+            logger.warning("Repaired drifted timeline counts of %d days", drifted)
@@ -1,17 +1,32 @@
 from uuid import UUID
 
-from sqlalchemy.orm import InstrumentedAttribute
+from sqlalchemy.orm import InstrumentedAttribute, Session
+from tornado.ioloop import IOLoop
 
 from core.api.modules.rest import RestMiniappModule, get, post, ApiResponse
+from core.data.blobs.base import OpenMode
+from core.data.blobs.upload import BlobUpload
+from core.http.ranges import if_none_match
+from core.miniapp.sql import MiniappSqlEvent
 
-from .data import PhotoAsset
+from .data import PhotoAsset, PhotoAssetKind
 from .tools.asset import PhotoAssetManager
 from .tools.files import PhotoFileManager, FileMetadata
+from .tools.probe import MediaProbeStore
+from .tools.render import RenderCache, RenderSpec, SingleFlight, render
+from .tools.renditions import RenditionSettings, RenditionStore
+
+# renders are requested with the content version, so a URL always yields the same image
+IMMUTABLE_CACHE = "private, max-age=31536000, immutable"
+REVALIDATE_CACHE = "private, no-cache"
+
+single_flight = SingleFlight()
 
 
 class ContentsModule(RestMiniappModule):
-    _assets: PhotoAssetManager
-    _files: PhotoFileManager
+    _assets: PhotoAssetManager|None = None
+    _files: PhotoFileManager|None = None
+    _renditions: RenditionSettings|None = None
 
     @property
     def assets(self) -> PhotoAssetManager:
@@ -25,6 +40,16 @@ class ContentsModule(RestMiniappModule):
             self._files = PhotoFileManager(self.user_id, self.context, self.session)
         return self._files
     
+    @property
+    def renditions(self):
+        if self._renditions is None:
+            self._renditions = RenditionSettings.from_env(self.context.env)
+        return self._renditions
+
+    @property
+    def render_cache(self):
+        return RenderCache(self.context.blobs, self.session, RenderCache.capacity_from_env(self.context.env))
+
     def _read(self, asset_id: str, attr: InstrumentedAttribute[FileMetadata|None]):
         asset = self.assets.get(UUID(asset_id))
         file: FileMetadata = getattr(asset, attr.key)
@@ -40,11 +65,16 @@ class ContentsModule(RestMiniappModule):
     def content_read(self, asset_id: str):
         return self._read(asset_id, PhotoAsset.file)
 
-    @post("/api/photos/contents/(.*)", name="photos.contents.write")
-    def content_write(self, asset_id: str):
+    def _open_upload(self, asset_id: str):
+        asset = self.assets.get(UUID(asset_id))
+        mime_type = self.request.headers.get("Content-Type", "application/octet-stream")
+        return self.files.upload(asset, mime_type)
+
+    @post("/api/photos/contents/(.*)", name="photos.contents.write", body=_open_upload)
+    def content_write(self, asset_id: str, upload: BlobUpload):
         asset = self.assets.get(UUID(asset_id))
         mime_type = self.request.headers.get("Content-Type", "application/octet-stream")
-        self.files.write(asset, self.request.body, mime_type)
+        self.files.complete_upload(asset, upload, mime_type)
 
     @get("/api/photos/preview/(.*)", name="photos.preview.read")
     def preview_read(self, asset_id: str):
@@ -53,3 +83,74 @@ class ContentsModule(RestMiniappModule):
     @get("/api/photos/thumbnail/(.*)", name="photos.thumbnail.read")
     def thumbnail_read(self, asset_id: str):
         return self._read(asset_id, PhotoAsset.thumbnail)
+
+    def _render_blob(self, source: FileMetadata, spec: RenderSpec):
+        with self.files.contents.open(source, OpenMode.READ) as blob:
+            return render(blob, spec, self.renditions.quality)
+
+    async def _render(self, asset: PhotoAsset, key: str, spec: RenderSpec):
+        loop = IOLoop.current()
+        cache = self.render_cache
+        if cache.touch(key):
+            try:
+                return await loop.run_in_executor(None, cache.read, key)
+            except FileNotFoundError:
+                cache.forget(key)
+        # photos are decoded at a reduced size, the other kinds only have their preview as an image
+        source = asset.file if asset.kind == PhotoAssetKind.PHOTO else asset.preview
+        if source is None:
+            raise FileNotFoundError()
+        content = await loop.run_in_executor(None, self._render_blob, source, spec)
+        await loop.run_in_executor(None, cache.write, key, content)
+        evicted = cache.add(asset, key, len(content))
+        if evicted:
+            await loop.run_in_executor(None, cache.delete, evicted)
+        return content
+
+    @get("/api/photos/render/(.*)", name="photos.render.read")
+    async def render_read(self, asset_id: str):
+        """Renders the asset to fit `w` x `h` as `fmt`, pass the content version as `v` to have it cached for good"""
+        asset = self.assets.get(UUID(asset_id))
+        version = asset.content_version
+        if version is None:
+            return ApiResponse(status=404)
+        try:
+            spec = RenderSpec.parse(
+                self.get_query_argument("w", None),
+                self.get_query_argument("h", None),
+                self.get_query_argument("fmt", None),
+                self.renditions.formats[0],
+            )
+        except ValueError:
+            return ApiResponse(status=400)
+        etag = f"\"{asset.id.hex}-{version}-{spec.key}\""
+        cache_control = IMMUTABLE_CACHE if self.get_query_argument("v", None) == version else REVALIDATE_CACHE
+        if if_none_match(self.request.headers.get("If-None-Match"), etag):
+            return ApiResponse(status=304, ETag=etag, **{"Cache-Control": cache_control})
+        key = RenderCache.key(asset, version, spec)
+        try:
+            content = await single_flight.run(key, lambda: self._render(asset, key, spec))
+        except FileNotFoundError:
+            return ApiResponse(status=404)
+        return ApiResponse(content=content, ETag=etag, **{"Content-Type": spec.mime, "Cache-Control": cache_control})
+
+
+class DeleteAssetBlobsEvent(MiniappSqlEvent):
+    """Removes what was derived from the contents of deleted assets"""
+    TARGET = Session
+    IDENTIFIER = "before_flush"
+
+    def run(self, session: Session, flush_context, instances):
+        assets = [entity for entity in session.deleted if isinstance(entity, PhotoAsset)]
+        if not assets:
+            return
+        store = RenditionStore(self.context.blobs)
+        probes = MediaProbeStore(self.context.blobs)
+        renditions = RenditionSettings.from_env(self.context.env).renditions
+        for asset in assets:
+            if asset.file is not None:
+                store.delete(asset, renditions)
+                probes.invalidate(asset)
+        # the rows go with the asset, the blobs have to be removed here
+        cache = RenderCache(self.context.blobs, session)
+        cache.delete(cache.keys_of([asset.id for asset in assets]))
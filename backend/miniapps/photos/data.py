@@ -1,11 +1,12 @@
-from datetime import datetime
+from datetime import date, datetime
 import enum
+from sqlalchemy import Index
 from uuid import UUID as PyUUID, uuid4
 from typing import List
 
 from core.auth.access import AccessLevel, access_info
 from core.auth.data import User
-from core.data.sql.columns import DateTime, Enum, Float, Integer, String, UUID, STRING_MAX, utcnow_tz
+from core.data.sql.columns import Date, DateTime, Enum, Float, Integer, String, UUID, STRING_MAX, utcnow_tz
 from core.data.sql.columns import mapped_column, relationship, Mapped, ForeignKey
 from core.data.sql.database import Model
 from core.data.sql.slugs import SLUG_LENGTH, slug_info
@@ -32,6 +33,10 @@ class PhotoAssetOrientation(enum.Enum):
 
 class PhotoAsset(Model):
     __tablename__ = "PhotoAsset"
+    __table_args__ = (
+        Index("ix_PhotoAsset_user_timeline", "user_id", "timeline_at_utc", "id"),
+        Index("ix_PhotoAsset_user_taken", "user_id", "taken_at_utc"),
+    )
     id: Mapped[PyUUID] = mapped_column(UUID, primary_key=True, default=uuid4)
     user_id: Mapped[PyUUID] = mapped_column(ForeignKey(User.id), nullable=False)
     user: Mapped[User] = relationship(User, backref="photos")
@@ -41,6 +46,8 @@ class PhotoAsset(Model):
     derived_assets: Mapped[List["PhotoAsset"]] = relationship("PhotoAsset", back_populates="origin")
     tags: Mapped[List["PhotoTag"]] = relationship(secondary="PhotoAssetTagAssoc")
     created_at_utc: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow_tz)
+    # taken_at_utc if known, created_at_utc otherwise, kept up to date on flush
+    timeline_at_utc: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow_tz)
     album_entries: Mapped[List["PhotoAlbumEntry"]] = relationship("PhotoAlbumEntry", back_populates="asset")
     cover_of_albums: Mapped[List["PhotoAlbum"]] = relationship("PhotoAlbum", back_populates="cover_asset")
     # contents
@@ -69,6 +76,31 @@ class PhotoAsset(Model):
     duration: Mapped[float|None] = mapped_column(Float, default=None, nullable=True)
     bitrate: Mapped[int|None] = mapped_column(Integer, default=None, nullable=True)
 
+    @property
+    def content_version(self) -> str|None:
+        """Changes with the contents, renders requested with it may be cached indefinitely"""
+        if self.file is None:
+            return None
+        mtime = int(self.file.mtime_utc.timestamp() * 1000000) if self.file.mtime_utc else 0
+        return f"{mtime:x}-{self.file.size or 0:x}"
+
+
+class PhotoTimelineDay(Model):
+    """Number of assets per user and UTC day of their timeline time"""
+    __tablename__ = "PhotoTimelineDay"
+    user_id: Mapped[PyUUID] = mapped_column(ForeignKey(User.id, ondelete="CASCADE"), primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
+class PhotoRenderCache(Model):
+    """Renders of assets in the blob store, evicted least recently used first"""
+    __tablename__ = "PhotoRenderCache"
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    asset_id: Mapped[PyUUID] = mapped_column(ForeignKey(PhotoAsset.id, ondelete="CASCADE"), nullable=False, index=True)
+    size: Mapped[int] = mapped_column(Integer, nullable=False)
+    accessed_at_utc: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow_tz, index=True)
+
 
 class PhotoAssetTagAssoc(Model):
     __tablename__ = "PhotoAssetTagAssoc"
@@ -8,7 +8,7 @@ from core.data.sql.database import Session
 from ..data import PhotoAsset, PhotoAssetKind
 
 from .files import PhotoFileManager
-from .importing import PREVIEW_MIME
+from .renditions import PREVIEW_MIME
 
 
 class PhotoAssetManager:
@@ -1,9 +1,11 @@
 from sqlalchemy import select
 from sqlalchemy.orm import InstrumentedAttribute
-from uuid import UUID
+from uuid import UUID, uuid4
 
 from core.asyncjob.context import AsyncJobContext
+from core.data.blobs.upload import BlobUpload
 from core.data.sql.database import Session
+from core.miniapp.context import MiniappContext
 
 from miniapps.files.data import FileStorage, FileMetadata
 from miniapps.files.tools import fspath
@@ -13,6 +15,7 @@ from miniapps.files.tools.storage import StorageManager
 from ..data import PhotoAsset, PhotoAssetKind
 
 from .importing import PhotoImporter
+from ..background import PreviewsHandler
 
 
 UNSET_MIME = object()
@@ -55,8 +58,13 @@ class PhotoFileManager:
     def for_service(cls, user_id: UUID|None, context: AsyncJobContext, session: Session):
         return cls(user_id, context, session, service=True)
     
-    def _file_path(self, storage: FileStorage, asset: PhotoAsset):
-        return fspath.join(storage.id, str(asset.id))
+    def _file_path(self, storage: FileStorage, asset: PhotoAsset, attr: InstrumentedAttribute[FileMetadata|None]):
+        if asset.id is None:
+            # the default is only applied on flush, the path needs it before
+            asset.id = uuid4()
+        if attr is PhotoAsset.file:
+            return fspath.join(storage.id, str(asset.id))
+        return fspath.join(storage.id, f"{asset.id}.{attr.key}")
 
     def _get_asset(self, asset: UUID|PhotoAsset) -> PhotoAsset|None:
         if isinstance(asset, UUID):
@@ -73,13 +81,13 @@ class PhotoFileManager:
     def get_any(self, asset: PhotoAsset, attr: InstrumentedAttribute[FileMetadata|None], *, create: bool = False, mime_type: str|None = UNSET_MIME):  # type: ignore
         if create and mime_type is UNSET_MIME:
             raise ValueError("mime_type must be specified when creating a file")
-        if asset.file is None:
+        if getattr(asset, attr.key) is None:
             if not create:
                 return
             storage = self.files.storage.get_or_create(self.STORAGE_NAME)
             if self.session.is_modified(storage):
                 self.session.commit()
-            path = self._file_path(storage, asset)
+            path = self._file_path(storage, asset, attr)
             file = self.files.makefile(path, mime_type, make_dirs=True)
             setattr(asset, attr.key, file)
             self.session.add(file)
@@ -93,10 +101,29 @@ class PhotoFileManager:
     def write_any(self, asset: PhotoAsset, attr: InstrumentedAttribute[FileMetadata|None], content: bytes, mime_type: str):
         file: FileMetadata = self.get_any(asset, attr, create=True, mime_type=mime_type)  # type: ignore
         self.contents.write(file, content, mime_type)
-        if attr is PhotoAsset.file:
-            importing = PhotoImporter(self.context, self.session)
-            importing.update_metadata(asset)
+        self.__written(asset, attr)
+
+    def upload(self, asset: PhotoAsset, mime_type: str):
+        file: FileMetadata = self.get_any(asset, PhotoAsset.file, create=True, mime_type=mime_type)  # type: ignore
+        return self.contents.upload(file)
+
+    def complete_upload(self, asset: PhotoAsset, upload: BlobUpload, mime_type: str):
+        file: FileMetadata = self.get_any(asset, PhotoAsset.file, create=True, mime_type=mime_type)  # type: ignore
+        self.contents.complete_upload(file, upload, mime_type)
+        self.__written(asset, PhotoAsset.file)
+
+    def __written(self, asset: PhotoAsset, attr: InstrumentedAttribute[FileMetadata|None]):
+        if attr is not PhotoAsset.file:
+            return
+        importing = PhotoImporter(self.context, self.session)
+        importing.update_metadata(asset)
+        if isinstance(self.context, MiniappContext):
+            # previews are CPU heavy - hand them over to a worker process
+            self.session.commit()
+            self.context.asyncjobs.schedule("photos", PreviewsHandler.TYPE, {"asset_id": str(asset.id)})
+        else:
             importing.update_previews(asset)
+
     def read(self, asset: PhotoAsset):
         return self.read_any(asset, PhotoAsset.file)
 
@@ -1,9 +1,9 @@
 from datetime import datetime, timedelta, timezone
 import io
 import math
+from typing import Dict
 
-import matplotlib.pyplot as pyplot
-from moviepy.editor import VideoFileClip
+from matplotlib.figure import Figure
 import numpy
 import PIL.ExifTags
 import PIL.Image
@@ -18,12 +18,8 @@ from miniapps.files.tools.files import FileManager
 
 from ..data import PhotoAsset, PhotoAssetKind, PhotoAssetOrientation
 
-PREVIEW_MAX_H = 1800  # about 12cm at 440ppi at arms length
-PREVIEW_MAX_W = 5*PREVIEW_MAX_H
-THUMBNAIL_MAX_H = 900  # about 6cm at 440ppi at arms length
-THUMBNAIL_MAX_W = 5*THUMBNAIL_MAX_H
-assert THUMBNAIL_MAX_H < PREVIEW_MAX_H
-PREVIEW_FORMAT, PREVIEW_MIME = "webp", "image/webp"
+from .probe import MediaProbeStore
+from .renditions import PREVIEW_MAX_H, RENDITION_FORMATS, Rendition, RenditionPipeline, RenditionSettings, RenditionStore
 
 def parse_offset_tz(offset_str: str|None):
     if not offset_str:
@@ -63,6 +59,7 @@ class PhotoImporter:
     context: AsyncJobContext
     _session: Session|None = None
     _files: FileManager|None = None
+    _renditions: RenditionPipeline|None = None
 
     @property
     def session(self):
@@ -80,41 +77,54 @@ class PhotoImporter:
     def contents(self):
         return self.files.contents
 
+    @property
+    def renditions(self):
+        if self._renditions is None:
+            self._renditions = RenditionPipeline(RenditionSettings.from_env(self.context.env))
+        return self._renditions
+
     def __init__(self, context: AsyncJobContext, session: Session|None):
         self.context = context
         self._session = session
 
+    def __store_renditions(self, asset: PhotoAsset, rendered: Dict[Rendition, bytes]):
+        settings = self.renditions.settings
+        store = RenditionStore(self.context.blobs)
+        for rendition, content in rendered.items():
+            mime_type = RENDITION_FORMATS[rendition.format].mime
+            if rendition == settings.preview:
+                assert asset.preview is not None
+                self.contents.write(asset.preview, content, mime_type)
+            elif rendition == settings.thumbnail:
+                assert asset.thumbnail is not None
+                self.contents.write(asset.thumbnail, content, mime_type)
+            else:
+                store.write(asset, rendition, content)
+
     def __generate_previews(self, asset: PhotoAsset, image: PIL.Image.Image):
-        assert asset.preview is not None
-        image.thumbnail((PREVIEW_MAX_W, PREVIEW_MAX_H))
-        with io.BytesIO() as preview_bytes:
-            image.save(preview_bytes, PREVIEW_FORMAT, quality=80)
-            self.contents.write(asset.preview, preview_bytes.getvalue(), PREVIEW_MIME)
-        del preview_bytes
-        
-        assert asset.thumbnail is not None
-        image.thumbnail((THUMBNAIL_MAX_W, THUMBNAIL_MAX_H))
-        with io.BytesIO() as thumbnail_bytes:
-            image.save(thumbnail_bytes, PREVIEW_FORMAT, quality=80)
-            self.contents.write(asset.preview, thumbnail_bytes.getvalue(), PREVIEW_MIME)
-        del thumbnail_bytes
+        self.__store_renditions(asset, self.renditions.render(image))
 
     def __update_photo_previews(self, asset: PhotoAsset):
         assert asset.kind == PhotoAssetKind.PHOTO
         assert asset.file is not None
         with self.contents.open(asset.file, OpenMode.READ) as fh:
-            image = PIL.Image.open(fh)
-        self.__generate_previews(asset, image)
-        image.close()
+            # decoded while the blob is still open, at the size of the largest rendition
+            rendered = self.renditions.render_blob(fh)
+        self.__store_renditions(asset, rendered)
+
+    def __probe(self, asset: PhotoAsset):
+        assert asset.file is not None
+        file = asset.file
+        # metadata and previews are updated one after the other, the second one reuses the stored probe
+        store = MediaProbeStore(self.context.blobs)
+        return store.get(asset, lambda: self.contents.open(file, OpenMode.READ))
 
     def __update_video_previews(self, asset: PhotoAsset):
         assert asset.kind == PhotoAssetKind.VIDEO
-        assert asset.file is not None
-        with self.contents.open(asset.file, OpenMode.READ) as fh:
-            video = VideoFileClip(fh)
-            preview_frame = PIL.Image.fromarray(video.get_frame(0))
-            video.close()
-        preview_frame.thumbnail((PREVIEW_MAX_W, PREVIEW_MAX_H))
+        _, poster = self.__probe(asset)
+        if poster is None:
+            return
+        preview_frame = PIL.Image.open(io.BytesIO(poster))
         self.__generate_previews(asset, preview_frame)
         preview_frame.close()
 
@@ -133,7 +143,9 @@ class PhotoImporter:
         # downsample
         data = data[::int(len(data)/50000)]
         # plot
-        figure, axes = pyplot.subplots(figsize=(PREVIEW_MAX_H/100, PREVIEW_MAX_H/100), dpi=100)
+        # pyplot keeps global state, a standalone figure is safe to use from any worker
+        figure = Figure(figsize=(PREVIEW_MAX_H/100, PREVIEW_MAX_H/100), dpi=100)
+        axes = figure.subplots()
         axes.plot(data, color='#3b7aaa', linewidth=2)
         axes.fill_between(range(len(data)), data, color='#3b7aaa', alpha=0.3)
         del data
@@ -212,14 +224,12 @@ class PhotoImporter:
 
     def __update_video_metadata(self, asset: PhotoAsset):
         assert asset.kind == PhotoAssetKind.VIDEO
-        assert asset.file is not None
-        with self.contents.open(asset.file, OpenMode.READ) as fh:
-            video = VideoFileClip(fh)
-            asset.width = video.w
-            asset.height = video.h
-            asset.fps = video.fps
-            asset.duration = video.duration
-            video.close()
+        probe, _ = self.__probe(asset)
+        asset.width = probe.width
+        asset.height = probe.height
+        asset.fps = round(probe.fps) if probe.fps is not None else None
+        asset.duration = probe.duration
+        asset.bitrate = probe.bitrate
     
     def __update_audio_metadata(self, asset: PhotoAsset):
         assert asset.kind == PhotoAssetKind.AUDIO
@@ -0,0 +1,125 @@
+from dataclasses import asdict, dataclass
+import io
+import json
+from typing import BinaryIO, Callable, Tuple
+
+import av
+import PIL.Image
+
+from core.data.blobs.base import Blobs
+
+from miniapps.files.tools import fspath
+from miniapps.files.tools.contents import FileContents, Namespace
+
+from ..data import PhotoAsset
+
+NAMESPACE_MEDIA_PROBE = Namespace("media-probe", False)
+# the demuxer reads in chunks of this size, as large as the read-ahead of ranged blob reads
+PROBE_BUFFER_SIZE = 1024 * 1024
+POSTER_QUALITY = 95
+
+# counter-clockwise, like the display matrix and PIL
+ROTATIONS = {
+    90: PIL.Image.Transpose.ROTATE_90,
+    180: PIL.Image.Transpose.ROTATE_180,
+    270: PIL.Image.Transpose.ROTATE_270,
+}
+
+
+@dataclass
+class MediaProbe:
+    width: int|None = None
+    height: int|None = None
+    fps: float|None = None
+    duration: float|None = None
+    bitrate: int|None = None
+
+
+def probe(blob: BinaryIO, poster: bool = True) -> Tuple[MediaProbe, PIL.Image.Image|None]:
+    """Reads the container header and, for the poster, decodes the first keyframe only.
+    The blob is read through seeks, so only the parts the demuxer asks for are fetched."""
+    result = MediaProbe()
+    image = None
+    with av.open(blob, "r", buffer_size=PROBE_BUFFER_SIZE) as container:
+        if container.duration is not None:
+            result.duration = container.duration / av.time_base
+        if container.bit_rate:
+            result.bitrate = container.bit_rate // 1000
+        video = next(iter(container.streams.video), None)
+        if video is None:
+            return result, None
+        # older muxers only leave a clockwise rotate tag, current ones a display matrix that the frames carry
+        rotation = -int(video.metadata.get("rotate", 0))
+        if video.average_rate:
+            result.fps = float(video.average_rate)
+        if result.duration is None and video.duration is not None and video.time_base is not None:
+            result.duration = float(video.duration * video.time_base)
+        frame = None
+        if poster:
+            video.codec_context.skip_frame = "NONKEY"
+            frame = next(container.decode(video), None)
+        if frame is not None and frame.rotation:
+            rotation = frame.rotation
+        rotation = round(rotation / 90) * 90 % 360
+        width, height = video.codec_context.width, video.codec_context.height
+        if rotation in (90, 270):
+            width, height = height, width
+        result.width, result.height = width, height
+        if frame is not None:
+            image = frame.to_image()
+            if rotation in ROTATIONS:
+                image = image.transpose(ROTATIONS[rotation])
+    return result, image
+
+
+class MediaProbeStore:
+    """Probe results and poster frames of assets, kept per version of their contents"""
+    contents: FileContents
+
+    def __init__(self, blobs: Blobs):
+        self.contents = FileContents(blobs, NAMESPACE_MEDIA_PROBE)
+
+    def __address(self, asset: PhotoAsset, suffix: str):
+        assert asset.file is not None
+        return self.contents.address(fspath.join(asset.file.storage_id, asset.id.hex + suffix))
+
+    def load(self, asset: PhotoAsset):
+        try:
+            data = json.loads(self.contents.blobs.read(self.__address(asset, ".json")))
+        except (FileNotFoundError, ValueError):
+            return None
+        if data.get("version") != asset.content_version:
+            return None
+        poster = None
+        if data.get("poster"):
+            try:
+                poster = self.contents.blobs.read(self.__address(asset, ".poster"))
+            except FileNotFoundError:
+                return None
+        return MediaProbe(**data["probe"]), poster
+
+    def save(self, asset: PhotoAsset, result: MediaProbe, poster: bytes|None):
+        if poster is not None:
+            self.contents.blobs.write(self.__address(asset, ".poster"), poster)
+        data = json.dumps({"version": asset.content_version, "probe": asdict(result), "poster": poster is not None})
+        self.contents.blobs.write(self.__address(asset, ".json"), data.encode("utf-8"))
+
+    def invalidate(self, asset: PhotoAsset):
+        self.contents.blobs.delete(self.__address(asset, ".json"))
+        self.contents.blobs.delete(self.__address(asset, ".poster"))
+
+    def get(self, asset: PhotoAsset, open_blob: Callable[[], BinaryIO]) -> Tuple[MediaProbe, bytes|None]:
+        """Returns the probe result and the encoded poster frame, only probing when nothing is stored for the version"""
+        cached = self.load(asset)
+        if cached is not None:
+            return cached
+        with open_blob() as blob:
+            result, image = probe(blob)
+        poster = None
+        if image is not None:
+            with io.BytesIO() as buffer:
+                image.convert("RGB").save(buffer, "JPEG", quality=POSTER_QUALITY)
+                poster = buffer.getvalue()
+            image.close()
+        self.save(asset, result, poster)
+        return result, poster
@@ -0,0 +1,195 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import timedelta
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.orm import Session
+from typing import Any, Awaitable, BinaryIO, Callable, Dict, List, TypeVar, cast
+
+import PIL.ImageOps
+
+from core.data.blobs.address import Address
+from core.data.blobs.base import Blobs
+from core.data.sql.columns import utcnow_tz
+from core.env import Environment
+
+from ..data import PhotoAsset, PhotoRenderCache
+
+from .renditions import RENDITION_FORMATS, decode, encode, normalize_mode, scale_down
+
+RENDER_STEP = 64
+RENDER_MAX = 4096
+RENDER_CACHE_SIZE = 1024 * 1024 * 1024
+# eviction frees a bit more than needed, so that it does not run on every miss
+EVICT_TO = 0.9
+# hits refresh the access time at most this often
+TOUCH_INTERVAL = timedelta(hours=1)
+# the total size is summed up again after this many inserts, in between the inserts of this process are added up
+TOTAL_RECOUNT = 64
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class RenderSpec:
+    width: int
+    height: int
+    format: str
+
+    @property
+    def key(self):
+        return f"{self.width}x{self.height}.{self.format}"
+
+    @property
+    def mime(self):
+        return RENDITION_FORMATS[self.format].mime
+
+    @staticmethod
+    def snap(value: str|None):
+        """Rounds the requested size up to the next step, so that similar screens share renders"""
+        if not value:
+            return RENDER_MAX
+        size = int(value)
+        if size <= 0:
+            raise ValueError("Size must be positive")
+        return min(RENDER_MAX, -(-size // RENDER_STEP) * RENDER_STEP)
+
+    @classmethod
+    def parse(cls, width: str|None, height: str|None, format: str|None, default_format: str):
+        format = format or default_format
+        if format not in RENDITION_FORMATS:
+            raise ValueError(f"Unknown format '{format}'")
+        return cls(cls.snap(width), cls.snap(height), format)
+
+
+def render(blob: BinaryIO, spec: RenderSpec, quality: int):
+    """Renders the image scaled down to fit the spec"""
+    box = (spec.width, spec.height)
+    image = decode(blob, box)
+    try:
+        scaled = scale_down(normalize_mode(PIL.ImageOps.exif_transpose(image)), box)
+        return encode(scaled, spec.format, quality)
+    finally:
+        image.close()
+
+
+class SingleFlight:
+    """Runs concurrent calls for the same key only once, the later callers wait for the result of the first"""
+    flights: Dict[str, "asyncio.Future[Any]"]
+
+    def __init__(self):
+        self.flights = {}
+
+    async def run(self, key: str, call: Callable[[], Awaitable[T]]) -> T:
+        flight = self.flights.get(key)
+        if flight is not None:
+            return await asyncio.shield(flight)
+        flight = asyncio.get_running_loop().create_future()
+        self.flights[key] = flight
+        try:
+            result = await call()
+            flight.set_result(result)
+            return result
+        except BaseException as e:
+            flight.set_exception(e)
+            # nobody might be waiting, which must not be reported as a lost exception
+            flight.exception()
+            raise
+        finally:
+            del self.flights[key]
+
+
+class RenderCache:
+    """Renders in the blob store, bounded in total size by evicting the least recently used"""
+    blobs: Blobs
+    session: Session
+    capacity: int
+    # shared by the caches of all requests of the process
+    _total: int|None = None
+    _inserts: int = 0
+
+    def __init__(self, blobs: Blobs, session: Session, capacity: int = RENDER_CACHE_SIZE):
+        self.blobs = blobs
+        self.session = session
+        self.capacity = capacity
+
+    @staticmethod
+    def capacity_from_env(env: Environment):
+        return int(cast(int, env.get("PHOTOS_RENDER_CACHE_SIZE", RENDER_CACHE_SIZE)))
+
+    @staticmethod
+    def key(asset: PhotoAsset, version: str, spec: RenderSpec):
+        # the version is part of the key, renders of older contents are simply never hit again
+        return f"{asset.id.hex}/{version}/{spec.key}"
+
+    def __address(self, key: str):
+        return Address("photos", Address.join_keys("render-cache", key))
+
+    def touch(self, key: str):
+        """Returns whether the render is cached, marking it as used"""
+        now = utcnow_tz()
+        statement = update(PhotoRenderCache) \
+            .where(PhotoRenderCache.key == key) \
+            .where(PhotoRenderCache.accessed_at_utc < now - TOUCH_INTERVAL) \
+            .values(accessed_at_utc=now) \
+            .execution_options(synchronize_session=False)
+        if self.session.execute(statement).rowcount:
+            self.session.commit()
+            return True
+        return self.session.get(PhotoRenderCache, key) is not None
+
+    def read(self, key: str):
+        return self.blobs.read(self.__address(key))
+
+    def write(self, key: str, content: bytes):
+        self.blobs.write(self.__address(key), content)
+
+    def delete(self, keys: List[str]):
+        for key in keys:
+            self.blobs.delete(self.__address(key))
+
+    def forget(self, key: str):
+        self.session.execute(delete(PhotoRenderCache).where(PhotoRenderCache.key == key))
+        self.session.commit()
+
+    def add(self, asset: PhotoAsset, key: str, size: int):
+        """Records a written render, returns the keys evicted to stay within the capacity"""
+        # not merged, merging a new row runs the load hooks without a query
+        entry = self.session.get(PhotoRenderCache, key)
+        if entry is None:
+            self.session.add(PhotoRenderCache(key=key, asset_id=asset.id, size=size, accessed_at_utc=utcnow_tz()))
+        else:
+            entry.size, entry.accessed_at_utc = size, utcnow_tz()
+        self.session.flush()
+        total = self.__estimate_total(size)
+        if total > self.capacity:
+            # other processes add and delete renders too, so the estimate is confirmed before evicting
+            total = self.__count_total()
+        evicted: List[str] = []
+        if total > self.capacity:
+            statement = select(PhotoRenderCache.key, PhotoRenderCache.size) \
+                .order_by(PhotoRenderCache.accessed_at_utc.asc())
+            for old_key, old_size in self.session.execute(statement):
+                if total <= self.capacity * EVICT_TO:
+                    break
+                evicted.append(old_key)
+                total -= old_size
+            self.session.execute(delete(PhotoRenderCache).where(PhotoRenderCache.key.in_(evicted)))
+            RenderCache._total = total
+        self.session.commit()
+        return evicted
+
+    def __estimate_total(self, added: int):
+        RenderCache._inserts += 1
+        if RenderCache._total is None or RenderCache._inserts >= TOTAL_RECOUNT:
+            return self.__count_total()
+        RenderCache._total += added
+        return RenderCache._total
+
+    def __count_total(self):
+        total = self.session.scalar(select(func.sum(PhotoRenderCache.size))) or 0
+        RenderCache._total, RenderCache._inserts = total, 0
+        return total
+
+    def keys_of(self, asset_ids: List[Any]):
+        statement = select(PhotoRenderCache.key).where(PhotoRenderCache.asset_id.in_(asset_ids))
+        return list(self.session.scalars(statement).all())
@@ -0,0 +1,210 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import io
+import os
+from typing import Any, BinaryIO, Dict, List, Tuple, cast
+
+import PIL.Image
+import PIL.ImageOps
+
+from core.data.blobs.base import Blobs
+from core.env import Environment
+
+from miniapps.files.tools import fspath
+from miniapps.files.tools.contents import FileContents, Namespace
+
+from ..data import PhotoAsset
+
+PREVIEW_MAX_H = 1800  # about 12cm at 440ppi at arms length
+THUMBNAIL_MAX_H = 900  # about 6cm at 440ppi at arms length
+assert THUMBNAIL_MAX_H < PREVIEW_MAX_H
+# panoramas may be wider than the height, up to this ratio
+MAX_ASPECT = 5
+PREVIEW_FORMAT, PREVIEW_MIME = "webp", "image/webp"
+
+NAMESPACE_RENDITIONS = Namespace("renditions", False)
+
+
+@dataclass(frozen=True)
+class RenditionFormat:
+    name: str
+    pil_format: str
+    mime: str
+    alpha: bool
+    options: Dict[str, Any] = field(default_factory=dict)
+
+RENDITION_FORMATS = {f.name: f for f in [
+    RenditionFormat("webp", "WEBP", "image/webp", True, {"method": 4}),
+    RenditionFormat("avif", "AVIF", "image/avif", True, {"speed": 8}),
+    RenditionFormat("jpeg", "JPEG", "image/jpeg", False, {"optimize": True, "progressive": True}),
+]}
+
+
+@dataclass(frozen=True)
+class Rendition:
+    height: int
+    format: str
+
+    @property
+    def key(self):
+        return f"{self.height}.{self.format}"
+
+    @property
+    def box(self):
+        return (MAX_ASPECT * self.height, self.height)
+
+
+@dataclass
+class RenditionSettings:
+    heights: List[int] = field(default_factory=lambda: [256, THUMBNAIL_MAX_H, PREVIEW_MAX_H])
+    formats: List[str] = field(default_factory=lambda: [PREVIEW_FORMAT])
+    quality: int = 80
+    # threads encoding the renditions of one image, within the process of its job
+    workers: int = field(default_factory=lambda: min(4, os.cpu_count() or 1))
+
+    @property
+    def renditions(self):
+        """All configured renditions, largest first so that each can be derived from the previous one"""
+        return [Rendition(height, format) for height in sorted(set(self.heights), reverse=True) for format in self.formats]
+
+    @property
+    def preview(self):
+        return Rendition(PREVIEW_MAX_H, self.formats[0])
+
+    @property
+    def thumbnail(self):
+        return Rendition(THUMBNAIL_MAX_H, self.formats[0])
+
+    @staticmethod
+    def _parse_list(value: str|list|None):
+        if value is None:
+            return None
+        if isinstance(value, list):
+            return [str(v).strip() for v in value]
+        return [v.strip() for v in str(value).split(",") if v.strip()]
+
+    @classmethod
+    def from_env(cls, env: Environment):
+        result = cls()
+        heights = cls._parse_list(cast(str|list|None, env.get("PHOTOS_RENDITION_SIZES")))
+        if heights is not None:
+            result.heights = [int(height) for height in heights]
+        formats = cls._parse_list(cast(str|list|None, env.get("PHOTOS_RENDITION_FORMATS")))
+        if formats is not None:
+            unknown = [format for format in formats if format not in RENDITION_FORMATS]
+            if unknown or not formats:
+                raise ValueError(f"Unknown rendition formats {unknown}, expected some of {list(RENDITION_FORMATS)}")
+            result.formats = formats
+        quality = cast(int|None, env.get("PHOTOS_RENDITION_QUALITY"))
+        if quality is not None:
+            result.quality = int(quality)
+        workers = cast(int|None, env.get("PHOTOS_RENDITION_WORKERS"))
+        if workers is not None:
+            result.workers = int(workers)
+        # the asset columns always hold these two
+        result.heights = sorted(set(result.heights) | {PREVIEW_MAX_H, THUMBNAIL_MAX_H})
+        return result
+
+
+def fit_size(size: Tuple[int, int], box: Tuple[int, int]):
+    """Size of an image scaled down to fit into the box, images are never scaled up"""
+    width, height = size
+    scale = min(box[0] / width, box[1] / height, 1.0)
+    return (max(1, round(width * scale)), max(1, round(height * scale)))
+
+
+def scale_down(image: PIL.Image.Image, box: Tuple[int, int]):
+    size = fit_size(image.size, box)
+    if size == image.size:
+        return image
+    return image.resize(size, PIL.Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+
+def normalize_mode(image: PIL.Image.Image):
+    if image.mode in ("RGB", "RGBA"):
+        return image
+    alpha = image.mode in ("LA", "PA", "RGBa", "La") or "transparency" in image.info
+    return image.convert("RGBA" if alpha else "RGB")
+
+
+def decode(blob: BinaryIO, box: Tuple[int, int]):
+    """Decodes the image at the smallest size still covering the box, JPEGs are scaled down while decoding"""
+    image = PIL.Image.open(blob)
+    orientation = image.getexif().get(0x0112)
+    # orientations 5 to 8 swap width and height
+    width, height = image.size if orientation not in (5, 6, 7, 8) else image.size[::-1]
+    target = fit_size((width, height), box)
+    if orientation in (5, 6, 7, 8):
+        target = target[::-1]
+    image.draft("RGB", target)
+    image.load()
+    return image
+
+
+def encode(image: PIL.Image.Image, format: str, quality: int):
+    rendition_format = RENDITION_FORMATS[format]
+    if image.mode == "RGBA" and not rendition_format.alpha:
+        image = image.convert("RGB")
+    with io.BytesIO() as buffer:
+        image.save(buffer, rendition_format.pil_format, quality=quality, **rendition_format.options)
+        return buffer.getvalue()
+
+
+class RenditionPipeline:
+    """Derives all configured renditions of an image, each size from the next larger one, and encodes them in parallel"""
+    settings: RenditionSettings
+
+    def __init__(self, settings: RenditionSettings):
+        self.settings = settings
+
+    def render_blob(self, blob: BinaryIO):
+        renditions = self.settings.renditions
+        image = decode(blob, renditions[0].box)
+        try:
+            return self.render(image)
+        finally:
+            image.close()
+
+    def render(self, image: PIL.Image.Image):
+        """Returns the encoded bytes of every configured rendition"""
+        # applied once to the largest image, every smaller one inherits the orientation
+        oriented = normalize_mode(PIL.ImageOps.exif_transpose(image))
+        scaled: List[Tuple[Rendition, PIL.Image.Image]] = []
+        current = oriented
+        for rendition in self.settings.renditions:
+            current = scale_down(current, rendition.box)
+            scaled.append((rendition, current))
+        quality = self.settings.quality
+        workers = min(self.settings.workers, len(scaled))
+        if workers <= 1:
+            return {rendition: encode(scaled_image, rendition.format, quality) for rendition, scaled_image in scaled}
+        # this already runs in a worker process of the job pool, Pillow releases the GIL while encoding,
+        # so threads encode in parallel without more processes or pickling the images
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="renditions") as executor:
+            futures = {rendition: executor.submit(encode, scaled_image, rendition.format, quality) for rendition, scaled_image in scaled}
+            return {rendition: future.result() for rendition, future in futures.items()}
+
+
+class RenditionStore:
+    """Renditions beyond the preview and thumbnail, stored next to the asset contents"""
+    contents: FileContents
+
+    def __init__(self, blobs: Blobs):
+        self.contents = FileContents(blobs, NAMESPACE_RENDITIONS)
+
+    def __address(self, asset: PhotoAsset, rendition: Rendition):
+        assert asset.file is not None
+        return self.contents.address(fspath.join(asset.file.storage_id, asset.id.hex, rendition.key))
+
+    def exists(self, asset: PhotoAsset, rendition: Rendition):
+        return self.contents.blobs.exists(self.__address(asset, rendition))
+
+    def read(self, asset: PhotoAsset, rendition: Rendition):
+        return self.contents.blobs.read(self.__address(asset, rendition))
+
+    def write(self, asset: PhotoAsset, rendition: Rendition, content: bytes):
+        self.contents.blobs.write(self.__address(asset, rendition), content)
+
+    def delete(self, asset: PhotoAsset, renditions: List[Rendition]):
+        for rendition in renditions:
+            self.contents.blobs.delete(self.__address(asset, rendition))
@@ -0,0 +1,109 @@
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+import enum
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, List, Tuple
+from uuid import UUID
+
+from ..data import PhotoAsset, PhotoTimelineDay
+
+from core.data.sql.columns import utcnow_tz
+
+
+class TimelineBucket(enum.Enum):
+    DAY = "DAY"
+    MONTH = "MONTH"
+
+
+@dataclass
+class TimelineLayout:
+    date: date
+    count: int
+
+
+def as_utc(value: datetime):
+    # the database hands timestamps back without a timezone
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def timeline_time(asset: PhotoAsset) -> datetime:
+    return as_utc(asset.taken_at_utc or asset.created_at_utc)
+
+
+def track_assets(session: Session, new: Iterable[PhotoAsset], dirty: Iterable[PhotoAsset], deleted: Iterable[PhotoAsset]):
+    """Keeps the timeline times of the assets and the per-day counts in sync with the pending changes"""
+    deltas: Dict[Tuple[UUID, date], int] = {}
+    def add(user_id: UUID, day: date, delta: int):
+        deltas[(user_id, day)] = deltas.get((user_id, day), 0) + delta
+    for asset in new:
+        if asset.created_at_utc is None:
+            asset.created_at_utc = utcnow_tz()
+        asset.timeline_at_utc = timeline_time(asset)
+        add(asset.user_id, asset.timeline_at_utc.date(), 1)
+    for asset in dirty:
+        current = timeline_time(asset)
+        if current != as_utc(asset.timeline_at_utc):
+            add(asset.user_id, asset.timeline_at_utc.date(), -1)
+            add(asset.user_id, current.date(), 1)
+            asset.timeline_at_utc = current
+    for asset in deleted:
+        add(asset.user_id, asset.timeline_at_utc.date(), -1)
+    apply_counts(session, deltas)
+
+
+def apply_counts(session: Session, deltas: Dict[Tuple[UUID, date], int]):
+    for (user_id, day), delta in deltas.items():
+        if not delta:
+            continue
+        statement = update(PhotoTimelineDay) \
+            .where(PhotoTimelineDay.user_id == user_id) \
+            .where(PhotoTimelineDay.day == day) \
+            .values(count=PhotoTimelineDay.count + delta) \
+            .execution_options(synchronize_session=False)
+        if session.execute(statement).rowcount:
+            continue
+        # runs while the session flushes, so the savepoint is taken on the connection
+        connection = session.connection()
+        try:
+            with connection.begin_nested():
+                connection.execute(insert(PhotoTimelineDay).values(user_id=user_id, day=day, count=delta))
+        except IntegrityError:
+            session.execute(statement)
+
+
+def reconcile_counts(session: Session, user_id: UUID):
+    """Recounts the assets of the user per day, returns how many days had drifted"""
+    day = func.date(PhotoAsset.timeline_at_utc)
+    statement = select(day, func.count()) \
+        .where(PhotoAsset.user_id == user_id) \
+        .group_by(day)
+    actual: Dict[date, int] = {}
+    for value, count in session.execute(statement):
+        actual[value if isinstance(value, date) else date.fromisoformat(value)] = count
+    statement = select(PhotoTimelineDay.day, PhotoTimelineDay.count).where(PhotoTimelineDay.user_id == user_id)
+    stored: Dict[date, int] = {value: count for value, count in session.execute(statement)}
+    drifted = [value for value in actual.keys() | stored.keys() if actual.get(value, 0) != stored.get(value, 0)]
+    for value in drifted:
+        session.execute(delete(PhotoTimelineDay).where(PhotoTimelineDay.user_id == user_id).where(PhotoTimelineDay.day == value))
+        if actual.get(value):
+            session.execute(insert(PhotoTimelineDay).values(user_id=user_id, day=value, count=actual[value]))
+    return len(drifted)
+
+
+def layout(session: Session, user_id: UUID, bucket: TimelineBucket) -> List[TimelineLayout]:
+    """Returns the asset counts per bucket, newest first"""
+    statement = select(PhotoTimelineDay.day, PhotoTimelineDay.count) \
+        .where(PhotoTimelineDay.user_id == user_id) \
+        .where(PhotoTimelineDay.count > 0) \
+        .order_by(PhotoTimelineDay.day.desc())
+    result: List[TimelineLayout] = []
+    for day, count in session.execute(statement):
+        if bucket == TimelineBucket.MONTH:
+            day = day.replace(day=1)
+        if result and result[-1].date == day:
+            result[-1].count += count
+        else:
+            result.append(TimelineLayout(day, count))
+    return result
@@ -4,6 +4,7 @@ from .activity import ActivityModule
 from .auth import AuthModule
 from .edit import EditModule
 from .importing.module import ImportingModule
+from .jobs import JobsModule
 from .importing.google import GoogleImportingJob
 
 
@@ -14,5 +15,6 @@ class ProfileMiniapp(Miniapp):
             ModuleRegistry(AuthModule),
             ModuleRegistry(EditModule),
             ModuleRegistry(ImportingModule),
+            ModuleRegistry(JobsModule),
             AsyncjobRegistry(GoogleImportingJob),
         )
@@ -0,0 +1,64 @@
+from dataclasses import dataclass
+
+from core.api.modules.gql import GqlMiniappModule, subscription
+from core.asyncjob.data import JobPromise
+from core.asyncjob.state import State
+
+
+@dataclass
+class JobProgress:
+    job_id: int
+    progress: float
+    queued: bool
+    queue_position: int|None
+    queue_depth: int
+    completed: bool
+    cancelled: bool
+    error: str|None
+
+    @classmethod
+    def of_state(cls, job_id: int, state: State):
+        return cls(
+            job_id=job_id,
+            progress=state.progress,
+            queued=state.queued,
+            queue_position=state.queue_position,
+            queue_depth=state.queue_depth,
+            completed=state.completed,
+            cancelled=state.cancelled,
+            error=state.error,
+        )
+
+    @classmethod
+    def of_promise(cls, promise: JobPromise):
+        completed = promise.completed_at_utc is not None or promise.error is not None
+        return cls(
+            job_id=promise.id,
+            progress=1.0 if completed else 0.0,
+            queued=not completed,
+            queue_position=None,
+            queue_depth=0,
+            completed=completed,
+            cancelled=False,
+            error=promise.error,
+        )
+
+
+class JobsModule(GqlMiniappModule):
+    def __get_promise(self, job_id: int):
+        promise = self.session.get(JobPromise, job_id)
+        if promise is None or promise.payload is None:
+            raise KeyError(f"Job #{job_id} not found")
+        if promise.payload.get("user_id") != str(self.user_id):
+            raise KeyError(f"Job #{job_id} not found")
+        return promise
+
+    @subscription()
+    async def progress(self, job_id: int) -> JobProgress:
+        promise = self.__get_promise(job_id)
+        state = self.context.asyncjobs.states.get(job_id)
+        if state is None:
+            yield JobProgress.of_promise(promise)
+            return
+        async for current in state.updates():
+            yield JobProgress.of_state(job_id, current)
@@ -0,0 +1,69 @@
+import asyncio
+
+from core.asyncjob.action import Action
+from core.asyncjob.handlers import AsyncJobHandler
+from core.asyncjob.queue import JobQueue, QueuedJob
+from core.asyncjob.settings import AsyncJobSettings, PoolKind
+from core.asyncjob import state as state_module
+from core.asyncjob.state import State
+
+
+class CountingState(State):
+    def __init__(self):
+        super().__init__()
+        self.changes = 0
+
+    def _changed(self):
+        self.changes += 1
+        super()._changed()
+
+
+def job(id: int, priority: int = 0):
+    return QueuedJob(id, "tests", "job", AsyncJobHandler, Action.RUN, {}, priority, PoolKind.THREAD, CountingState())
+
+
+def test_positions_are_computed_when_asked():
+    queue = JobQueue(AsyncJobSettings(max_workers=1, cpu_workers=1))
+    jobs = [job(id) for id in range(100)]
+    for queued in jobs:
+        queue.push(queued)
+    # each job is told once that it is queued, not again for every job queued after it
+    assert all(queued.state.changes == 1 for queued in jobs)
+    urgent = job(100, priority=1)
+    queue.push(urgent)
+    assert urgent.state.queue_place == (0, 101)
+    assert jobs[0].state.queue_place == (1, 101)
+    assert jobs[-1].state.queue_place == (100, 101)
+
+
+def test_started_jobs_leave_the_queue():
+    queue = JobQueue(AsyncJobSettings(max_workers=1, cpu_workers=1))
+    jobs = [job(id) for id in range(3)]
+    for queued in jobs:
+        queue.push(queued)
+    ready = queue.pop_ready()
+    assert ready == [jobs[0]]
+    ready[0].state.set_started()
+    assert jobs[0].state.queue_position is None
+    assert jobs[1].state.queue_place == (0, 2)
+    assert queue.remove(jobs[1].id)
+    assert jobs[2].state.queue_place == (0, 1)
+
+
+def test_watchers_see_the_position_move(monkeypatch):
+    monkeypatch.setattr(state_module, "QUEUE_POLL_INTERVAL", 0.01)
+    queue = JobQueue(AsyncJobSettings(max_workers=1, cpu_workers=1))
+    first, second = job(1), job(2)
+    queue.push(first)
+    queue.push(second)
+
+    async def watch():
+        places = []
+        async for current in second.state.updates(interval=0):
+            places.append(current.queue_place)
+            if len(places) == 1:
+                queue.remove(first.id)
+            else:
+                return places
+
+    assert asyncio.run(asyncio.wait_for(watch(), 1)) == [(1, 2), (0, 1)]
@@ -0,0 +1,72 @@
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import UUID, create_engine, event, select
+from sqlalchemy.dialects.mysql import LONGBLOB
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+
+# the auth modules import the core through the app, like the server does
+import core.app.main  # noqa: F401
+from core.auth.access import AccessLevel
+from core.auth.data import User, UserRole
+from core.auth.handlers import AuthError
+from core.data.sql.columns import utcnow_tz
+from miniapps.files.data import FileMetadata, FileStorage
+
+
+@compiles(UUID, "sqlite")
+def compile_uuid(type_, compiler, **kwargs):
+    return "CHAR(32)"
+
+
+@compiles(LONGBLOB, "sqlite")
+def compile_longblob(type_, compiler, **kwargs):
+    return "BLOB"
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://")
+    for model in (User, FileStorage, FileMetadata):
+        model.__table__.create(engine)  # type: ignore
+    return engine
+
+
+def populate(engine, storages: int, files: int, access: AccessLevel):
+    now = utcnow_tz()
+    with Session(engine) as session:
+        user = User("owner", "owner-Passw0rd!", UserRole.USER)
+        for i in range(storages):
+            storage = FileStorage(id=uuid4(), user=user, name=f"storage{i}", slug=f"storage{i}")
+            for j in range(files):
+                session.add(FileMetadata(
+                    id=uuid4(), name=f"file{j}", path=f"/file{j}", storage=storage, access=access,
+                    atime_utc=now, mtime_utc=now, ctime_utc=now,
+                ))
+        session.commit()
+
+
+def count_queries(engine):
+    counter = {"queries": 0}
+    def before_execute(*args):
+        counter["queries"] += 1
+    event.listen(engine, "before_cursor_execute", before_execute)
+    return counter
+
+
+def test_loading_checks_owners_in_batches(engine):
+    populate(engine, 50, 10, AccessLevel.PUBLIC_READABLE)
+    counter = count_queries(engine)
+    with Session(engine) as session:
+        files = session.scalars(select(FileMetadata)).all()
+        assert len(files) == 500
+        # the files, then their storages and users with one query each
+        assert counter["queries"] == 3
+
+
+def test_loading_still_denies(engine):
+    populate(engine, 2, 2, AccessLevel.PRIVATE)
+    with Session(engine) as session:
+        with pytest.raises(AuthError):
+            session.scalars(select(FileMetadata)).all()
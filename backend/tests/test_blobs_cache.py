@@ -0,0 +1,75 @@
+import os
+
+from core.data.blobs.address import Address
+from core.data.blobs.base import OpenMode
+from core.data.blobs.cache import CachedBlobs
+from core.data.blobs.fs import FsBlobs
+
+
+class CountingBlobs(FsBlobs):
+    def __init__(self, root: str):
+        super().__init__(root)
+        self.opened = 0
+
+    def open(self, address: Address, mode: OpenMode):
+        self.opened += 1
+        return super().open(address, mode)
+
+
+def address(name: str):
+    return Address("files", name)
+
+
+def test_open_fetches_when_entered(tmp_path):
+    inner = CountingBlobs(str(tmp_path / "inner"))
+    inner.write(address("a"), b"content")
+    inner.opened = 0
+    cache = CachedBlobs(inner, str(tmp_path / "cache"), 1024)
+    blob = cache.open(address("a"), OpenMode.READ)
+    assert inner.opened == 0
+    with blob:
+        assert blob.read() == b"content"
+    assert inner.opened == 1
+    with cache.open(address("a"), OpenMode.READ) as blob:
+        assert blob.read() == b"content"
+    assert inner.opened == 1
+
+
+def test_forked_cache_keeps_parent_entries(tmp_path):
+    inner = FsBlobs(str(tmp_path / "inner"))
+    for name in "abc":
+        inner.write(address(name), name.encode() * 400)
+    cache = CachedBlobs(inner, str(tmp_path / "cache"), 1000)
+    assert cache.read(address("a")) == b"a" * 400
+    parent_paths = [entry.path for entry in cache.entries.values()]
+    cache.after_fork()
+    assert not cache.entries and cache.size == 0
+    # filling the worker cache evicts only the worker's own entries
+    assert cache.read(address("b")) == b"b" * 400
+    assert cache.read(address("c")) == b"c" * 400
+    assert cache.read(address("a")) == b"a" * 400
+    assert all(os.path.isfile(path) for path in parent_paths)
+    assert all(entry.path.startswith(cache.root + os.sep) for entry in cache.entries.values())
+
+
+def test_large_blob_is_not_copied(tmp_path):
+    inner = CountingBlobs(str(tmp_path / "inner"))
+    inner.write(address("big"), b"x" * 2048)
+    cache = CachedBlobs(inner, str(tmp_path / "cache"), 1024 * 16, max_entry_size=1024)
+    with cache.open(address("big"), OpenMode.READ) as blob:
+        blob.seek(1000)
+        assert blob.read(10) == b"x" * 10
+    assert cache.stats["misses"] == 0
+    assert os.listdir(cache.root) == []
+
+
+def test_directory_invalidation(tmp_path):
+    inner = CountingBlobs(str(tmp_path / "inner"))
+    cache = CachedBlobs(inner, str(tmp_path / "cache"), 1024 * 16)
+    for name in ("dir/a", "dir/b", "dirx"):
+        inner.write(address(name), name.encode())
+        cache.read(address(name))
+    assert cache.stats["entries"] == 3
+    cache.delete(address("dir"))
+    assert cache.stats["entries"] == 1
+    assert cache.read(address("dirx")) == b"dirx"
@@ -0,0 +1,99 @@
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+import pytest
+
+from core.data.blobs.address import Address
+from core.data.blobs.base import OpenMode
+from core.data.blobs.cas import BlobContent, BlobRef, CasBlobs
+from core.data.blobs.fs import FsBlobs
+
+
+class SqliteDatabase:
+    def __init__(self):
+        self.engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        BlobContent.metadata.create_all(self.engine, tables=[BlobContent.__table__, BlobRef.__table__])  # type: ignore
+        self._sessionmaker = sessionmaker(bind=self.engine)
+
+    def make_session(self, info: dict|None = None):
+        return self._sessionmaker(info=info)
+
+
+@pytest.fixture
+def cas(tmp_path):
+    return CasBlobs(FsBlobs(str(tmp_path)), SqliteDatabase())  # type: ignore
+
+
+def address(path: str):
+    return Address("files", Address.join_keys("storage", "content", path))
+
+
+def write(blobs: CasBlobs, path: str, data: bytes):
+    with blobs.open(address(path), OpenMode.WRITE) as fh:
+        fh.write(data)
+
+
+def refcounts(blobs: CasBlobs):
+    with blobs.database.make_session() as session:
+        return {content.digest: content.refcount for content in session.scalars(select(BlobContent))}
+
+
+def test_rename_directory_moves_children(cas: CasBlobs):
+    write(cas, "dir/a.txt", b"a")
+    write(cas, "dir/sub/b.txt", b"b")
+    write(cas, "dirx/c.txt", b"c")
+    cas.rename(address("dir"), address("moved"))
+    assert cas.read(address("moved/a.txt")) == b"a"
+    assert cas.read(address("moved/sub/b.txt")) == b"b"
+    assert not cas.exists(address("dir/a.txt"))
+    # a sibling sharing the name as a prefix stays where it is
+    assert cas.read(address("dirx/c.txt")) == b"c"
+    assert sorted(refcounts(cas).values()) == [1, 1, 1]
+
+
+def test_rename_directory_with_legacy_blobs(cas: CasBlobs):
+    write(cas, "dir/a.txt", b"a")
+    cas.inner.write(address("dir/legacy.txt"), b"legacy")
+    cas.rename(address("dir"), address("moved"))
+    assert cas.read(address("moved/a.txt")) == b"a"
+    assert cas.read(address("moved/legacy.txt")) == b"legacy"
+
+
+def test_rename_missing_directory(cas: CasBlobs):
+    with pytest.raises(FileNotFoundError):
+        cas.rename(address("missing"), address("moved"))
+
+
+def test_delete_directory_releases_children(cas: CasBlobs):
+    write(cas, "dir/a.txt", b"a")
+    write(cas, "dir/sub/b.txt", b"b")
+    write(cas, "other.txt", b"a")
+    cas.delete(address("dir"))
+    assert not cas.exists(address("dir/a.txt"))
+    assert not cas.exists(address("dir/sub/b.txt"))
+    assert cas.read(address("other.txt")) == b"a"
+    assert sorted(refcounts(cas).values()) == [0, 1]
+    assert cas.collect_garbage() == 1
+    assert cas.read(address("other.txt")) == b"a"
+
+
+def test_collect_garbage_keeps_contents_when_commit_fails(cas: CasBlobs, monkeypatch):
+    write(cas, "a.txt", b"a")
+    cas.delete(address("a.txt"))
+    digest = next(iter(refcounts(cas)))
+    make_session = cas.database.make_session
+
+    def failing_session(*args, **kwargs):
+        session = make_session(*args, **kwargs)
+        def commit():
+            raise RuntimeError("commit failed")
+        session.commit = commit
+        return session
+
+    monkeypatch.setattr(cas.database, "make_session", failing_session)
+    with pytest.raises(RuntimeError):
+        cas.collect_garbage()
+    monkeypatch.setattr(cas.database, "make_session", make_session)
+    assert cas.inner.exists(cas.content_address(digest))
+    assert cas.collect_garbage() == 1
+    assert not cas.inner.exists(cas.content_address(digest))
@@ -0,0 +1,105 @@
+import os
+
+import boto3
+from moto import mock_aws
+import pytest
+
+from core.data.blobs import s3
+from core.data.blobs.address import Address
+from core.data.blobs.base import OpenMode
+from core.data.blobs.s3 import S3Blobs
+
+BUCKET = "blobs"
+
+
+class CountingClient:
+    """Counts the calls made through the client of the blobs"""
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+        def call(*args, **kwargs):
+            self.calls.append(name)
+            return attr(*args, **kwargs)
+        return call
+
+
+@pytest.fixture
+def blobs(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket=BUCKET)
+        result = S3Blobs(f"id:secret@{BUCKET}")
+        result.client = CountingClient(result.client)  # type: ignore
+        yield result
+
+
+def address(name: str):
+    return Address("files", name)
+
+
+def test_read_fetches_ranges_lazily(blobs: S3Blobs):
+    data = os.urandom(3 * s3.READ_AHEAD_SIZE)
+    blobs.write(address("a"), data)
+    calls = blobs.client.calls  # type: ignore
+    calls.clear()
+    with blobs.open(address("a"), OpenMode.READ) as fh:
+        assert fh.seek(2 * s3.READ_AHEAD_SIZE) == 2 * s3.READ_AHEAD_SIZE
+        assert fh.seek(-5, os.SEEK_END) == len(data) - 5
+        # seeking alone fetches nothing
+        assert calls == ["head_object"]
+        fh.seek(2 * s3.READ_AHEAD_SIZE)
+        assert fh.read(10) == data[2 * s3.READ_AHEAD_SIZE:2 * s3.READ_AHEAD_SIZE + 10]
+        assert fh.read(10) == data[2 * s3.READ_AHEAD_SIZE + 10:2 * s3.READ_AHEAD_SIZE + 20]
+        assert calls == ["head_object", "get_object"]
+        fh.seek(100)
+        assert fh.read(10) == data[100:110]
+        assert calls == ["head_object", "get_object", "get_object"]
+        fh.seek(-5, os.SEEK_END)
+        assert fh.read() == data[-5:]
+        assert fh.read() == b""
+
+
+def test_read_missing(blobs: S3Blobs):
+    with pytest.raises(FileNotFoundError):
+        with blobs.open(address("missing"), OpenMode.READ):
+            pass
+
+
+def test_write_uploads_parts(blobs: S3Blobs, monkeypatch):
+    monkeypatch.setattr(s3, "PART_SIZE", 5 * 1024 * 1024)
+    data = os.urandom(2 * s3.PART_SIZE + 1024 * 1024)
+    with blobs.open(address("a"), OpenMode.WRITE) as fh:
+        for start in range(0, len(data), 1024 * 1024):
+            fh.write(data[start:start + 1024 * 1024])
+        assert "upload_part" in blobs.client.calls  # type: ignore
+    assert "complete_multipart_upload" in blobs.client.calls  # type: ignore
+    assert blobs.read(address("a")) == data
+
+
+def test_small_write_is_put_at_once(blobs: S3Blobs):
+    blobs.write(address("a"), b"content")
+    assert "create_multipart_upload" not in blobs.client.calls  # type: ignore
+    assert blobs.read(address("a")) == b"content"
+
+
+def test_failed_write_aborts_upload(blobs: S3Blobs, monkeypatch):
+    monkeypatch.setattr(s3, "PART_SIZE", 5 * 1024 * 1024)
+    with pytest.raises(RuntimeError):
+        with blobs.open(address("a"), OpenMode.WRITE) as fh:
+            fh.write(os.urandom(2 * s3.PART_SIZE + 1))
+            raise RuntimeError("interrupted")
+    assert "abort_multipart_upload" in blobs.client.calls  # type: ignore
+    assert not blobs.exists(address("a"))
+    assert "Uploads" not in blobs.client.list_multipart_uploads(Bucket=BUCKET)
+
+
+def test_copy_missing(blobs: S3Blobs):
+    with pytest.raises(FileNotFoundError):
+        blobs.copy(address("missing"), address("b"))
+    with pytest.raises(FileNotFoundError):
+        blobs.rename(address("missing"), address("b"))
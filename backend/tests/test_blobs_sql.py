@@ -0,0 +1,48 @@
+import os
+
+from sqlalchemy import event
+
+from core.data.blobs.address import Address
+from core.data.blobs.base import OpenMode
+from core.data.blobs.sql import CHUNK_SIZE, SqlBlobs
+
+
+def address(name: str):
+    return Address("files", name)
+
+
+def count_queries(blobs: SqlBlobs):
+    counter = {"selects": 0}
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            counter["selects"] += 1
+    event.listen(blobs.engine, "before_cursor_execute", before_execute)
+    return counter
+
+
+def test_small_reads_keep_the_chunk(tmp_path):
+    blobs = SqlBlobs(f"sqlite:///{tmp_path / 'blobs.db'}")
+    data = os.urandom(4 * CHUNK_SIZE + 100)
+    blobs.write(address("a"), data)
+    counter = count_queries(blobs)
+    parts = []
+    with blobs.open(address("a"), OpenMode.READ) as fh:
+        while part := fh.read(512):
+            parts.append(part)
+    assert b"".join(parts) == data
+    # the object, then one query per chunk
+    assert counter["selects"] <= 1 + 5 + 1
+
+
+def test_reads_across_chunks_and_writes(tmp_path):
+    blobs = SqlBlobs(f"sqlite:///{tmp_path / 'blobs.db'}")
+    data = bytearray(os.urandom(3 * CHUNK_SIZE))
+    blobs.write(address("a"), bytes(data))
+    with blobs.open(address("a"), OpenMode.APPEND) as fh:
+        fh.seek(CHUNK_SIZE - 10)
+        assert fh.read(20) == data[CHUNK_SIZE - 10:CHUNK_SIZE + 10]
+        assert fh.read(10) == data[CHUNK_SIZE + 10:CHUNK_SIZE + 20]
+        fh.write(b"tail")
+        fh.seek(3 * CHUNK_SIZE - 2)
+        assert fh.read() == data[-2:] + b"tail"
+    assert blobs.read(address("a")) == bytes(data) + b"tail"
@@ -0,0 +1,53 @@
+import io
+import tarfile
+
+# the miniapps import the core through the app, like the server does
+import core.app.main  # noqa: F401
+from miniapps.files.previews.archives import ArchivePreview
+
+
+class CountingStream(io.BytesIO):
+    def __init__(self, data: bytes):
+        super().__init__(data)
+        self.read_size = 0
+
+    def read(self, size: int|None = -1):
+        data = super().read(size)
+        self.read_size += len(data)
+        return data
+
+
+def tar(files: dict, mode: str = "w"):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode) as tf:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tf.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+def test_open_member_of_plain_tar_seeks():
+    data = tar({"big": b"x" * 1024 * 1024, "small": b"content"})
+    index = ArchivePreview.index(io.BytesIO(data), "a.tar")
+    member = next(m for m in index.members if m.path == "small")
+    stream = CountingStream(data)
+    with ArchivePreview.open_member(stream, index, member) as reader:
+        assert reader.read() == b"content"
+    assert stream.read_size < 1024
+
+
+def test_index_of_plain_tar_seeks():
+    data = tar({"big": b"x" * 1024 * 1024, "small": b"content"})
+    stream = CountingStream(data)
+    index = ArchivePreview.index(stream, "a.tar")
+    assert [(m.path, m.size) for m in index.members] == [("big", 1024 * 1024), ("small", 7)]
+    assert stream.read_size < 64 * 1024
+
+
+def test_open_member_of_compressed_tar():
+    data = tar({"big": b"x" * 1024 * 1024, "small": b"content"}, "w:gz")
+    index = ArchivePreview.index(io.BytesIO(data), "a.tar.gz")
+    member = next(m for m in index.members if m.path == "small")
+    with ArchivePreview.open_member(io.BytesIO(data), index, member) as reader:
+        assert reader.read() == b"content"
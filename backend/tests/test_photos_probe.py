@@ -0,0 +1,41 @@
+import io
+
+import av
+import PIL.Image
+
+# the miniapps import the core through the app, like the server does
+import core.app.main  # noqa: F401
+from miniapps.photos.tools.probe import probe
+
+
+def sample(rotation: int):
+    """A 320x240 clip, white on the left half, shown rotated by the display matrix"""
+    image = PIL.Image.new("RGB", (320, 240))
+    image.paste((255, 255, 255), (0, 0, 160, 240))
+    buffer = io.BytesIO()
+    with av.open(buffer, "w", format="mp4") as container:
+        stream = container.add_stream("mpeg4", rate=10)
+        stream.width, stream.height, stream.pix_fmt = 320, 240, "yuv420p"
+        stream.set_display_rotation(rotation)
+        for _ in range(3):
+            for packet in stream.encode(av.VideoFrame.from_image(image)):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+    buffer.seek(0)
+    return buffer
+
+
+def test_probe_unrotated():
+    result, poster = probe(sample(0))
+    assert (result.width, result.height) == (320, 240)
+    assert poster is not None and poster.size == (320, 240)
+
+
+def test_probe_portrait_from_display_matrix():
+    result, poster = probe(sample(-90))
+    assert (result.width, result.height) == (240, 320)
+    assert poster is not None and poster.size == (240, 320)
+    # turned clockwise, the white left half ends up on top
+    assert poster.convert("L").getpixel((120, 40)) > 200
+    assert poster.convert("L").getpixel((120, 280)) < 50
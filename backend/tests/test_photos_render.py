@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import UUID, create_engine, event
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+
+# the miniapps import the core through the app, like the server does
+import core.app.main  # noqa: F401
+from core.http.ranges import if_none_match
+from miniapps.photos.data import PhotoRenderCache
+from miniapps.photos.tools import render
+from miniapps.photos.tools.render import RenderCache
+
+
+@compiles(UUID, "sqlite")
+def compile_uuid(type_, compiler, **kwargs):
+    return "CHAR(32)"
+
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(RenderCache, "_total", None)
+    monkeypatch.setattr(RenderCache, "_inserts", 0)
+    engine = create_engine("sqlite://")
+    PhotoRenderCache.__table__.create(engine)  # type: ignore
+    with Session(engine) as session:
+        yield session
+
+
+def count_sums(session: Session):
+    counter = {"sums": 0}
+    def before_execute(conn, cursor, statement, *args):
+        if "sum(" in statement.lower():
+            counter["sums"] += 1
+    event.listen(session.get_bind(), "before_cursor_execute", before_execute)
+    return counter
+
+
+def test_total_is_recounted_only_now_and_then(session, monkeypatch):
+    monkeypatch.setattr(render, "TOTAL_RECOUNT", 10)
+    cache = RenderCache(None, session, capacity=1000)  # type: ignore
+    counter = count_sums(session)
+    asset = SimpleNamespace(id=uuid4())
+    for i in range(20):
+        assert cache.add(asset, f"key{i}", 10) == []  # type: ignore
+    assert counter["sums"] == 2
+
+
+def test_eviction_counts_exactly(session):
+    cache = RenderCache(None, session, capacity=100)  # type: ignore
+    asset = SimpleNamespace(id=uuid4())
+    evicted = []
+    for i in range(12):
+        evicted += cache.add(asset, f"key{i}", 10)  # type: ignore
+    # the 11th render overflows the cache, which is evicted down to 90%
+    assert evicted == ["key0", "key1"]
+    assert RenderCache._total == 100
+
+
+def test_if_none_match():
+    etag = "\"a-1\""
+    assert if_none_match("\"b\", \"a-1\"", etag)
+    assert if_none_match("*", etag)
+    assert if_none_match("W/\"a-1\"", etag)
+    assert not if_none_match("\"b\"", etag)
+    assert not if_none_match(None, etag)